@@ -0,0 +1,60 @@
+"""Сравнение двух прогонов benchmarks.run.
+
+Запуск: python -m benchmarks.compare old.json new.json [--threshold 1.1]
+Код возврата 1, если какой-то бенчмарк замедлился больше порога.
+"""
+import argparse
+import json
+import sys
+
+
+def load(filename):
+    with open(filename, encoding='utf8') as file:
+        report = json.load(file)
+    return report.get('environment', {}), \
+        {(result['name'], result['size']): result['best']
+         for result in report['results']}
+
+
+def compare(old, new, threshold):
+    """Строки таблицы и число замедлившихся бенчмарков."""
+    rows = []
+    slower = 0
+    for key in sorted(old.keys() & new.keys(),
+                      key=lambda key: (key[1], key[0])):
+        ratio = new[key] / old[key] if old[key] else float('inf')
+        mark = ''
+        if ratio > threshold:
+            mark = ' slower'
+            slower += 1
+        elif ratio < 1 / threshold:
+            mark = ' faster'
+        rows.append(f'{key[0]:<16}{key[1]:>9}{old[key]:>12.4f}'
+                    f'{new[key]:>12.4f}{ratio:>8.2f}x{mark}')
+    return rows, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.compare',
+        description='compare two benchmark runs')
+    parser.add_argument('old', type=str, help='baseline json')
+    parser.add_argument('new', type=str, help='json to compare')
+    parser.add_argument(
+        '--threshold', type=float, default=1.1,
+        help='ratio new/old considered a slowdown')
+    args = parser.parse_args(argv)
+
+    old_environment, old = load(args.old)
+    new_environment, new = load(args.new)
+    print(f'old: {old_environment.get("commit")}')
+    print(f'new: {new_environment.get("commit")}')
+    print(f'{"benchmark":<16}{"size":>9}{"old, s":>12}{"new, s":>12}'
+          f'{"ratio":>9}')
+    rows, slower = compare(old, new, args.threshold)
+    print('\n'.join(rows))
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
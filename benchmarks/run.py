@@ -0,0 +1,339 @@
+"""Набор бенчмарков на синтетических сценах с выводом в JSON.
+
+Запуск: python -m benchmarks.run [--sizes 1000 10000] [--only paint pick]
+        [--repeat 3] [--seed 0] [-o results.json]
+
+Результаты разных коммитов сравниваются командой
+python -m benchmarks.compare old.json new.json
+"""
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from benchmarks.scenes import scene
+from editor.drawer import Drawer, ZBUFFER
+from editor.projection import ProjectionCache
+from source.algebra import Matrix, Matrix3, Vector3
+from source.history import History
+from source.model import Model
+
+RESOLUTION = (1280, 720)
+ORIGIN = (640, 360)
+CLICKS = 200
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Регистрирует бенчмарк: функция готовит данные и возвращает
+    замеряемую функцию без аргументов и число вызовов в ней."""
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+@benchmark('display_vector')
+def bench_display_vector(model):
+    store = model.vertices
+    vectors = [Vector3(*row) for row in store.used_coords().tolist()]
+
+    def run():
+        for vector in vectors:
+            model.display_vector(vector)
+    return run, len(vectors)
+
+
+def rotate_view(rotation, vectors):
+    """Операции с матрицей поворота вида, по разу на вершину; одинаковы
+    для Matrix3 и общего Matrix."""
+    matrix = rotation
+    for vector in vectors:
+        matrix = (matrix * rotation).transpose()
+        x, y, z = (matrix * vector).to_tuple()
+        x * vector.x + y * vector.y + z * vector.z
+
+
+@benchmark('matrix3')
+def bench_matrix3(model):
+    store = model.vertices
+    vectors = [Vector3(*row) for row in store.used_coords().tolist()]
+    rotation = Matrix3.rotation('y', math.pi / 90)
+
+    def run():
+        rotate_view(rotation, vectors)
+    return run, len(vectors)
+
+
+@benchmark('matrix_generic')
+def bench_matrix_generic(model):
+    # То же, что matrix3, через общий Matrix: видно ускорение Matrix3
+    store = model.vertices
+    vectors = [Vector3(*row) for row in store.used_coords().tolist()]
+    rotation = Matrix(3, 3, *Matrix3.rotation('y', math.pi / 90).to_tuple())
+
+    def run():
+        rotate_view(rotation, vectors)
+    return run, len(vectors)
+
+
+@benchmark('project')
+def bench_project(model):
+    def run():
+        ProjectionCache(model).update(ORIGIN, 1)
+    return run, 1
+
+
+@benchmark('depth_sort')
+def bench_depth_sort(model):
+    projection = ProjectionCache(model)
+    projection.update(ORIGIN, 1)
+    projection.update_topology()
+
+    def run():
+        projection.order = None
+        projection.depth_order()
+    return run, 1
+
+
+@benchmark('bsp_order')
+def bench_bsp_order(model):
+    drawer = Drawer(model)
+    drawer.bsp.sync(model)
+    direction = np.array(model.display_plate_basis[2].to_tuple())
+
+    def run():
+        drawer.bsp.back_to_front(direction=direction)
+    return run, 1
+
+
+def new_image():
+    return QtGui.QImage(RESOLUTION[0], RESOLUTION[1],
+                        QtGui.QImage.Format_ARGB32_Premultiplied)
+
+
+@benchmark('paint')
+def bench_paint(model):
+    image = new_image()
+
+    def run():
+        # Холодный кадр: проекции, BSP-дерево и слои строятся заново
+        with QtGui.QPainter(image) as painter:
+            Drawer(model).paint_objects(ORIGIN, 1, painter, RESOLUTION)
+    return run, 1
+
+
+@benchmark('paint_rotate')
+def bench_paint_rotate(model):
+    image = new_image()
+    drawer = Drawer(model)
+    rotation = Matrix3.rotation('y', math.pi / 90)
+    with QtGui.QPainter(image) as painter:
+        drawer.paint_objects(ORIGIN, 1, painter, RESOLUTION)
+
+    def run():
+        # Типичный кадр при повороте: вершины те же, вид новый
+        model.update_display_matrix(rotation)
+        with QtGui.QPainter(image) as painter:
+            drawer.paint_objects(ORIGIN, 1, painter, RESOLUTION)
+    return run, 1
+
+
+@benchmark('paint_perspective')
+def bench_paint_perspective(model):
+    image = new_image()
+    scene = model.snapshot()
+    scene.set_perspective(True)
+    drawer = Drawer(scene)
+    rotation = Matrix3.rotation('y', math.pi / 90)
+    with QtGui.QPainter(image) as painter:
+        drawer.paint_objects(ORIGIN, 1, painter, RESOLUTION)
+
+    def run():
+        # Тот же кадр поворота, что в paint_rotate, в перспективе
+        scene.update_display_matrix(rotation)
+        with QtGui.QPainter(image) as painter:
+            drawer.paint_objects(ORIGIN, 1, painter, RESOLUTION)
+    return run, 1
+
+
+@benchmark('paint_zbuffer')
+def bench_paint_zbuffer(model):
+    image = new_image()
+    drawer = Drawer(model, ZBUFFER)
+    rotation = Matrix3.rotation('y', math.pi / 90)
+    with QtGui.QPainter(image) as painter:
+        drawer.paint_objects(ORIGIN, 1, painter, RESOLUTION)
+
+    def run():
+        # Тот же кадр поворота, что в paint_rotate, через z-буфер
+        model.update_display_matrix(rotation)
+        with QtGui.QPainter(image) as painter:
+            drawer.paint_objects(ORIGIN, 1, painter, RESOLUTION)
+    return run, 1
+
+
+@benchmark('pick')
+def bench_pick(model):
+    from editor import editor
+    window = editor.RedactorWindow()
+    window.model = model
+    window.label.drawer = Drawer(model)
+    window.label.frame = None
+    window.update_display()
+    window.label.wait_for_frame()
+    rng = np.random.default_rng(0)
+    events = [QtGui.QMouseEvent(QtCore.QEvent.MouseMove,
+                                QtCore.QPointF(x, y), QtCore.Qt.LeftButton,
+                                QtCore.Qt.LeftButton, QtCore.Qt.NoModifier)
+              for x, y in zip(rng.integers(0, RESOLUTION[0], CLICKS),
+                              rng.integers(0, RESOLUTION[1], CLICKS))]
+
+    def run():
+        for event in events:
+            window.label.update_object_to_interact(event)
+    return run, len(events)
+
+
+@benchmark('select_transform')
+def bench_select_transform(model):
+    from editor.selection import Selection, select_rect
+    # Правится копия вершин, чтобы сцена не менялась для других замеров
+    scene = model.snapshot()
+    scene.history = History()
+    rotation = np.array(Matrix3.rotation('y', math.pi / 12).to_tuple())
+
+    def run():
+        figures = select_rect(scene, ORIGIN, 1, (0, 0), RESOLUTION)
+        selection = Selection.of(scene, figures)
+        scene.transform_vertices(selection.indices, rotation.reshape(3, 3),
+                                 selection.center(scene))
+    return run, 1
+
+
+@benchmark('save_text')
+def bench_save_text(model):
+    def run():
+        model.save(io.StringIO())
+    return run, 1
+
+
+@benchmark('open_text')
+def bench_open_text(model):
+    text = io.StringIO()
+    model.save(text)
+    data = text.getvalue()
+
+    def run():
+        Model().open(io.StringIO(data))
+    return run, 1
+
+
+@benchmark('save_binary')
+def bench_save_binary(model):
+    def run():
+        model.save_binary(io.BytesIO())
+    return run, 1
+
+
+@benchmark('open_binary')
+def bench_open_binary(model):
+    data = io.BytesIO()
+    model.save_binary(data)
+    data = data.getvalue()
+
+    def run():
+        Model().open_binary(io.BytesIO(data))
+    return run, 1
+
+
+def measure(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit or None,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'qt': QtCore.QT_VERSION_STR,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def run(sizes, names, repeat=3, seed=0, log=sys.stderr):
+    application = QtWidgets.QApplication.instance() or \
+        QtWidgets.QApplication([sys.argv[0]])
+    results = []
+    for size in sizes:
+        for name in names:
+            # Каждый бенчмарк получает свою сцену: некоторые ее меняют
+            model = scene(size, seed)
+            function, calls = BENCHMARKS[name](model)
+            times = measure(function, repeat)
+            results.append({'name': name, 'size': size, 'seed': seed,
+                            'calls': calls, 'repeat': repeat,
+                            'best': min(times),
+                            'mean': sum(times) / len(times)})
+            print(f'{name:<16}{size:>9}{min(times):>12.4f} s', file=log)
+            application.processEvents()
+    return {'environment': environment(), 'results': results}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='benchmarks on synthetic scenes')
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', metavar='N',
+        default=[1000, 10000], help='scene sizes (figures)')
+    parser.add_argument(
+        '--only', nargs='+', metavar='NAME', choices=sorted(BENCHMARKS),
+        default=list(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument(
+        '--repeat', type=int, metavar='N', default=3,
+        help='runs of every benchmark, the best one is reported')
+    parser.add_argument(
+        '--seed', type=int, metavar='N', default=0, help='scene seed')
+    parser.add_argument(
+        '-o', '--output', type=str, metavar='FILENAME',
+        help='write json here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args.sizes, args.only, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
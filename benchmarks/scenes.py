@@ -0,0 +1,68 @@
+"""Генераторы синтетических сцен для бенчмарков.
+
+Сцены воспроизводимы: одинаковые размер и seed дают одинаковую модель.
+Плоскости - небольшие плоские четырехугольники, как в реальных моделях
+(случайные четырехугольники через всю сцену пересекают друг друга и
+делают BSP-дерево квадратичным).
+"""
+import numpy as np
+
+from source.figures import Ellipse, Line, Place, Point
+from source.model import Color, Model
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+# Доли точек, отрезков, плоскостей и эллипсов среди фигур сцены
+SHARES = (0.5, 0.3, 0.15, 0.05)
+
+EXTENT = 300
+PLACE_SIZE = 20
+
+
+def generate(points, lines, places, ellipses, seed=0):
+    rng = np.random.default_rng(seed)
+    model = Model()
+    store = model.vertices
+    colors = list(Color)
+
+    point_indices = store.extend(
+        rng.uniform(-EXTENT, EXTENT, (points, 3)),
+        Color.GREEN.value, 10).tolist()
+
+    # Углы плоскостей: центр и два перпендикулярных направления
+    centers = rng.uniform(-EXTENT, EXTENT, (places, 1, 3))
+    u = rng.normal(size=(places, 3))
+    u /= np.linalg.norm(u, axis=1, keepdims=True)
+    v = np.cross(u, rng.normal(size=(places, 3)))
+    v /= np.linalg.norm(v, axis=1, keepdims=True)
+    signs = np.array([(1, 1), (1, -1), (-1, -1), (-1, 1)])
+    corners = centers + PLACE_SIZE * (
+        signs[None, :, :1] * u[:, None] + signs[None, :, 1:] * v[:, None])
+    corner_indices = store.extend(corners.reshape(-1, 3), Color.GREEN.value,
+                                  10).reshape(places, 4).tolist()
+
+    figures = [Point.from_index(store, index) for index in point_indices]
+    if point_indices:
+        ends = rng.choice(point_indices, (lines + ellipses, 2)).tolist()
+    else:
+        ends = store.extend(rng.uniform(-EXTENT, EXTENT,
+                                        (2 * (lines + ellipses), 3)),
+                            Color.GREEN.value, 10).reshape(-1, 2).tolist()
+    color_choice = rng.integers(len(colors), size=lines + places + ellipses)
+    color_choice = [colors[i] for i in color_choice.tolist()]
+    figures += [Line.from_indices(store, pair, color_choice[i])
+                for i, pair in enumerate(ends[:lines])]
+    figures += [Place.from_indices(store, indices, color_choice[lines + i])
+                for i, indices in enumerate(corner_indices)]
+    figures += [Ellipse.from_indices(store, pair,
+                                     color_choice[lines + places + i])
+                for i, pair in enumerate(ends[lines:])]
+    model.add_figures(figures)
+    return model
+
+
+def scene(size, seed=0):
+    """Сцена из size фигур всех видов в пропорциях SHARES."""
+    points, lines, places = (int(size * share) for share in SHARES[:3])
+    return generate(points, lines, places,
+                    size - points - lines - places, seed)
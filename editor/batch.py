@@ -0,0 +1,153 @@
+"""Отрисовка сохраненных моделей в PNG без окна.
+
+Файлы и углы обзора раздаются пулу процессов; в каждом процессе
+создается свое QGuiApplication с платформой offscreen.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import math
+import os
+import sys
+
+LOGGER_NAME = '3d-editor.batch'
+LOGGER = logging.getLogger(LOGGER_NAME)
+
+DEFAULT_SIZE = (1280, 720)
+
+application = None
+
+
+def init_worker():
+    global application
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtGui
+    application = QtGui.QGuiApplication.instance() or \
+        QtGui.QGuiApplication([sys.argv[0]])
+
+
+def parse_size(text):
+    try:
+        width, height = map(int, text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f'image size must be WxH: {text}')
+    if width <= 0 or height <= 0:
+        raise ValueError(f'image size must be positive: {text}')
+    return width, height
+
+
+def parse_angles(text):
+    angles = [float(angle) for angle in text.split(',') if angle.strip()]
+    if not angles:
+        raise ValueError('no view angles given')
+    return angles
+
+
+def turntable(count):
+    return [360 * i / count for i in range(count)]
+
+
+def output_name(filename, output, number, numbered):
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if numbered:
+        stem = f'{stem}_{number:03d}'
+    return os.path.join(output, stem + '.png')
+
+
+def render_views(filename, views, axis, output, size, zoom, numbered,
+                 backend='painter'):
+    """Открывает файл и рисует его для каждого вида (номер, угол в
+    градусах).
+
+    Выполняется в процессе пула; возвращает список записанных файлов.
+    """
+    if application is None:
+        init_worker()
+    from PyQt5 import QtGui
+    from editor.drawer import Drawer
+    from source import model
+
+    scene = model.load(filename)
+    plate_basis = list(scene.display_plate_basis)
+    drawer = Drawer(scene, backend)
+    image = QtGui.QImage(size[0], size[1],
+                         QtGui.QImage.Format_ARGB32_Premultiplied)
+    origin = (size[0] // 2, size[1] // 2)
+    written = []
+    for number, angle in views:
+        # Каждый вид отсчитывается от сохраненного в файле
+        scene.display_plate_basis = list(plate_basis)
+        scene.update_display_matrix(None)
+        if angle:
+            scene.rotate_view(math.radians(angle), axis)
+        painter = QtGui.QPainter(image)
+        try:
+            drawer.update_scene(painter, size, origin, zoom)
+        finally:
+            painter.end()
+        name = output_name(filename, output, number, numbered)
+        if not image.save(name, 'png'):
+            raise OSError(f'Cannot write {name}')
+        written.append(name)
+    return written
+
+
+def split_tasks(files, angles, jobs):
+    """Задачи (файл, виды): при малом числе файлов виды одного файла
+    делятся между процессами, иначе файл рисуется одним процессом."""
+    views = list(enumerate(angles))
+    chunks = max(1, min(len(views), jobs // max(len(files), 1)))
+    size = math.ceil(len(views) / chunks)
+    return [(filename, views[i:i + size])
+            for filename in files
+            for i in range(0, len(views), size)]
+
+
+def run(files, output='.', angles=(0,), axis='y', size=DEFAULT_SIZE,
+        zoom=1, jobs=None, backend='painter'):
+    """Рисует все файлы под всеми углами; возвращает число ошибок."""
+    jobs = jobs or os.cpu_count() or 1
+    angles = list(angles)
+    if jobs < 1:
+        raise ValueError(f'jobs must be positive: {jobs}')
+    if not angles:
+        raise ValueError('no view angles given')
+    numbered = len(angles) > 1
+    os.makedirs(output, exist_ok=True)
+    tasks = split_tasks(files, angles, jobs)
+    errors = 0
+    if jobs == 1:
+        for filename, chunk in tasks:
+            try:
+                for name in render_views(filename, chunk, axis, output,
+                                         size, zoom, numbered, backend):
+                    LOGGER.info('%s has been rendered', name)
+            except Exception as e:
+                errors += 1
+                LOGGER.error('Error: %s: %s', filename, e)
+                print(f'{filename}: {e}', file=sys.stderr)
+        return errors
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=init_worker) as pool:
+        futures = {pool.submit(render_views, filename, chunk, axis, output,
+                               size, zoom, numbered, backend): filename
+                   for filename, chunk in tasks}
+        for future in as_completed(futures):
+            try:
+                for name in future.result():
+                    LOGGER.info('%s has been rendered', name)
+            except Exception as e:
+                errors += 1
+                LOGGER.error('Error: %s: %s', futures[future], e)
+                print(f'{futures[future]}: {e}', file=sys.stderr)
+    return errors
+
+
+def main(args):
+    # Аргументы уже разобраны и проверены в main.py
+    if args.angles is not None:
+        angles = args.angles
+    else:
+        angles = turntable(args.turntable)
+    return run(args.files, args.output, angles, args.axis,
+               args.size, args.zoom, args.jobs, args.backend)
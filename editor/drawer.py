@@ -1,13 +1,36 @@
 from source.figures import *
 from PyQt5 import QtGui, QtCore
 from enum import Enum
+import itertools
 import logging
 
-from source.model import Model
+import numpy as np
+
+from source.bsp import BSPTree
+from editor.projection import (ELLIPSE, FragmentProjection, LINE, PLACE,
+                               POINT, ProjectionCache)
+from editor.layers import LayerCache
+from editor.profiling import FrameStats
+from editor import raster
+from editor.spatial_index import ScreenGrid, query_grids
 
 LOGGER_NAME = '3d-editor.drawer'
 LOGGER = logging.getLogger(LOGGER_NAME)
 
+# Запас вокруг экрана при отсечении: толщина линий и размер точек
+CULL_MARGIN = 16
+
+# Способы отрисовки фигур: алгоритм художника на QPainter и программный
+# z-буфер (editor.raster)
+PAINTER = 'painter'
+ZBUFFER = 'zbuffer'
+BACKENDS = (PAINTER, ZBUFFER)
+
+PEN_WIDTH = 5
+# Сдвиг глубины обводок, прямых и точек к наблюдателю в z-буфере: ребро
+# плоскости видно поверх нее самой
+DEPTH_BIAS = 0.5
+
 
 class Color(Enum):
     BLACK = 0
@@ -24,6 +47,11 @@ COLORS = {
     Color.YELLOW: QtCore.Qt.yellow,
     Color.BLUE: QtCore.Qt.blue}
 
+# Цвета для z-буфера: номер цвета -> 0xAARRGGBB, и цвет заливки
+PALETTE = np.array([raster.argb(COLORS[color]) for color in Color],
+                   dtype=np.uint32)
+FILL = raster.argb(QtGui.QColor(230, 102, 30))
+
 
 def set_painter_params(painter, pen_color=QtGui.QColor(230, 102, 0),
                        pen_width=5, pen_style=QtCore.Qt.SolidLine,
@@ -33,11 +61,74 @@ def set_painter_params(painter, pen_color=QtGui.QColor(230, 102, 0),
     painter.setBrush(QtGui.QBrush(brush_color, brush_style))
 
 
+# Поле вокруг точки в спрайте: половина толщины пера с запасом
+SPRITE_PAD = 4
+
+
+class Styles:
+    """Перья, кисти и спрайты точек, созданные один раз на стиль.
+
+    Перо и кисть ставятся на QPainter, только когда стиль меняется;
+    reset() вызывается перед рисованием новым QPainter.
+    """
+
+    def __init__(self):
+        self.pens = {color: QtGui.QPen(COLORS[color], 5, QtCore.Qt.SolidLine)
+                     for color in Color}
+        # Заливка по умолчанию (как в set_painter_params) и прозрачная
+        self.brushes = {True: QtGui.QBrush(QtGui.QColor(230, 102, 30)),
+                        False: QtGui.QBrush(QtGui.QColor(0, 0, 0, 0))}
+        self.sprites = {}
+        self.current = None
+
+    def reset(self):
+        self.current = None
+
+    def apply(self, painter, color, fill=True):
+        key = (color, fill)
+        if key != self.current:
+            painter.setPen(self.pens[color])
+            painter.setBrush(self.brushes[fill])
+            self.current = key
+
+    def sprite(self, color, width):
+        """Точка цвета color и размера width, нарисованная в QImage так
+        же, как paint_point рисовал ее прямо на сцене."""
+        key = (color, width)
+        if key not in self.sprites:
+            size = width + 2 * SPRITE_PAD
+            image = QtGui.QImage(size, size,
+                                 QtGui.QImage.Format_ARGB32_Premultiplied)
+            image.fill(QtCore.Qt.transparent)
+            with QtGui.QPainter(image) as painter:
+                set_painter_params(painter, pen_color=COLORS[color],
+                                   brush_color=COLORS[color])
+                painter.drawEllipse(SPRITE_PAD, SPRITE_PAD, width, width)
+            self.sprites[key] = image
+        return self.sprites[key]
+
+
 class Drawer:
-    def __init__(self, model):
+    def __init__(self, model, backend=PAINTER):
         self.model = model
-        self.displayed_objects = []
-        self.points_display_table = {}
+        self.backend = backend
+        # Нарисованные объекты по сеткам выбора (параллельно grids)
+        self.displayed = []
+        self.grids = []
+        self.layers = LayerCache()
+        self.active = None
+        self.active_key = None
+        self.active_mask = None
+        self.active_vertices = None
+        self.static_objects = []
+        self.static_grid = ScreenGrid()
+        self.static_end = 0
+        self.stats = FrameStats()
+        self.projection = ProjectionCache(model)
+        self.bsp = BSPTree()
+        self.fragments = FragmentProjection(model, self.bsp)
+        self.styles = Styles()
+        self.zbuffer = raster.ZBuffer()
 
         self.point_color = Color.GREEN
         self.line_color = Color.BLACK
@@ -49,143 +140,511 @@ class Drawer:
         self.axiss_width = 3
 
         self.draw_table = {
-            Point: self.paint_point,
-            Line: self.paint_line,
-            Place: self.paint_place,
-            Ellipse: self.paint_ellipse
+            POINT: self.paint_points,
+            LINE: self.paint_lines,
+            PLACE: self.paint_places,
+            ELLIPSE: self.paint_ellipses
+        }
+        self.raster_table = {
+            PLACE: self.raster_places,
+            ELLIPSE: self.raster_ellipses,
+            LINE: self.raster_lines,
+            POINT: self.raster_points
         }
 
-    def update_scene(self, painter, resolution, split_coordinates, zoom):
-        set_painter_params(painter)
-        painter.fillRect(
-            0, 0, resolution[0], resolution[1],
-            QtGui.QGradient.Preset(self.scene_style_preset))
-
-        self.draw_coordinates_system(painter)
-
-        self.displayed_objects = []
-        self.paint_objects(
-            split_coordinates, zoom, painter)
-
-    def paint_objects(self, split_coordinates, zoom, painter):
-        for obj in self.model.figures:
-            if isinstance(obj, Point):
-                display_coord = self.model.display_vector(
-                    obj.to_vector3())
-                self.points_display_table[obj] = (int(display_coord[0] * zoom +
-                                                      split_coordinates[0]),
-                                                  int(display_coord[1] * zoom +
-                                                      split_coordinates[1]))
-                self.draw_table[type(obj)](obj, painter)
-                self.displayed_objects.append(obj)
-
-        sorted_figures = sorted(self.model.figures,
-                                key=lambda fig: fig.distance_to_viewer(self.model))
-        #if len(sorted_figures) > 0:
-            #self.check_sorted_places(sorted_figures)
-        sorted_figures.reverse()
-
-        for obj in sorted_figures:
-            self.draw_table[type(obj)](obj, painter)
-            self.displayed_objects.append(obj)
-
-    #алгоритм Ньэлла для сортировки плоскостей, но он только ухудшил первую сортировку по z
-    def check_sorted_places(self, sorted_figures):
-        places = []
-        copy_places = []
-        for obj in sorted_figures:
-            if isinstance(obj, Place):
-                fl_wasnt_insert = True
-                for place in places:
-                    if not fl_wasnt_insert:
-                        copy_places.append(place)
-                        continue
-                    if Model.check_overlap(place.points, obj.points):
-                        copy_places.append(obj)
-                        copy_places.append(place)
-                        fl_wasnt_insert = False
-                        continue
-                    copy_places.append(place)
-                if fl_wasnt_insert:
-                    copy_places.append(obj)
-                places = copy_places
-                copy_places = []
-        for i in range(len(sorted_figures)):
-            if isinstance(sorted_figures[i], Place):
-                sorted_figures[i] = places.pop(0)
-
-    def paint_point(self, point, painter):
-        color = Color(point.color.value)
-        set_painter_params(painter, pen_color=COLORS[color],
-                           brush_color=COLORS[color])
-        painter.drawEllipse(int(self.points_display_table[point][0] -
-                                point.WIDTH / 2),
-                            int(self.points_display_table[point][1] -
-                                point.WIDTH / 2),
-                            point.WIDTH, point.WIDTH)
-
-    def paint_line(self, line, painter):
-        color = Color(line.color.value)
-        set_painter_params(painter, pen_color=COLORS[color])
-        painter.pen().setWidth(line.WIDTH)
-        painter.drawLine(
-            *self.points_display_table[line.start],
-            *self.points_display_table[line.end])
-
-    def paint_place(self, place, painter):
-        color = Color(place.color.value)
-        set_painter_params(painter, pen_color=COLORS[color])
-        painter.pen().setWidth(place.WIDTH)
-        painter.drawConvexPolygon(
-            *[QtCore.QPointF(*self.points_display_table[point])
-              for point in place.points])
-
-    def paint_ellipse(self, ellipse, painter):
-        color = Color(ellipse.color.value)
-        set_painter_params(painter, pen_color=COLORS[color])
-        painter.pen().setWidth(ellipse.WIDTH)
-
-        p1 = QtCore.QPoint(*self.points_display_table[ellipse.topLeft])
-        p2 = QtCore.QPoint(*self.points_display_table[ellipse.bottomRight])
-        rect1 = QtCore.QRect(p1, p2)
-        rect2 = QtCore.QRect(p1, p2)
-        rect3 = QtCore.QRect(p1, p2)
-
-        if not ellipse.rx:
-            ellipse.set_move_info(rect1.width() // 2,
-                                  rect1.height() // 2)
-        painter.drawEllipse(rect1)
-
-        if abs(rect2.height()) < abs(ellipse.ry // 2):
-            rect2.setHeight(ellipse.ry // 2)
-        rect2.setWidth(ellipse.rx // 2)
-        if len(ellipse.extra_el) < 2:
-            ellipse.add_extra_el(Ellipse(rect2.topLeft(),
-                                         rect2.bottomRight(),
-                                         ellipse.color))
-        self.paint_extra_ellipse(rect2, rect1, color, painter)
-
-        if abs(rect3.width()) < abs(ellipse.rx // 2):
-            rect3.setWidth(ellipse.rx // 2)
-        rect3.setHeight(ellipse.ry // 2)
-        if len(ellipse.extra_el) < 2:
-            ellipse.add_extra_el(Ellipse(rect3.topLeft(),
-                                         rect3.bottomRight(),
-                                         ellipse.color))
-        self.paint_extra_ellipse(rect3, rect1, color, painter)
-
-        set_painter_params(painter, pen_color=COLORS[color],
-                           brush_color=QtGui.QColor(0, 0, 0, 0))
-        painter.drawEllipse(rect2)
-
-    def paint_extra_ellipse(self, rect, rect_base, color, painter):
-        center = rect_base.center()
-        if abs(rect.width()) <= abs(rect_base.width()) and \
-                abs(rect.height()) <= abs(rect_base.height()):
-            set_painter_params(painter, pen_color=COLORS[color],
-                               brush_color=QtGui.QColor(0, 0, 0, 0))
-        rect.moveCenter(center)
-        painter.drawEllipse(rect)
+    def set_model(self, model):
+        self.model = model
+        self.projection.model = model
+        self.fragments.model = model
+
+    def set_active(self, obj):
+        """Объект, который сейчас редактируется: он и фигуры с общими
+        вершинами рисуются поверх закэшированного слоя каждый кадр."""
+        self.active = obj
+
+    def update_scene(self, painter, resolution, split_coordinates, zoom,
+                     stats=None):
+        stats = stats or FrameStats()
+        key = (tuple(resolution), self.scene_style_preset)
+        if not self.layers.background.valid(key):
+            with stats.stage('background'), \
+                    self.layers.background.begin(resolution, key) as layer:
+                set_painter_params(layer)
+                layer.fillRect(
+                    0, 0, resolution[0], resolution[1],
+                    QtGui.QGradient.Preset(self.scene_style_preset))
+
+        key = (tuple(resolution), self.model.display_version)
+        if not self.layers.axes.valid(key):
+            with stats.stage('axes'), \
+                    self.layers.axes.begin(resolution, key) as layer:
+                set_painter_params(layer)
+                self.draw_coordinates_system(layer)
+
+        self.paint_objects(split_coordinates, zoom, painter, resolution,
+                           stats)
+
+    def paint_objects(self, split_coordinates, zoom, painter,
+                      resolution=None, stats=None):
+        """Рисует фигуры; время этапов и счетчики кадра остаются в
+        self.stats."""
+        self.stats = stats = stats or FrameStats()
+        if resolution is None:
+            resolution = (painter.device().width(),
+                          painter.device().height())
+        with stats.stage('project'):
+            changed = self.projection.update(split_coordinates, zoom)
+            self.projection.update_ellipses()
+            self.update_active()
+        stats.count('projected', self.projection.projected_count)
+        stats.count('ellipse_meshes', self.projection.ellipses.built_count)
+        stats.count('drawn', 0)
+        stats.count('culled', 0)
+        if self.backend == ZBUFFER:
+            self.paint_zbuffer(painter, resolution)
+            return
+
+        key = (tuple(resolution), self.projection.view,
+               self.model.display_version, self.model.figures_version,
+               self.active_key)
+        moved = len(changed) and (self.active_vertices is None or
+                                  not self.active_vertices[changed].all())
+        if moved or not self.layers.figures.valid(key):
+            self.static_objects = []
+            self.static_grid = ScreenGrid()
+            with stats.stage('paint'), \
+                    self.layers.figures.begin(resolution, key) as layer:
+                self.static_end = self.paint_figures(
+                    layer, resolution, self.static_objects,
+                    self.static_grid, len(self.model.figures),
+                    exclude=True)
+
+        with stats.stage('compose'):
+            self.layers.compose(painter)
+        # Объекты закэшированного слоя не копируются: активный проход
+        # собирает свои в отдельный список
+        self.displayed = [self.static_objects]
+        self.grids = [self.static_grid]
+        if self.active_mask is not None:
+            active_objects = []
+            active_grid = ScreenGrid()
+            with stats.stage('paint'):
+                self.paint_figures(painter, resolution, active_objects,
+                                   active_grid, self.static_end,
+                                   exclude=False)
+            self.displayed.append(active_objects)
+            self.grids.append(active_grid)
+
+    @property
+    def displayed_objects(self):
+        """Нарисованные объекты всех сеток выбора."""
+        return list(itertools.chain.from_iterable(self.displayed))
+
+    def paint_zbuffer(self, painter, resolution):
+        """Рисует все видимые фигуры заново в z-буфер: пересекающиеся
+        плоскости видны правильно. Слой фигур и активный проход здесь не
+        нужны, сетка выбора строится так же, как у художника."""
+        stats = self.stats
+        kinds = self.projection.figure_kinds
+        visible = self.projection.visible(resolution, CULL_MARGIN)
+        stats.count('culled', int(np.count_nonzero(~visible)))
+        with stats.stage('raster'):
+            self.zbuffer.clear(resolution)
+            for kind, draw in self.raster_table.items():
+                positions = np.flatnonzero(visible & (kinds == kind))
+                if len(positions):
+                    draw(positions)
+        stats.count('fragments', self.zbuffer.fragments)
+        with stats.stage('compose'):
+            self.layers.compose(painter, figures=False)
+            painter.drawImage(0, 0, self.zbuffer.image())
+
+        # Приоритеты выбора как в paint_figures: точки - по номеру,
+        # остальные фигуры - от дальних к ближним после всех номеров
+        figures = self.model.figures
+        lows, highs = self.projection.figure_bounds()
+        order = self.projection.depth_order()
+        objects = []
+        grid = ScreenGrid()
+        for i in np.flatnonzero(visible & (kinds == POINT)).tolist():
+            self.add_displayed_object(objects, grid, figures[i], lows[i],
+                                      highs[i], i)
+        order = order[visible[order] & (kinds[order] != POINT)].tolist()
+        for priority, i in enumerate(order, len(figures)):
+            self.add_displayed_object(objects, grid, figures[i], lows[i],
+                                      highs[i], priority)
+        self.displayed = [objects]
+        self.grids = [grid]
+        stats.count('drawn', len(objects))
+
+    def raster_screen(self, display):
+        """Экранные координаты без округления для z-буфера."""
+        view = self.projection.view
+        return display[..., :2] * view[2] + np.asarray(view[:2], dtype=float)
+
+    def figure_colors(self, positions):
+        figures = self.model.figures
+        return PALETTE[np.fromiter((figures[i].color.value
+                                    for i in positions.tolist()),
+                                   dtype=np.intp, count=len(positions))]
+
+    def raster_points(self, positions):
+        store = self.model.vertices
+        vertices = self.projection.figure_indices[
+            self.projection.figure_offsets[positions]]
+        display = self.projection.display[vertices]
+        centers = self.raster_screen(display)
+        colors = PALETTE[store.colors[vertices]]
+        widths = store.widths[vertices]
+        # Спрайт точки - круг размера width, обведенный пером
+        for width in np.unique(widths).tolist():
+            same = widths == width
+            self.zbuffer.draw_discs(centers[same],
+                                    display[same, 2] - DEPTH_BIAS,
+                                    colors[same], width + PEN_WIDTH)
+
+    def raster_lines(self, positions):
+        projection = self.projection
+        clipped = projection.clipped_display
+        cut = np.isin(positions, list(clipped))
+        whole = positions[~cut]
+        ends = projection.figure_indices[
+            projection.figure_offsets[whole][:, None] + (0, 1)]
+        display = projection.display[ends]
+        if cut.any():
+            display = np.concatenate(
+                [display] + [clipped[i][None]
+                             for i in positions[cut].tolist()])
+        self.raster_segments(display[:, 0], display[:, 1],
+                             self.figure_colors(np.concatenate(
+                                 (whole, positions[cut]))))
+
+    def raster_places(self, positions):
+        projection = self.projection
+        clipped = projection.clipped_display
+        cut = np.isin(positions, list(clipped))
+        whole = positions[~cut]
+        offsets = projection.figure_offsets
+        lengths = np.diff(np.append(offsets, len(projection.figure_indices)))
+        owners, local = raster.expand(lengths[whole])
+        display = projection.display[projection.figure_indices[
+            offsets[whole][owners] + local]]
+        lengths = lengths[whole]
+        if cut.any():
+            polygons = [clipped[i] for i in positions[cut].tolist()]
+            display = np.concatenate([display] + polygons)
+            lengths = np.append(lengths, [len(polygon)
+                                          for polygon in polygons])
+        self.raster_polygons(self.raster_screen(display), display[:, 2],
+                             lengths, self.figure_colors(np.concatenate(
+                                 (whole, positions[cut]))))
+
+    def raster_ellipses(self, positions):
+        """Эллипсоид закрашивается по глубине его передней поверхности;
+        контур и видимые половины колец обводятся по ней же."""
+        ellipses = self.projection.ellipses
+        rows = np.searchsorted(ellipses.positions, positions)
+        colors = self.figure_colors(positions)
+        centers = ellipses.screen_centers[rows]
+        surfaces = ellipses.surfaces[rows]
+        self.zbuffer.fill_ellipsoids(
+            centers, ellipses.forms[rows], surfaces,
+            np.full(len(rows), FILL, dtype=np.uint32))
+
+        outline = ellipses.outline[rows]
+        starts = [outline.reshape(-1, 2)]
+        ends = [np.roll(outline, -1, axis=1).reshape(-1, 2)]
+        owners = [np.repeat(np.arange(len(rows)), outline.shape[1])]
+        for k, row in enumerate(rows.tolist()):
+            for arc in ellipses.front_arcs(row):
+                arc = np.array(arc).reshape(-1, 2)
+                starts.append(arc[:-1])
+                ends.append(arc[1:])
+                owners.append(np.full(len(arc) - 1, k))
+        owners = np.concatenate(owners)
+        corners = raster.segment_corners(
+            np.concatenate(starts).astype(float),
+            np.concatenate(ends).astype(float), PEN_WIDTH)
+        # Отрезки колец - хорды, поэтому их глубина берется не по концам,
+        # а по поверхности в каждом пикселе
+        surfaces = surfaces.copy()
+        surfaces[:, 0] -= DEPTH_BIAS
+        self.zbuffer.fill_convex(
+            corners, lambda segments, lines: raster.surface_rows(
+                centers, surfaces, owners[segments], lines),
+            colors[owners])
+
+    def raster_segments(self, starts, ends, colors):
+        """Отрезки между точками вида starts и ends (S, 3)."""
+        self.zbuffer.draw_segments(
+            self.raster_screen(starts), self.raster_screen(ends),
+            np.stack((starts[:, 2], ends[:, 2]), axis=1) - DEPTH_BIAS,
+            colors, PEN_WIDTH)
+
+    def raster_polygons(self, screen, depths, lengths, colors):
+        """Выпуклые многоугольники с заливкой и обводкой цвета colors:
+        вершины всех многоугольников идут подряд в screen (V, 2) и
+        depths (V,), lengths - числа их вершин."""
+        offsets = np.cumsum(lengths) - lengths
+        owners, local = raster.expand(lengths - 2)
+        first = offsets[owners]
+        triangles = np.stack((first, first + local + 1, first + local + 2),
+                             axis=1)
+        self.zbuffer.fill_triangles(
+            screen[triangles], depths[triangles],
+            np.full(len(triangles), FILL, dtype=np.uint32))
+        owners, local = raster.expand(lengths)
+        starts = offsets[owners] + local
+        ends = offsets[owners] + (local + 1) % lengths[owners]
+        self.zbuffer.draw_segments(
+            screen[starts], screen[ends],
+            np.stack((depths[starts], depths[ends]), axis=1) - DEPTH_BIAS,
+            colors[owners], PEN_WIDTH)
+
+    def update_active(self):
+        key = (id(self.active), self.model.figures_version) \
+            if self.active is not None else None
+        if key == self.active_key:
+            return
+        self.active_key = key
+        self.active_mask = self.active_vertices = None
+        if key is None:
+            return
+        self.projection.update_topology()
+        self.active_vertices = np.zeros(self.model.vertices.size,
+                                        dtype=bool)
+        self.active_vertices[self.active.indices] = True
+        indices = self.projection.figure_indices
+        offsets = self.projection.figure_offsets
+        if not len(offsets):
+            return
+        self.active_mask = np.logical_or.reduceat(
+            self.active_vertices[indices], offsets)
+        lengths = np.diff(np.append(offsets, len(indices)))
+        # Вершины всех затронутых фигур тоже считаются активными
+        self.active_vertices[indices[np.repeat(self.active_mask,
+                                               lengths)]] = True
+
+    def paint_figures(self, painter, resolution, displayed_objects, grid,
+                      start, exclude):
+        """Рисует фигуры от дальних к ближним.
+
+        exclude=True - все, кроме активных, exclude=False - только
+        активные. Фигуры за пределами экрана не рисуются и не попадают в
+        сетку выбора. Точки получают приоритет выбора по номеру в модели,
+        остальные фигуры - start и далее в порядке отрисовки; возвращает
+        следующий свободный приоритет.
+        """
+        figures = self.model.figures
+        lows, highs = self.projection.figure_bounds()
+        kinds = self.projection.figure_kinds
+        selected = np.ones(len(figures), dtype=bool)
+        if self.active_mask is not None:
+            selected = self.active_mask != exclude
+        visible = self.projection.visible(resolution, CULL_MARGIN)
+        self.stats.count('culled',
+                         int(np.count_nonzero(selected & ~visible)))
+        selected &= visible
+
+        # Точки рисуются в общем порядке по глубине, здесь они только
+        # попадают в сетку выбора со своим приоритетом
+        drawn = 0
+        for i in np.flatnonzero(selected & (kinds == POINT)).tolist():
+            self.add_displayed_object(displayed_objects, grid, figures[i],
+                                      lows[i], highs[i], i)
+            drawn += 1
+
+        with self.stats.stage('sort'):
+            if exclude:
+                self.bsp.sync(self.model)
+                self.fragments.update(self.projection.view)
+                items = list(self.depth_sorted_items(selected))
+            else:
+                order = self.projection.depth_order()
+                items = [(i, None) for i in order[selected[order]].tolist()]
+        # Подряд идущие фигуры одного вида и цвета рисуются одной пачкой:
+        # порядок по глубине сохраняется, а перо меняется только между
+        # пачками
+        self.styles.reset()
+        styles = self.figure_styles(kinds, np.flatnonzero(selected))
+        batch = []
+        batch_style = None
+        batches = 0
+        places = set()
+        priority = start
+        for i, item in items:
+            style = styles[i]
+            if style != batch_style:
+                if batch:
+                    self.draw_table[batch_style[0]](painter, batch,
+                                                    batch_style)
+                    batches += 1
+                batch = []
+                batch_style = style
+            batch.append((i, item))
+            if item is not None:
+                if i in places:
+                    continue
+                places.add(i)
+            elif style[0] == POINT:
+                continue
+            self.add_displayed_object(displayed_objects, grid, figures[i],
+                                      lows[i], highs[i], priority)
+            priority += 1
+            drawn += 1
+        if batch:
+            self.draw_table[batch_style[0]](painter, batch, batch_style)
+            batches += 1
+        self.stats.count('drawn', drawn)
+        self.stats.count('batches', batches)
+        return priority
+
+    def figure_styles(self, kinds, positions):
+        """Стили фигур positions для группировки в пачки: (вид, цвет) и
+        для точек еще размер. Словарь по номеру фигуры: в активном
+        проходе это только перетаскиваемые фигуры."""
+        store = self.model.vertices
+        figures = self.model.figures
+        first = self.projection.figure_indices[
+            self.projection.figure_offsets[positions]]
+        colors = store.colors[first].tolist()
+        widths = store.widths[first].tolist()
+        return {i: (POINT, Color(color), width) if kind == POINT
+                else (kind, Color(figures[i].color.value))
+                for i, kind, color, width in zip(
+                    positions.tolist(), kinds[positions].tolist(), colors,
+                    widths)}
+
+    def depth_sorted_items(self, selected):
+        """Выбранные фигуры от дальних к ближним: плоскости берутся
+        фрагментами в порядке обхода BSP-дерева, остальные фигуры - по
+        глубине, и обе последовательности сливаются по глубине."""
+        order = self.projection.depth_order()
+        order = order[selected[order] &
+                      (self.projection.figure_kinds[order] != PLACE)]
+        order = order.tolist()
+        depths = self.projection.depths
+        positions = self.bsp.positions
+        if self.model.perspective:
+            fragments = self.bsp.back_to_front(eye=self.model.viewer_eye())
+        else:
+            a = self.model.display_plate_basis[2]
+            fragments = self.bsp.back_to_front(
+                direction=np.array((a.x, a.y, a.z)))
+        hidden = self.fragments.hidden
+        if hidden:
+            fragments = [fragment for fragment in fragments
+                         if id(fragment) not in hidden]
+        fragment_depths = self.fragments.depths
+        # Обход BSP-дерева не упорядочен по глубине, поэтому невидимые
+        # фрагменты отбрасываются после слияния, иначе изменился бы
+        # порядок остальных фигур
+        i = j = 0
+        while i < len(order) or j < len(fragments):
+            if j == len(fragments) or (
+                    i < len(order) and
+                    depths[order[i]] >= fragment_depths[id(fragments[j])]):
+                yield order[i], None
+                i += 1
+            else:
+                position = positions[id(fragments[j].place)]
+                if selected[position]:
+                    yield position, fragments[j]
+                j += 1
+
+    def add_displayed_object(self, displayed_objects, grid, obj, low, high,
+                             priority):
+        left, top = int(low[0]), int(low[1])
+        right, bottom = int(high[0]), int(high[1])
+        margin = 0
+        if isinstance(obj, Point):
+            margin = obj.WIDTH
+        elif isinstance(obj, Line):
+            # Точки, для которых сумма расстояний до концов превышает
+            # длину меньше чем на WIDTH, лежат внутри эллипса с фокусами
+            # в концах отрезка
+            length = ((right - left) ** 2 + (bottom - top) ** 2) ** 0.5
+            margin = max(obj.WIDTH,
+                         (2 * length * obj.WIDTH + obj.WIDTH ** 2) ** 0.5)
+        displayed_objects.append(obj)
+        grid.insert(obj, left - margin, top - margin,
+                    right + margin, bottom + margin, priority)
+
+    def query(self, x, y):
+        return query_grids(self.grids, x, y)
+
+    def screen_position(self, index):
+        return self.projection.screen_position(index)
+
+    def paint_points(self, painter, batch, style):
+        _, color, width = style
+        vertices = self.projection.figure_indices[
+            self.projection.figure_offsets[[i for i, _ in batch]]]
+        # Левый верхний угол как у drawEllipse(int(x - width / 2), ...)
+        corners = (self.projection.screen[vertices] - width / 2).astype(int)
+        corners -= SPRITE_PAD
+        sprite = self.styles.sprite(color, width)
+        draw = painter.drawImage
+        for x, y in corners.tolist():
+            draw(x, y, sprite)
+
+    def paint_lines(self, painter, batch, style):
+        self.styles.apply(painter, style[1])
+        starts = self.projection.figure_offsets[[i for i, _ in batch]]
+        ends = self.projection.figure_indices[starts[:, None] + (0, 1)]
+        segments = self.projection.screen[ends]
+        clipped = self.projection.clipped
+        if clipped:
+            # Прямые, пересекающие ближнюю плоскость, рисуются обрезанными
+            for k, (i, _) in enumerate(batch):
+                if i in clipped:
+                    segments[k] = clipped[i]
+        painter.drawLines(QtGui.QPolygon(segments.ravel().tolist()))
+
+    def paint_places(self, painter, batch, style):
+        self.styles.apply(painter, style[1])
+        figures = self.model.figures
+        for i, fragment in batch:
+            if fragment is not None:
+                self.paint_fragment(fragment, painter)
+            else:
+                self.paint_place(i, figures[i], painter)
+
+    def paint_ellipses(self, painter, batch, style):
+        color = style[1]
+        ellipses = self.projection.ellipses
+        rows = ellipses.rows
+        figures = self.model.figures
+        for i, _ in batch:
+            row = rows[id(figures[i])]
+            # Контур с заливкой, поверх него - видимые половины колец
+            self.styles.apply(painter, color)
+            painter.drawConvexPolygon(QtGui.QPolygon(
+                ellipses.outline[row].ravel().tolist()))
+            self.styles.apply(painter, color, fill=False)
+            for arc in ellipses.front_arcs(row):
+                painter.drawPolyline(QtGui.QPolygon(arc))
+
+    def paint_place(self, position, place, painter):
+        screen = self.projection.clipped.get(position)
+        if screen is None:
+            screen = self.projection.screen[place.indices]
+        painter.drawConvexPolygon(QtGui.QPolygon(screen.ravel().tolist()))
+
+    def paint_fragment(self, fragment, painter):
+        polygon = QtGui.QPolygon(self.fragments.polygon(fragment))
+        edges = self.fragments.edges(fragment)
+        if edges.all():
+            painter.drawConvexPolygon(polygon)
+            return
+        # Ребра разреза не обводятся, чтобы не было видно швов
+        pen = painter.pen()
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.drawConvexPolygon(polygon)
+        painter.setPen(pen)
+        size = polygon.size()
+        for k in np.flatnonzero(edges).tolist():
+            painter.drawLine(polygon.point(k), polygon.point((k + 1) % size))
 
     def draw_coordinates_system(self, painter):
         width = 5
@@ -207,10 +666,8 @@ class Drawer:
 
     def draw_axis(self, painter, basis_vector, display_origin):
         width = 5
-        temp_point = Point(basis_vector.x * self.axiss_size,
-                           basis_vector.y * self.axiss_size,
-                           basis_vector.z * self.axiss_size)
-        display_coord = self.model.display_vector(temp_point.to_vector3())
+        display_coord = self.model.display_vector(
+            basis_vector * self.axiss_size)
         display_coord = (int(display_coord[0] + 1200),
                          int(display_coord[1] + 60))
         painter.drawEllipse(int(display_coord[0] - width / 2),
@@ -1,27 +1,47 @@
 import time
 
 from PyQt5 import QtGui, QtWidgets, QtCore
-from PyQt5.QtCore import QPoint
 
-from source import model
+from source import binary_format, journal, model
+from source.history import DEFAULT_MEMORY, History
 from source.algebra import *
 from source.figures import *
-from editor.drawer import Drawer
+from editor.drawer import Drawer, PAINTER, ZBUFFER
+from editor.loader import ModelLoader
+from editor.profiling import (FrameStats, log_frame, PROFILE_FILE,
+                              PROFILE_FRAMES)
+from editor.render import Renderer
+from editor.saver import AUTOSAVE_FILE, AUTOSAVE_INTERVAL, ModelSaver
+from editor.scheduler import DEFAULT_FPS, FrameScheduler
+from editor.selection import (screen_coords, select_lasso, select_rect,
+                              Selection)
 import math
 from enum import Enum
 import logging
+import os
 import sys
 
+import numpy as np
+
 RESOLUTION = (1280, 720)
 
 LOGGER_NAME = '3d-editor.editor'
 LOGGER = logging.getLogger(LOGGER_NAME)
 
 ERROR_DRAW_OBJ = 6
-ERROR_SAVE = 7
 ERROR_SCREEN = 8
 ERROR_OPEN = 9
 
+# Поворот вида при перетаскивании правой кнопкой, радиан на пиксель
+TRACKBALL_SPEED = math.pi / 360
+
+# Шаг поворота и масштаба выделения
+SELECTION_ANGLE = math.pi / 12
+SELECTION_SCALE = 1.1
+# Точки лассо ставятся не чаще, чем через столько пикселей
+LASSO_STEP = 4
+SELECTION_COLOR = QtGui.QColor(255, 140, 0)
+
 
 class Mode(Enum):
     VIEW = 0
@@ -47,7 +67,7 @@ def get_distance(x0, y0, x1, y1):
 
 
 class SceneWindow(QtWidgets.QLabel):
-    def __init__(self, window):
+    def __init__(self, window, fps=DEFAULT_FPS):
         super().__init__(window)
 
         canvas = QtGui.QPixmap(RESOLUTION[0], RESOLUTION[1])
@@ -62,23 +82,103 @@ class SceneWindow(QtWidgets.QLabel):
         self.forget_object_delay = 0.05
 
         self.object_to_interact = None
+        # Выделенные в режиме Edit фигуры и рамка (или лассо), которой
+        # их сейчас выделяют: список точек экрана
+        self.selection = Selection()
+        self.band = None
+        self.lasso = False
         self.model = None
         self.drawer = None
+        self.frame = None
 
         self.origin_coordinates = [640, 360]
 
+        # Наложение со временем этапов кадра и время выбора объектов,
+        # накопленное до следующего кадра
+        self.show_stats = False
+        self.pick_time = 0
+
+        self.renderer = Renderer(RESOLUTION, self)
+        self.renderer.frame_ready.connect(self.show_frame)
+        self.scheduler = FrameScheduler(self.render_frame, fps, self)
+
     def timerEvent(self, event):
         self.update_statusbar()
 
     def update_scene_display(self):
-        with self.get_painter() as painter:
-            self.drawer.update_scene(
-                painter, RESOLUTION, self.origin_coordinates, self.zoom)
-
+        # Выделение, которое перетаскивают, рисуется поверх
+        # закэшированного слоя
+        active = (self.selection
+                  if self.parent().mode == Mode.EDIT and
+                  self.object_to_interact is not None else None)
+        stats = FrameStats()
+        if self.pick_time:
+            stats.add_time('pick', self.pick_time)
+            self.pick_time = 0
+        with stats.stage('snapshot'):
+            snapshot = self.parent().model.snapshot(
+                self.renderer.spare_snapshot())
+        self.renderer.request(self.drawer, snapshot,
+                              self.origin_coordinates, self.zoom, active,
+                              stats)
         self.update_statusbar()
 
-    def get_painter(self):
-        return QtGui.QPainter(self.pixmap())
+    def render_frame(self, pan, rotation):
+        self.origin_coordinates[0] += pan[0]
+        self.origin_coordinates[1] += pan[1]
+        if rotation is not None:
+            self.parent().model.update_display_matrix(rotation)
+        self.update_scene_display()
+
+    def wait_for_frame(self):
+        self.scheduler.flush()
+        self.renderer.wait()
+
+    def show_frame(self, frame):
+        frame.stats.done()
+        log_frame(frame.stats, frame.frame_id, self.show_stats)
+        self.frame = frame
+        self.update()
+        if self.show_stats:
+            self.update_statusbar()
+
+    def paintEvent(self, event):
+        with QtGui.QPainter(self) as painter:
+            painter.drawImage(0, 0, self.renderer.front_buffer)
+            self.paint_selection(painter)
+            if self.show_stats and self.frame is not None:
+                self.paint_stats(painter, self.frame.stats.lines())
+
+    def paint_selection(self, painter):
+        model = self.parent().model
+        if self.selection and len(self.selection.indices) and \
+                self.selection.indices[-1] < model.vertices.size:
+            screen, front = screen_coords(model, self.origin_coordinates,
+                                          self.zoom, self.selection.indices)
+            painter.setPen(QtGui.QPen(SELECTION_COLOR, 5))
+            painter.drawPoints(QtGui.QPolygon(
+                screen[front].astype(int).ravel().tolist()))
+        if self.band is not None:
+            painter.setPen(QtGui.QPen(QtCore.Qt.white, 1,
+                                      QtCore.Qt.DashLine))
+            painter.setBrush(QtCore.Qt.NoBrush)
+            if self.lasso:
+                painter.drawPolygon(QtGui.QPolygon(
+                    [c for point in self.band for c in point]))
+            else:
+                painter.drawRect(QtCore.QRect(
+                    QtCore.QPoint(*self.band[0]),
+                    QtCore.QPoint(*self.band[-1])).normalized())
+
+    def paint_stats(self, painter, lines):
+        metrics = painter.fontMetrics()
+        height = metrics.height()
+        width = max(metrics.horizontalAdvance(line) for line in lines)
+        painter.fillRect(4, 4, width + 8, height * len(lines) + 8,
+                         QtGui.QColor(0, 0, 0, 160))
+        painter.setPen(QtCore.Qt.white)
+        for i, line in enumerate(lines):
+            painter.drawText(8, 8 + metrics.ascent() + i * height, line)
 
     def update_statusbar(self):
         pos = QtGui.QCursor.pos()
@@ -86,14 +186,27 @@ class SceneWindow(QtWidgets.QLabel):
                         (pos.x() / self.zoom - self.origin_coordinates[0]) +
                         self.parent().model.display_plate_basis[1] *
                         (pos.y() / self.zoom - self.origin_coordinates[1]))
+        loading = self.parent().load_progress
+        stats = (self.frame.stats
+                 if self.show_stats and self.frame is not None else None)
         self.parent().statusBar().showMessage(
             f'Mode: {str(self.parent().mode)[5:]};' +
             f' x={round(global_coord.x, 1)} ' +
             f' y={round(global_coord.y, 1)} ' +
             f' z={round(global_coord.z, 1)};' +
-            f' Zoom: {round(self.zoom, 2)}')
+            f' Zoom: {round(self.zoom, 2)}' +
+            (f'; Loading: {loading}%' if loading is not None else '') +
+            (f'; Frame: {stats.total * 1000:.1f} ms'
+             if stats is not None else ''))
 
     def mousePressEvent(self, event):
+        if self.parent().mode != Mode.VIEW and \
+                not self.parent().editable():
+            # Читаемую модель можно только рассматривать
+            self.refresh_interaction_variables(event)
+            return
+        # Каждое нажатие начинает новое действие для истории отмены
+        self.parent().model.history.seal()
         try:
             if self.parent().mode == Mode.POINT:
                 self.set_point(event)
@@ -116,12 +229,23 @@ class SceneWindow(QtWidgets.QLabel):
 
         self.object_to_interact = None
         self.refresh_interaction_variables(event)
+        if self.parent().mode == Mode.EDIT and \
+                event.button() == QtCore.Qt.LeftButton:
+            self.begin_edit(event)
         self.parent().update_display()
 
+    def mouseReleaseEvent(self, event):
+        if self.band is not None:
+            self.finish_band(event)
+
     def mouseMoveEvent(self, event: QtGui.QMouseEvent):
         if self.parent().mode == Mode.VIEW:
-            self.origin_coordinates[0] += event.x() / self.zoom - self.last_x
-            self.origin_coordinates[1] += event.y() / self.zoom - self.last_y
+            dx = event.x() / self.zoom - self.last_x
+            dy = event.y() / self.zoom - self.last_y
+            if event.buttons() & QtCore.Qt.RightButton:
+                self.trackball(dx * self.zoom, dy * self.zoom)
+            else:
+                self.scheduler.add_pan(dx, dy)
         elif self.parent().mode == Mode.EDIT:
             self.edit_object(event)
 
@@ -129,6 +253,18 @@ class SceneWindow(QtWidgets.QLabel):
 
         self.parent().update_display()
 
+    def trackball(self, dx, dy):
+        """Поворот вида вслед за мышью вокруг оси экрана, перпендикулярной
+        ее движению. Повороты за время кадра складываются планировщиком
+        в один."""
+        distance = math.hypot(dx, dy)
+        if not distance:
+            return
+        basis = self.parent().model.display_plate_basis
+        axis = basis[0] * dy - basis[1] * dx
+        self.scheduler.add_rotation(
+            Matrix3.axis_rotation(axis, distance * TRACKBALL_SPEED))
+
     def refresh_interaction_variables(self, event):
         self.last_x = event.x() / self.zoom
         self.last_y = event.y() / self.zoom
@@ -180,62 +316,124 @@ class SceneWindow(QtWidgets.QLabel):
                                             self.drawer.ellipse_color)
             self.parent().buffer = []
 
+    def begin_edit(self, event):
+        """Нажатие в режиме Edit: фигура под курсором выделяется и
+        перетаскивается вместе со всем выделением (с Ctrl - добавляется в
+        выделение или убирается из него), на пустом месте начинается
+        выделение рамкой (с Shift - лассо)."""
+        self.update_object_to_interact(event)
+        obj = self.object_to_interact
+        model = self.parent().model
+        modifiers = event.modifiers()
+        if obj is None:
+            self.band = [(event.x(), event.y())] * 2
+            self.lasso = bool(modifiers & QtCore.Qt.ShiftModifier)
+        elif modifiers & QtCore.Qt.ControlModifier:
+            self.selection = self.selection.toggle(model, obj)
+            self.object_to_interact = None
+        elif obj not in self.selection:
+            self.selection = Selection.of(model, [obj])
+        self.update()
+
+    def extend_band(self, event):
+        point = (event.x(), event.y())
+        if not self.lasso:
+            self.band[-1] = point
+        elif get_distance(*self.band[-1], *point) >= LASSO_STEP:
+            self.band.append(point)
+        self.update()
+
+    def finish_band(self, event):
+        band, self.band = self.band, None
+        model = self.parent().model
+        start = time.perf_counter()
+        try:
+            if self.lasso:
+                figures = select_lasso(model, self.origin_coordinates,
+                                       self.zoom, band)
+            else:
+                figures = select_rect(model, self.origin_coordinates,
+                                      self.zoom, band[0], band[-1])
+        finally:
+            self.pick_time += time.perf_counter() - start
+        if event.modifiers() & QtCore.Qt.ControlModifier:
+            self.selection = self.selection.union(model, figures)
+        else:
+            self.selection = Selection.of(model, figures)
+        LOGGER.info('%d objects have been selected', len(self.selection))
+        self.update()
+
+    def clear_selection(self):
+        self.selection = Selection()
+        self.object_to_interact = None
+        self.band = None
+        self.update()
+
     def edit_object(self, event):
-        if self.object_to_interact:
+        if self.band is not None:
+            self.extend_band(event)
+        elif self.object_to_interact:
             if time.time() - self.last_time_clicked < self.forget_object_delay:
-                self.object_to_interact + (
-                        self.parent().model.display_plate_basis[0] *
-                        (event.x() / self.zoom - self.last_x) +
-                        self.parent().model.display_plate_basis[1] *
-                        (event.y() / self.zoom - self.last_y))
-        else:
-            self.update_object_to_interact(event)
+                self.scheduler.add_drag(self.selection,
+                                        event.x() / self.zoom - self.last_x,
+                                        event.y() / self.zoom - self.last_y,
+                                        self.move_selection)
+
+    def move_selection(self, selection, dx, dy):
+        # Сдвиг за кадр переводится в мировые координаты одним умножением
+        # на две первые строки матрицы вида
+        model = self.parent().model
+        selection.forget_move_info()
+        model.move_vertices(selection.indices,
+                            np.array((dx, dy)) @
+                            model.display_matrix_array[:2])
 
     def update_object_to_interact(self, event):
-        self.object_to_interact = None
-        for obj in self.drawer.displayed_objects:
+        start = time.perf_counter()
+        try:
+            self.object_to_interact = self.find_object(event)
+        finally:
+            self.pick_time += time.perf_counter() - start
+
+    def find_object(self, event):
+        if self.frame is None:
+            return None
+        for obj in self.frame.query(event.x(), event.y()):
             if isinstance(obj, Point):
                 distance = self.get_distance_to_point(event, obj)
                 if obj.WIDTH > distance:
-                    self.object_to_interact = obj
-                    break
+                    return obj
             elif isinstance(obj, Line):
                 distance = self.get_distance_to_line(event, obj)
                 if obj.WIDTH > distance:
-                    self.object_to_interact = obj
-                    break
+                    return obj
             elif isinstance(obj, Place):
-                is_inside = self.is_inside_place(event, obj)
-                if is_inside:
-                    self.object_to_interact = obj
-                    break
+                if self.is_inside_place(event, obj):
+                    return obj
             elif isinstance(obj, Ellipse):
-                is_inside = self.is_inside_ellipse(event, obj)
-                if is_inside:
-                    self.object_to_interact = obj
-                    break
+                if self.is_inside_ellipse(event, obj):
+                    return obj
+        return None
 
     def get_distance_to_point(self, event, point):
         return get_distance(event.x(), event.y(),
-                            *self.drawer.points_display_table[point])
+                            *self.frame.screen_position(point.index))
 
     def get_distance_to_line(self, event, line):
-        return (self.get_distance_to_point(event, line.start) +
-                self.get_distance_to_point(event, line.end) -
-                get_distance(
-                    *self.drawer.points_display_table[line.start],
-                    *self.drawer.points_display_table[line.end]))
+        (x1, y1), (x2, y2) = self.frame.figure_screen(line).tolist()
+        return (get_distance(event.x(), event.y(), x1, y1) +
+                get_distance(event.x(), event.y(), x2, y2) -
+                get_distance(x1, y1, x2, y2))
 
     def is_inside_place(self, event, place):
-        num_points = len(place.points)
+        screen = self.frame.figure_screen(place).tolist()
+        num_points = len(screen)
         x, y = event.x(), event.y()
         sign = None
 
         for i in range(num_points):
-            p1 = place.points[i]
-            p2 = place.points[(i + 1) % num_points]
-            x1, y1 = self.drawer.points_display_table[p1]
-            x2, y2 = self.drawer.points_display_table[p2]
+            x1, y1 = screen[i]
+            x2, y2 = screen[(i + 1) % num_points]
 
             # вычисляем векторы стороны и вектор до точки
             vx, vy = x2 - x1, y2 - y1
@@ -252,34 +450,7 @@ class SceneWindow(QtWidgets.QLabel):
         return True
 
     def is_inside_ellipse(self, event, ellipse):
-        is_inside = self.check_ellipse(event, ellipse)
-        if is_inside:
-            return True
-
-        if ellipse.extra_el:
-            for el in ellipse.extra_el:
-                is_inside = self.check_ellipse(event, el)
-                if is_inside:
-                    return True
-        else:
-            return False
-
-    def check_ellipse(self, event, ellipse):
-        x, y = event.x(), event.y()
-        x1, y1 = 0, 0
-        x2, y2 = 0, 0
-        if isinstance(ellipse.topLeft, QPoint):
-            x1, y1 = ellipse.topLeft.x(), ellipse.topLeft.y()
-            x2, y2 = ellipse.bottomRight.x(), ellipse.bottomRight.y()
-        else:
-            x1, y1 = self.drawer.points_display_table[ellipse.topLeft]
-            x2, y2 = self.drawer.points_display_table[ellipse.bottomRight]
-        cx = (x1 + x2) / 2
-        cy = (y1 + y2) / 2
-        a = (x2 - x1) / 2
-        b = (y2 - y1) / 2
-        d = math.sqrt(((x - cx) / a) ** 2 + ((y - cy) / b) ** 2)
-        return d < 1
+        return self.frame.inside_ellipse(ellipse, event.x(), event.y())
 
 
 def set_checkable(action, mode):
@@ -290,8 +461,14 @@ def set_checkable(action, mode):
 
 
 class RedactorWindow(QtWidgets.QMainWindow):
-    def __init__(self):
+    def __init__(self, fps=DEFAULT_FPS, profile_frames=PROFILE_FRAMES,
+                 profile_file=PROFILE_FILE, undo_memory=DEFAULT_MEMORY,
+                 autosave=AUTOSAVE_INTERVAL, autosave_file=AUTOSAVE_FILE):
         super().__init__()
+        self.fps = fps
+        self.undo_memory = undo_memory
+        self.profile_frames = profile_frames
+        self.profile_file = profile_file
         self.label = None
         self.toolbar = None
         self.mode_menu = None
@@ -299,6 +476,27 @@ class RedactorWindow(QtWidgets.QMainWindow):
         self.model = None
         self.buffer = []
         self.drawer = None
+        self.load_progress = None
+        self.perspective = False
+        self.backend = PAINTER
+
+        self.loader = ModelLoader(self)
+        self.loader.changed.connect(self.update_display)
+        self.loader.loading.connect(self.show_load_progress)
+        self.loader.finished.connect(self.on_model_opened)
+        self.loader.failed.connect(self.on_open_failed)
+
+        self.saver = ModelSaver(self)
+        self.saver.saved.connect(self.on_model_saved)
+        self.saver.failed.connect(self.on_save_failed)
+        self.saver.start_autosave(
+            lambda: self.model if self.load_progress is None else None,
+            autosave_file, autosave)
+
+        # Журнал изменений сбрасывается на диск и сжимается по таймеру
+        self.journal_timer = QtCore.QTimer(self)
+        self.journal_timer.timeout.connect(self.check_journal)
+        self.journal_timer.start(int(journal.SYNC_INTERVAL * 1000))
 
         self.modes = {
             QtCore.Qt.Key_V: Mode.VIEW}
@@ -334,40 +532,19 @@ class RedactorWindow(QtWidgets.QMainWindow):
 
         self.statusBar()
 
-        self.label = SceneWindow(self)
+        self.label = SceneWindow(self, self.fps)
         self.setCentralWidget(self.label)
+        self.label.renderer.profiler.saved.connect(self.on_profile_saved)
 
     def get_initial_rotate_matrix(self):
         rotate_angle = math.pi / 90
         rotate_matrix = {
-            'xplus': Matrix(3, 3, math.cos(rotate_angle),
-                            -math.sin(rotate_angle), 0,
-                            math.sin(rotate_angle),
-                            math.cos(rotate_angle),
-                            0, 0, 0, 1),
-            'zplus': Matrix(3, 3, 1, 0, 0, 0,
-                            math.cos(rotate_angle),
-                            -math.sin(rotate_angle), 0,
-                            math.sin(rotate_angle),
-                            math.cos(rotate_angle)),
-            'zminus': Matrix(3, 3, 1, 0, 0, 0,
-                             math.cos(-rotate_angle),
-                             -math.sin(-rotate_angle), 0,
-                             math.sin(-rotate_angle),
-                             math.cos(-rotate_angle)),
-            'xminus': Matrix(3, 3, math.cos(-rotate_angle),
-                             -math.sin(-rotate_angle), 0,
-                             math.sin(-rotate_angle),
-                             math.cos(-rotate_angle),
-                             0, 0, 0, 1),
-            'yminus': Matrix(3, 3, math.cos(rotate_angle), 0,
-                             math.sin(rotate_angle), 0, 1, 0,
-                             -math.sin(rotate_angle), 0,
-                             math.cos(rotate_angle)),
-            'yplus': Matrix(3, 3, math.cos(-rotate_angle), 0,
-                            math.sin(-rotate_angle), 0, 1, 0,
-                            -math.sin(-rotate_angle), 0,
-                            math.cos(-rotate_angle))
+            'xplus': Matrix3.rotation('x', rotate_angle),
+            'xminus': Matrix3.rotation('x', -rotate_angle),
+            'yplus': Matrix3.rotation('y', -rotate_angle),
+            'yminus': Matrix3.rotation('y', rotate_angle),
+            'zplus': Matrix3.rotation('z', rotate_angle),
+            'zminus': Matrix3.rotation('z', -rotate_angle)
         }
         return rotate_matrix
 
@@ -377,6 +554,20 @@ class RedactorWindow(QtWidgets.QMainWindow):
         for action_file in actions_file:
             file.addAction(action_file)
 
+        edit = menubar.addMenu('Edit')
+        actions_edit = self.get_actions_edit()
+        for action_edit in actions_edit:
+            edit.addAction(action_edit)
+
+        selection = menubar.addMenu('Selection')
+        for action_selection in self.get_actions_selection():
+            selection.addAction(action_selection)
+        recolor = selection.addMenu('Color')
+        for color in Color:
+            recolor.addAction(self.new_action(
+                color.name.capitalize(),
+                lambda _, color=color: self.recolor_selection(color)))
+
         rotations = menubar.addMenu('Rotates')
         actions_rotate = self.get_actions_rotate()
         for action_rotate in actions_rotate:
@@ -388,6 +579,11 @@ class RedactorWindow(QtWidgets.QMainWindow):
             action_mode.setCheckable(True)
             self.mode_menu.addAction(action_mode)
 
+        tools = menubar.addMenu('Tools')
+        actions_tools = self.get_actions_tools()
+        for action_tools in actions_tools:
+            tools.addAction(action_tools)
+
     def get_actions_file(self):
         action_new = self.new_action(
             'New', self.init_new_model, shortcut='Ctrl+N')
@@ -399,6 +595,55 @@ class RedactorWindow(QtWidgets.QMainWindow):
             'Open', self.open_model, shortcut='Ctrl+O')
         return action_new, action_save, screen_action, action_open
 
+    def get_actions_edit(self):
+        action_undo = self.new_action(
+            'Undo', self.undo, shortcut='Ctrl+Z')
+        action_redo = self.new_action(
+            'Redo', self.redo, shortcut='Ctrl+Shift+Z')
+        action_delete = self.new_action(
+            'Delete', self.delete_object, shortcut='Del')
+        return action_undo, action_redo, action_delete
+
+    def get_actions_selection(self):
+        action_all = self.new_action(
+            'Select all', self.select_all, shortcut='Ctrl+A')
+        action_clear = self.new_action(
+            'Clear', self.clear_selection, shortcut='Esc')
+        action_rotate_left = self.new_action(
+            'Rotate left',
+            lambda _: self.rotate_selection(SELECTION_ANGLE),
+            shortcut='Ctrl+[')
+        action_rotate_right = self.new_action(
+            'Rotate right',
+            lambda _: self.rotate_selection(-SELECTION_ANGLE),
+            shortcut='Ctrl+]')
+        action_scale_up = self.new_action(
+            'Scale up', lambda _: self.scale_selection(SELECTION_SCALE),
+            shortcut='Ctrl+=')
+        action_scale_down = self.new_action(
+            'Scale down',
+            lambda _: self.scale_selection(1 / SELECTION_SCALE),
+            shortcut='Ctrl+-')
+        return (action_all, action_clear, action_rotate_left,
+                action_rotate_right, action_scale_up, action_scale_down)
+
+    def get_actions_tools(self):
+        action_merge = self.new_action(
+            'Merge points', self.merge_points, shortcut='Ctrl+M')
+        action_stats = self.new_action(
+            'Frame stats', self.toggle_stats, shortcut='F3')
+        action_stats.setCheckable(True)
+        action_profile = self.new_action(
+            'Profile frames', self.toggle_profile, shortcut='F4')
+        action_perspective = self.new_action(
+            'Perspective', self.toggle_perspective, shortcut='P')
+        action_perspective.setCheckable(True)
+        action_zbuffer = self.new_action(
+            'Z-buffer', self.toggle_zbuffer, shortcut='F6')
+        action_zbuffer.setCheckable(True)
+        return (action_merge, action_stats, action_profile,
+                action_perspective, action_zbuffer)
+
     def get_actions_rotate(self):
         action_rotate_x_add = self.new_action(
             'X+', lambda _: self.rotate('xplus'), shortcut='S')
@@ -448,14 +693,23 @@ class RedactorWindow(QtWidgets.QMainWindow):
         return action
 
     def update_display(self):
-        self.label.update_scene_display()
-        self.update()
+        self.label.scheduler.request()
+
+    def editable(self):
+        """Можно ли менять модель: не пока она читается из файла."""
+        if self.load_progress is None:
+            return True
+        self.statusBar().showMessage('Model is still loading')
+        return False
 
     def set_mode(self, mode: Mode):
-        if self.mode == Mode.PLACE and len(self.buffer) > 2:
+        if self.mode == Mode.PLACE and len(self.buffer) > 2 and \
+                self.editable():
             self.model.add_place(self.buffer,
                                  self.label.drawer.plane_color)
         self.buffer = []
+        if mode != Mode.EDIT:
+            self.clear_selection()
         self.mode = mode
         for action in self.toolbar.actions():
             set_checkable(action, mode)
@@ -470,18 +724,74 @@ class RedactorWindow(QtWidgets.QMainWindow):
         if not ok:
             return
         LOGGER.info('model is saving')
-        try:
-            with open(filename, 'w', encoding='utf8') as file:
-                self.model.save(file)
-        except OSError as e:
-            import traceback
-            LOGGER.error('Error: %s\n%s', e,
-                         ''.join(traceback.format_tb(sys.exc_info()[-1])))
-            print(e, file=sys.stderr)
-            sys.exit(ERROR_SAVE)
-            QtWidgets.QMessageBox.about(self, 'Error', 'OSError')
-        LOGGER.info('model has been saved')
-        self.update_display()
+        # Снимок модели записывается в фоне
+        self.label.scheduler.flush_drag()
+        filename = os.path.abspath(filename)
+        if filename.endswith(binary_format.EXTENSION):
+            # Двоичный файл становится основой журнала изменений
+            current = self.model.journal
+            if current is not None and current.base == filename and \
+                    not current.compacting:
+                generation = current.begin_compaction()
+            else:
+                self.close_journal()
+                self.model.journal = journal.Journal.start(self.model,
+                                                           filename)
+                generation = self.model.journal.next_generation
+            self.saver.save(self.model, filename, generation=generation)
+        else:
+            self.close_journal()
+            self.saver.save(self.model, filename)
+        self.statusBar().showMessage(f'Saving {filename}...')
+
+    def on_model_saved(self, task):
+        if task.generation is not None:
+            current = self.model.journal
+            if current is not None and current.base == task.filename and \
+                    current.next_generation == task.generation:
+                current.finish_compaction()
+        if not task.auto:
+            self.statusBar().showMessage(f'Saved: {task.filename}')
+
+    def on_save_failed(self, task, message):
+        print(message, file=sys.stderr)
+        if task.generation is not None:
+            current = self.model.journal
+            if current is not None and current.base == task.filename and \
+                    current.next_generation == task.generation:
+                current.abort_compaction()
+                if current.file is None:
+                    # Основа так и не записана: вести журнал не к чему
+                    self.close_journal()
+        if task.auto:
+            self.statusBar().showMessage(f'Autosave failed: {message}')
+        else:
+            QtWidgets.QMessageBox.about(self, 'Error', message)
+
+    def check_journal(self):
+        current = self.model.journal if self.model is not None else None
+        if current is None:
+            return
+        current.sync()
+        if current.error is not None:
+            LOGGER.error('Journal error: %s', current.error)
+            self.statusBar().showMessage(f'Journal failed: {current.error}')
+            self.close_journal()
+        elif current.needs_compaction():
+            # Журнал вырос: модель переписывается в новую основу
+            LOGGER.info('journal compaction of %s', current.base)
+            self.label.scheduler.flush_drag()
+            self.saver.save(self.model, current.base, auto=True,
+                            generation=current.begin_compaction())
+
+    def close_journal(self):
+        if self.model is None or self.model.journal is None:
+            return
+        # Начатое сжатие доводится до конца
+        self.saver.wait()
+        if self.model.journal is not None:
+            self.model.journal.close()
+            self.model.journal = None
 
     def screenshot(self):
         filename, ok = QtWidgets.QFileDialog.getSaveFileName(self,
@@ -493,6 +803,7 @@ class RedactorWindow(QtWidgets.QMainWindow):
         if not filename.endswith('.png') and not filename.endswith('.bmp'):
             filename += '.png'
         LOGGER.info('screenshot is saving')
+        self.label.wait_for_frame()
         try:
             screen.grabWindow(self.winId()).save(filename, 'png')
         except PermissionError as e:
@@ -508,30 +819,168 @@ class RedactorWindow(QtWidgets.QMainWindow):
         filename, ok = QtWidgets.QFileDialog.getOpenFileName(self, 'open')
         if not ok:
             return
-        self.model = model.Model()
+        self.loader.cancel()
+        self.close_journal()
+        self.clear_selection()
+        self.model = model.Model(History(self.undo_memory))
+        self.model.set_perspective(self.perspective)
+        self.label.drawer = Drawer(self.model, self.backend)
+        self.label.frame = None
         LOGGER.info('model is opening')
-        try:
-            with open(filename, 'r', encoding='utf8') as file:
-                self.model.open(file)
-        except OSError as e:
-            import traceback
-            LOGGER.error('Error: %s\n%s', e,
-                         ''.join(traceback.format_tb(sys.exc_info()[-1])))
-            print(e, file=sys.stderr)
-            sys.exit(ERROR_OPEN)
-            QtWidgets.QMessageBox.about(self, 'Error', 'Error')
-        self.label.drawer = Drawer(self.model)
+        # Файл читается в фоне, сцена заполняется по мере чтения
+        self.loader.open(filename, self.model)
+        self.load_progress = 0
+        self.update_display()
+
+    def show_load_progress(self, percent):
+        self.load_progress = percent
+        self.label.update_statusbar()
+
+    def on_model_opened(self):
+        self.load_progress = None
         self.update_display()
         LOGGER.info('model has been opened')
 
-    def rotate(self, axis):
-        self.model.update_display_matrix(self.rotate_matrix[axis])
+    def on_open_failed(self, message):
+        self.load_progress = None
+        print(message, file=sys.stderr)
+        QtWidgets.QMessageBox.about(self, 'Error', message)
+        self.update_display()
+
+    def merge_points(self):
+        if not self.editable():
+            return
+        # Склейка перенумеровывает вершины выделения
+        self.clear_selection()
+        merged = self.model.weld()
+        LOGGER.info('%d points have been merged', merged)
+        self.statusBar().showMessage(
+            f'Merged points: {merged}; undo history cleared')
+        self.update_display()
+
+    def toggle_stats(self, checked):
+        self.label.show_stats = checked
+        self.label.update()
+        self.label.update_statusbar()
+
+    def toggle_perspective(self, checked):
+        self.label.scheduler.flush_drag()
+        self.perspective = checked
+        self.model.set_perspective(checked)
+        self.update_display()
+
+    def toggle_zbuffer(self, checked):
+        self.backend = ZBUFFER if checked else PAINTER
+        self.label.drawer.backend = self.backend
+        self.update_display()
+
+    def toggle_profile(self):
+        profiler = self.label.renderer.profiler
+        if profiler.active:
+            profiler.cancel()
+            LOGGER.info('frame profiling has been cancelled')
+            self.statusBar().showMessage('Profiling cancelled')
+            return
+        profiler.start(self.profile_frames, self.profile_file)
+        LOGGER.info('profiling next %d frames', self.profile_frames)
+        self.statusBar().showMessage(
+            f'Profiling next {self.profile_frames} frames')
+
+    def on_profile_saved(self, filename):
+        self.statusBar().showMessage(f'Frame profile saved: {filename}')
+
+    def undo(self):
+        self.step_history(self.model.undo, 'Nothing to undo')
+
+    def redo(self):
+        self.step_history(self.model.redo, 'Nothing to redo')
+
+    def step_history(self, step, empty_message):
+        if not self.editable():
+            return
+        # Накопленный за кадр сдвиг должен попасть в историю раньше
+        self.label.scheduler.flush_drag()
+        self.buffer = []
+        # Отмена могла удалить выделенные фигуры
+        self.clear_selection()
+        if not step():
+            self.statusBar().showMessage(empty_message)
+        self.update_display()
+
+    def delete_object(self):
+        selection = self.label.selection
+        if self.mode != Mode.EDIT or not selection or \
+                not self.editable():
+            return
+        self.label.scheduler.flush_drag()
+        self.model.history.seal()
+        self.model.remove_figures(selection.figures)
+        self.clear_selection()
+        LOGGER.info('%d objects have been deleted', len(selection))
+        self.update_display()
+
+    def clear_selection(self):
+        self.label.scheduler.flush_drag()
+        self.label.clear_selection()
+
+    def select_all(self):
+        if self.mode != Mode.EDIT:
+            return
+        self.label.scheduler.flush_drag()
+        self.label.selection = Selection.of(self.model, self.model.figures)
+        self.label.update()
+
+    def rotate_selection(self, angle):
+        # Выделение поворачивается вокруг оси взгляда через свой центр
+        axis = self.model.display_plate_basis[2]
+        self.transform_selection(np.array(
+            Matrix3.axis_rotation(axis, angle).to_tuple()).reshape(3, 3))
+
+    def scale_selection(self, factor):
+        self.transform_selection(np.eye(3) * factor)
+
+    def transform_selection(self, matrix):
+        selection = self.label.selection
+        if self.mode != Mode.EDIT or not selection or \
+                not self.editable():
+            return
+        self.label.scheduler.flush_drag()
+        self.model.history.seal()
+        selection.forget_move_info()
+        self.model.transform_vertices(selection.indices, matrix,
+                                      selection.center(self.model))
         self.update_display()
 
+    def recolor_selection(self, color):
+        selection = self.label.selection
+        if self.mode != Mode.EDIT or not selection or \
+                not self.editable():
+            return
+        self.label.scheduler.flush_drag()
+        self.model.history.seal()
+        self.model.recolor_figures(selection.figures, color)
+        self.update_display()
+
+    def closeEvent(self, event):
+        # Начатые записи доводятся до конца
+        self.loader.cancel()
+        self.saver.wait()
+        self.close_journal()
+        super().closeEvent(event)
+
+    def rotate(self, axis):
+        self.label.scheduler.add_rotation(self.rotate_matrix[axis])
+
     def init_new_model(self):
+        self.loader.cancel()
+        self.load_progress = None
+        self.close_journal()
+        self.clear_selection()
         del self.model
-        self.model = model.Model()
-        self.label.drawer = Drawer(self.model)
+        self.model = model.Model(History(self.undo_memory))
+        self.model.set_perspective(self.perspective)
+        self.label.drawer = Drawer(self.model, self.backend)
+        self.label.frame = None
         self.label.zoom = 1
         self.buffer = []
         self.set_mode(Mode.VIEW)
@@ -0,0 +1,46 @@
+from PyQt5 import QtGui, QtCore
+
+
+class Layer:
+    """Закэшированный слой сцены: QImage и ключ, при котором он нарисован."""
+
+    def __init__(self, transparent=True):
+        self.transparent = transparent
+        self.image = None
+        self.key = None
+
+    def valid(self, key):
+        return self.image is not None and self.key == key
+
+    def begin(self, resolution, key):
+        """Готовит слой к перерисовке и возвращает QPainter для него."""
+        if self.image is None or (self.image.width(),
+                                  self.image.height()) != tuple(resolution):
+            self.image = QtGui.QImage(
+                resolution[0], resolution[1],
+                QtGui.QImage.Format_ARGB32_Premultiplied)
+        if self.transparent:
+            self.image.fill(QtCore.Qt.transparent)
+        self.key = key
+        return QtGui.QPainter(self.image)
+
+    def invalidate(self):
+        self.key = None
+
+
+class LayerCache:
+    """Слои сцены в порядке наложения: фон, оси, статичные фигуры.
+
+    Активные (редактируемые) фигуры рисуются поверх слоев каждый кадр.
+    """
+
+    def __init__(self):
+        self.background = Layer(transparent=False)
+        self.axes = Layer()
+        self.figures = Layer()
+
+    def compose(self, painter, figures=True):
+        layers = (self.background, self.axes, self.figures)
+        for layer in layers if figures else layers[:2]:
+            if layer.image is not None:
+                painter.drawImage(0, 0, layer.image)
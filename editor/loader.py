@@ -0,0 +1,273 @@
+from PyQt5 import QtCore
+import logging
+import os
+
+from source import binary_format, journal, model
+from source.vertices import VertexStore
+from source.welding import weld_store
+
+LOGGER_NAME = '3d-editor.loader'
+LOGGER = logging.getLogger(LOGGER_NAME)
+
+BATCH_SIZE = 5000
+# Сколько прочитанных пачек может ждать GUI-поток: дальше чтение
+# останавливается, пока пачки не добавятся в модель
+BATCHES_IN_FLIGHT = 2
+# Как часто ждущее чтение проверяет, не отменено ли оно, мс
+WAIT_INTERVAL = 50
+
+
+class LoadTask(QtCore.QRunnable):
+    """Чтение файла модели в фоновом потоке.
+
+    Фигуры передаются в GUI-поток пачками, уже готовыми к добавлению:
+    они ссылаются на хранилище модели store (пока пустое) с итоговыми
+    номерами вершин и фигур, так что GUI-поток только дописывает их.
+    Текстовый файл читается построчно, а в конце склеивается здесь же;
+    склеенные фигуры GUI-поток подставляет целиком. Непринятых пачек
+    не бывает больше BATCHES_IN_FLIGHT, так что память не растет, даже
+    если GUI-поток не успевает за чтением.
+    """
+
+    def __init__(self, loader, filename, batch_size, store):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.loader = loader
+        self.filename = filename
+        self.batch_size = batch_size
+        self.store = store
+        self.binary = False
+        self.next_figure_id = 0
+        # Для текстового файла - склеенные фигуры и их хранилище
+        self.welded = None
+        # Для двоичного файла - основы журнала изменений
+        self.generation = None
+        self.replayed = 0
+        self.journal_error = None
+        self.slots = QtCore.QSemaphore(BATCHES_IN_FLIGHT)
+
+    def run(self):
+        try:
+            with open(self.filename, 'rb') as file:
+                self.binary = binary_format.is_binary(
+                    file.read(len(binary_format.MAGIC)))
+                if self.binary:
+                    file.seek(0)
+                    self.read_binary(file)
+                else:
+                    file.seek(0)
+                    self.read_text(file)
+        except Exception as e:
+            import traceback
+            LOGGER.error('Error: %s\n%s', e, traceback.format_exc())
+            self.loader.task_failed.emit(self, str(e))
+            return
+        self.loader.task_done.emit(self)
+
+    def read_binary(self, file):
+        # Двоичный файл читается целиком: это быстрее разбора пачками
+        loaded = model.Model()
+        loaded.open_binary(file)
+        if self.loader.task is not self:
+            return
+        # Журнал применяется здесь же, к своей копии модели: ее номера
+        # вершин и фигур совпадают с основой, что бы ни происходило в
+        # GUI-потоке
+        try:
+            self.generation, self.replayed = journal.restore(
+                loaded, os.path.abspath(self.filename))
+        except (OSError, ValueError, LookupError) as e:
+            import traceback
+            LOGGER.error('Error: %s\n%s', e, traceback.format_exc())
+            self.journal_error = str(e)
+        self.loader.header_loaded.emit(
+            self, (loaded.basis, loaded.origin, loaded.display_plate_basis))
+
+        # Вершины уходят с первой пачкой и получают те же номера
+        figures = loaded.figures
+        for figure in figures:
+            figure.store = self.store
+        self.next_figure_id = loaded.next_figure_id
+        store = loaded.vertices
+        count = len(figures)
+        for start in range(0, max(count, 1), self.batch_size):
+            if not self.acquire_slot():
+                return
+            stop = min(start + self.batch_size, count)
+            self.loader.batch_loaded.emit(self, figures[start:stop], store)
+            store = VertexStore()
+            self.loader.progress.emit(self, stop * 100 // max(count, 1))
+
+    def read_text(self, file):
+        size = os.fstat(file.fileno()).st_size
+        header = [file.readline() for _ in range(model.HEADER_LINES)]
+        self.loader.header_loaded.emit(self, model.Model.parse_header(header))
+
+        # Все вершины файла остаются здесь до склейки; таблицы фигур
+        # пачек снимаются до того, как фигуры уйдут в GUI-поток
+        store = VertexStore()
+        tables = []
+        figures = []
+        sent = 0
+        percent = 0
+        for line in file:
+            if self.loader.task is not self:
+                return
+            if not line.strip():
+                continue
+            figures.append(model.Model.parse_figure(line, store))
+            if len(figures) == self.batch_size:
+                if not self.send_batch(figures, store, sent, tables):
+                    return
+                sent = store.size
+                figures = []
+                if size and file.tell() * 100 // size != percent:
+                    percent = file.tell() * 100 // size
+                    self.loader.progress.emit(self, percent)
+        if figures and not self.send_batch(figures, store, sent, tables):
+            return
+
+        # В текстовом файле у каждой фигуры свои копии точек
+        table = binary_format.join_tables(tables)
+        welded, renumber, _ = weld_store(store, table['indices'])
+        table['indices'] = renumber[table['indices']]
+        figures = model.Model.figures_from_table(welded, table)
+        for figure_id, figure in enumerate(figures):
+            figure.figure_id = figure_id
+        self.welded = figures, welded
+        self.loader.progress.emit(self, 100)
+
+    def send_batch(self, figures, store, start, tables):
+        """Отдает пачку фигур, вершины которых - store с номера start;
+        False, если чтение отменено."""
+        tables.append(binary_format.figure_table(figures))
+        batch = VertexStore(max(store.size - start, 1))
+        batch.extend(store.coords[start:store.size],
+                     store.colors[start:store.size],
+                     store.widths[start:store.size])
+        for figure in figures:
+            figure.store = self.store
+            figure.figure_id = self.next_figure_id
+            self.next_figure_id += 1
+        if not self.acquire_slot():
+            return False
+        self.loader.batch_loaded.emit(self, figures, batch)
+        return True
+
+    def acquire_slot(self):
+        """Ждет, пока GUI-поток примет одну из отправленных пачек;
+        False, если чтение отменено."""
+        while not self.slots.tryAcquire(1, WAIT_INTERVAL):
+            if self.loader.task is not self:
+                return False
+        return True
+
+
+class ModelLoader(QtCore.QObject):
+    """Открытие модели без блокировки интерфейса.
+
+    Заголовок и пачки фигур приходят в GUI-поток сигналами и сразу
+    добавляются в модель, поэтому сцена заполняется по мере чтения.
+    Новое открытие отменяет предыдущее: сигналы старой задачи
+    игнорируются. Пока модель читается, менять ее нельзя: пачки
+    добавляются в конец, а по окончании текстовую модель заменяет
+    склеенная в фоне и история отмены очищается.
+    """
+    header_loaded = QtCore.pyqtSignal(object, object)
+    batch_loaded = QtCore.pyqtSignal(object, object, object)
+    progress = QtCore.pyqtSignal(object, int)
+    task_done = QtCore.pyqtSignal(object)
+    task_failed = QtCore.pyqtSignal(object, str)
+
+    changed = QtCore.pyqtSignal()
+    loading = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None, batch_size=BATCH_SIZE):
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.batch_size = batch_size
+        self.task = None
+        self.model = None
+        self.header_loaded.connect(self.on_header_loaded)
+        self.batch_loaded.connect(self.on_batch_loaded)
+        self.progress.connect(self.on_progress)
+        self.task_done.connect(self.on_task_done)
+        self.task_failed.connect(self.on_task_failed)
+
+    def open(self, filename, target):
+        """Начинает чтение файла в новую пустую модель target."""
+        self.model = target
+        self.task = LoadTask(self, filename, self.batch_size,
+                             target.vertices)
+        self.pool.start(self.task)
+
+    def cancel(self):
+        self.task = None
+        self.model = None
+
+    @QtCore.pyqtSlot(object, object)
+    def on_header_loaded(self, task, header):
+        if task is self.task:
+            self.model.set_header(header)
+            self.changed.emit()
+            self.loading.emit(0)
+
+    @QtCore.pyqtSlot(object, object, object)
+    def on_batch_loaded(self, task, figures, store):
+        task.slots.release()
+        if task is self.task:
+            self.model.merge(figures, store)
+            self.changed.emit()
+
+    @QtCore.pyqtSlot(object, int)
+    def on_progress(self, task, percent):
+        if task is self.task:
+            self.loading.emit(percent)
+
+    @QtCore.pyqtSlot(object)
+    def on_task_done(self, task):
+        if task is self.task:
+            self.model.next_figure_id = task.next_figure_id
+            if not task.binary:
+                self.model.replace_figures(*task.welded)
+            elif task.journal_error is not None:
+                # Модель показывается без журнала
+                self.cancel()
+                self.changed.emit()
+                self.failed.emit(f'Journal: {task.journal_error}')
+                return
+            else:
+                # Двоичный файл - основа журнала изменений: журнал уже
+                # применен при чтении и дальше ведется
+                try:
+                    journal.attach(self.model,
+                                   os.path.abspath(task.filename),
+                                   task.generation)
+                except OSError as e:
+                    import traceback
+                    LOGGER.error('Error: %s\n%s', e, traceback.format_exc())
+                    self.cancel()
+                    self.changed.emit()
+                    self.failed.emit(f'Journal: {e}')
+                    return
+                LOGGER.info('%d journal records replayed', task.replayed)
+            self.changed.emit()
+            self.cancel()
+            self.finished.emit()
+
+    @QtCore.pyqtSlot(object, str)
+    def on_task_failed(self, task, message):
+        if task is self.task:
+            self.cancel()
+            self.failed.emit(message)
+
+    def wait(self):
+        """Дожидается окончания чтения и применяет все пачки."""
+        while self.task is not None:
+            # Чтение ждет, пока пачки не будут приняты здесь же
+            self.pool.waitForDone(WAIT_INTERVAL)
+            QtCore.QCoreApplication.sendPostedEvents(
+                self, QtCore.QEvent.MetaCall)
@@ -0,0 +1,146 @@
+from PyQt5 import QtCore
+from contextlib import contextmanager
+import cProfile
+import json
+import logging
+import threading
+import time
+
+LOGGER_NAME = '3d-editor.frames'
+LOGGER = logging.getLogger(LOGGER_NAME)
+
+# Кадры дольше этого времени записываются в журнал всегда
+SLOW_FRAME = 0.1
+
+PROFILE_FRAMES = 100
+PROFILE_FILE = 'frames.prof'
+
+
+class FrameStats:
+    """Время этапов одного кадра и счетчики.
+
+    Этапы могут быть вложенными: время вложенного этапа не входит во
+    время внешнего, поэтому сумма этапов равна времени всей работы.
+    """
+
+    def __init__(self):
+        self.created = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.latency = None
+        self.nested = []
+
+    @contextmanager
+    def stage(self, name):
+        self.nested.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self.nested.pop()
+            self.add_time(name, elapsed - inner)
+            if self.nested:
+                self.nested[-1] += elapsed
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def done(self):
+        """Отмечает показ кадра: задержка от запроса до показа."""
+        self.latency = time.perf_counter() - self.created
+
+    @property
+    def total(self):
+        return sum(self.stages.values())
+
+    def record(self, frame_id=None):
+        return {'frame': frame_id,
+                'total_ms': round(self.total * 1000, 3),
+                'latency_ms': (round(self.latency * 1000, 3)
+                               if self.latency is not None else None),
+                'stages_ms': {name: round(seconds * 1000, 3)
+                              for name, seconds in self.stages.items()},
+                'counters': dict(self.counters)}
+
+    def lines(self):
+        """Строки для наложения поверх сцены."""
+        lines = [f'frame {self.total * 1000:.1f} ms']
+        if self.latency is not None:
+            lines[0] += f' (shown after {self.latency * 1000:.1f} ms)'
+        lines += [f'{name}: {seconds * 1000:.2f} ms'
+                  for name, seconds in self.stages.items()]
+        lines += [f'{name}: {value}'
+                  for name, value in self.counters.items()]
+        return lines
+
+
+def log_frame(stats, frame_id, verbose=False):
+    """Пишет кадр в журнал структурированной записью: медленные кадры -
+    всегда, остальные - если включено наложение."""
+    if stats.total >= SLOW_FRAME:
+        level = logging.INFO
+    elif verbose:
+        level = logging.DEBUG
+    else:
+        return
+    record = stats.record(frame_id)
+    LOGGER.log(level, 'frame %s', json.dumps(record),
+               extra={'frame': record})
+
+
+class FrameProfiler(QtCore.QObject):
+    """Снимок cProfile следующих N кадров в файл.
+
+    Кадры рисуются в фоновом потоке, поэтому профилируется именно
+    отрисовка внутри RenderTask.
+    """
+    saved = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.lock = threading.Lock()
+        self.profile = None
+        self.remaining = 0
+        self.filename = None
+
+    @property
+    def active(self):
+        return self.profile is not None
+
+    def start(self, frames=PROFILE_FRAMES, filename=PROFILE_FILE):
+        with self.lock:
+            self.profile = cProfile.Profile()
+            self.remaining = frames
+            self.filename = filename
+
+    def cancel(self):
+        with self.lock:
+            self.profile = None
+
+    @contextmanager
+    def frame(self):
+        with self.lock:
+            profile = self.profile
+        if profile is None:
+            yield
+            return
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                finished = profile is self.profile and self.remaining <= 1
+                if profile is self.profile:
+                    self.remaining -= 1
+                if finished:
+                    self.profile = None
+            if finished:
+                profile.dump_stats(self.filename)
+                LOGGER.info('frame profile has been saved to %s',
+                            self.filename)
+                self.saved.emit(self.filename)
@@ -0,0 +1,449 @@
+import numpy as np
+
+from source import clipping, ellipsoids
+from source.model import NEAR_PLANE
+from source.figures import Ellipse, Line, Place, Point
+
+# Номера видов фигур в ProjectionCache.figure_kinds
+KINDS = (Point, Line, Place, Ellipse)
+POINT, LINE, PLACE, ELLIPSE = range(len(KINDS))
+
+
+class ProjectionCache:
+    """Кэш проекций вершин модели.
+
+    Проекция пересчитывается целиком только при смене матрицы отображения
+    (Model.display_version). Иначе перепроецируются лишь вершины, чьи
+    счетчики изменений в VertexStore.versions отличаются от сохраненных.
+
+    В перспективе фигуры за ближней плоскостью скрываются (hidden), а
+    прямые и плоскости, пересекающие ее, обрезаются: их экранные вершины
+    лежат в clipped (номер фигуры -> массив (K, 2)), координаты вида - в
+    clipped_display (номер фигуры -> массив (K, 3)).
+
+    Экранные координаты готового кадра (publish) читаются в GUI-потоке,
+    пока рисуется следующий, поэтому, как и буферы изображений Renderer,
+    они чередуются между двумя массивами: следующий кадр пишет в
+    прежний, и в него переносятся только изменившиеся с тех пор строки.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.display = np.zeros((0, 3))
+        self.front = np.zeros(0, dtype=bool)
+        self.screen = np.zeros((0, 2), dtype=int)
+        # Второй массив экранных координат; published - отдан ли кадру
+        # текущий, changed - строки, которыми они различаются (None - все)
+        self.spare = None
+        self.published = False
+        self.changed = None
+        self.versions = np.zeros(0, dtype=np.uint32)
+        self.display_version = None
+        self.view = None
+
+        self.figures_version = None
+        self.figure_indices = np.zeros(0, dtype=np.intp)
+        self.figure_offsets = np.zeros(0, dtype=np.intp)
+        self.figure_kinds = np.zeros(0, dtype=np.int8)
+        self.depths = np.zeros(0)
+        self.order = None
+        self.bounds = None
+        self.hidden = np.zeros(0, dtype=bool)
+        self.clipped = {}
+        self.clipped_display = {}
+        self.ellipses = EllipseMeshes()
+
+        self.projected_count = 0
+
+    def update(self, split_coordinates, zoom):
+        """Обновляет проекции и экранные координаты, возвращает индексы
+        перепроецированных вершин."""
+        store = self.model.vertices
+        size = store.size
+        cached = len(self.display)
+        view = (split_coordinates[0], split_coordinates[1], zoom)
+
+        if self.display_version != self.model.display_version or \
+                size < cached:
+            changed = np.arange(size)
+        else:
+            stale = np.flatnonzero(
+                store.versions[:cached] != self.versions)
+            changed = np.concatenate((stale, np.arange(cached, size)))
+
+        if size != cached:
+            display = np.zeros((size, 3))
+            front = np.zeros(size, dtype=bool)
+            screen = np.zeros((size, 2), dtype=int)
+            keep = min(size, cached)
+            display[:keep] = self.display[:keep]
+            front[:keep] = self.front[:keep]
+            screen[:keep] = self.screen[:keep]
+            self.display, self.front = display, front
+            self.replace_screen(screen)
+
+        if len(changed):
+            self.display[changed], self.front[changed] = self.model.project(
+                store.coords[changed])
+        if view != self.view:
+            self.replace_screen(self.to_screen(self.display, view))
+        elif len(changed):
+            if self.published:
+                self.swap_screen()
+            self.screen[changed] = self.to_screen(self.display[changed],
+                                                  view)
+            if self.changed is not None:
+                self.changed = np.union1d(self.changed, changed)
+
+        if len(changed):
+            self.order = None
+        if len(changed) or view != self.view:
+            self.bounds = None
+        self.versions = store.versions[:size].copy()
+        self.display_version = self.model.display_version
+        self.view = view
+        self.projected_count = len(changed)
+        return changed
+
+    def publish(self):
+        """Экранные координаты для готового кадра: следующее обновление
+        их уже не меняет."""
+        self.published = True
+        return self.screen
+
+    def replace_screen(self, screen):
+        if self.published:
+            self.spare = self.screen
+        self.screen = screen
+        self.published = False
+        self.changed = None
+
+    def swap_screen(self):
+        """Переходит ко второму массиву, перенося в него строки, которыми
+        он отличается от опубликованного."""
+        screen, spare = self.screen, self.spare
+        if spare is None or spare.shape != screen.shape or \
+                self.changed is None:
+            spare = screen.copy()
+        else:
+            spare[self.changed] = screen[self.changed]
+        self.screen, self.spare = spare, screen
+        self.published = False
+        self.changed = np.zeros(0, dtype=np.intp)
+
+    @staticmethod
+    def to_screen(display, view):
+        return (display[:, :2] * view[2] + view[:2]).astype(int)
+
+    def update_topology(self):
+        figures = self.model.figures
+        if self.figures_version == self.model.figures_version:
+            return False
+        lengths = np.fromiter((len(obj.indices) for obj in figures),
+                              dtype=np.intp, count=len(figures))
+        self.figure_offsets = np.zeros(len(figures), dtype=np.intp)
+        np.cumsum(lengths[:-1], out=self.figure_offsets[1:])
+        self.figure_indices = np.fromiter(
+            (index for obj in figures for index in obj.indices),
+            dtype=np.intp, count=int(lengths.sum()))
+        kinds = {kind: number for number, kind in enumerate(KINDS)}
+        self.figure_kinds = np.fromiter(
+            (kinds.get(type(obj), -1) for obj in figures),
+            dtype=np.int8, count=len(figures))
+        self.figures_version = self.model.figures_version
+        self.ellipses.set_figures(figures,
+                                  np.flatnonzero(self.figure_kinds ==
+                                                 ELLIPSE))
+        self.order = None
+        self.bounds = None
+        return True
+
+    def depth_order(self):
+        """Порядок отрисовки фигур от дальних к ближним."""
+        self.update_topology()
+        if self.order is not None:
+            return self.order
+        if len(self.figure_offsets):
+            self.depths = np.maximum.reduceat(
+                self.display[self.figure_indices, 2], self.figure_offsets)
+        else:
+            self.depths = np.zeros(0)
+        # Глубина эллипса - по вершинам его сетки, а не по углам коробки
+        ellipses = self.update_ellipses()
+        self.depths[ellipses.positions] = ellipses.depths
+        self.order = np.argsort(self.depths, kind='stable')[::-1]
+        return self.order
+
+    def figure_bounds(self):
+        """Экранные ограничивающие прямоугольники фигур: массивы
+        минимумов и максимумов формы (F, 2)."""
+        self.update_topology()
+        if self.bounds is None:
+            if len(self.figure_offsets):
+                corners = self.screen[self.figure_indices]
+                self.bounds = (
+                    np.minimum.reduceat(corners, self.figure_offsets),
+                    np.maximum.reduceat(corners, self.figure_offsets))
+            else:
+                empty = np.zeros((0, 2), dtype=int)
+                self.bounds = (empty, empty)
+            self.update_clipping()
+            for position, screen in self.clipped.items():
+                self.bounds[0][position] = screen.min(axis=0)
+                self.bounds[1][position] = screen.max(axis=0)
+            ellipses = self.update_ellipses()
+            self.bounds[0][ellipses.positions] = ellipses.lows
+            self.bounds[1][ellipses.positions] = ellipses.highs
+            self.hidden[ellipses.positions] |= ellipses.hidden
+        return self.bounds
+
+    def update_clipping(self):
+        """Скрывает фигуры за ближней плоскостью и обрезает пересекающие
+        ее прямые и плоскости. В ортогональной проекции и когда все
+        вершины перед плоскостью, ничего не делается."""
+        offsets = self.figure_offsets
+        self.hidden = np.zeros(len(offsets), dtype=bool)
+        self.clipped = {}
+        self.clipped_display = {}
+        if not len(offsets) or self.front.all():
+            return
+        behind = ~self.front[self.figure_indices]
+        partly = np.logical_or.reduceat(behind, offsets)
+        fully = np.logical_and.reduceat(behind, offsets)
+        kinds = self.figure_kinds
+        cut = partly & ~fully & ((kinds == LINE) | (kinds == PLACE))
+        self.hidden = partly & ~cut
+        figures = self.model.figures
+        store = self.model.vertices
+        for position in np.flatnonzero(cut).tolist():
+            points = self.model.homogeneous_vectors(
+                store.coords[figures[position].indices])
+            if kinds[position] == LINE:
+                points = clipping.clip_segment(points, NEAR_PLANE)
+            else:
+                points = clipping.clip_polygon(points, NEAR_PLANE)[0]
+            display = clipping.to_display(points)
+            self.clipped_display[position] = display
+            self.clipped[position] = self.to_screen(display, self.view)
+
+    def update_ellipses(self):
+        self.update_topology()
+        self.ellipses.update(self.model, self.view)
+        return self.ellipses
+
+    def visible(self, resolution, margin=0):
+        """Маска фигур, чьи прямоугольники (расширенные на margin)
+        пересекают экран размера resolution."""
+        lows, highs = self.figure_bounds()
+        return np.all((highs >= -margin) &
+                      (lows <= np.asarray(resolution) + margin),
+                      axis=1) & ~self.hidden
+
+    def screen_position(self, index):
+        x, y = self.screen[index]
+        return int(x), int(y)
+
+
+class EllipseMeshes:
+    """Сетки эллипсоидов и их проекции.
+
+    Кольца эллипса строятся один раз и перестраиваются, только когда
+    меняются счетчики версий его вершин; все сетки проецируются одним
+    пакетом. Контур на экране пересчитывается при смене вида.
+
+    В перспективе каждый эллипсоид уменьшается целиком по глубине своего
+    центра (контур остается эллипсом); эллипсоиды, задевающие ближнюю
+    плоскость, скрываются (hidden).
+    """
+
+    def __init__(self):
+        self.template = ellipsoids.ring_template()
+        self.positions = np.zeros(0, dtype=np.intp)
+        self.corners = np.zeros((0, 2), dtype=np.intp)
+        self.rows = {}
+        self.versions = None
+        self.display_version = None
+        self.view = None
+
+        size = len(self.template)
+        self.centers = np.zeros((0, 3))
+        self.axes = np.zeros((0, 3))
+        self.mesh = np.zeros((0, size, 3))
+        self.display = np.zeros((0, size, 3))
+        self.front = np.zeros((0, size), dtype=bool)
+        self.depths = np.zeros(0)
+        self.surfaces = np.zeros((0, 7))
+        self.hidden = np.zeros(0, dtype=bool)
+        self.screen = np.zeros((0, size, 2), dtype=int)
+        self.outline = np.zeros((0, ellipsoids.OUTLINE_SEGMENTS, 2),
+                                dtype=int)
+        self.screen_centers = np.zeros((0, 2))
+        self.forms = np.zeros((0, 2, 2))
+        self.inverse = np.zeros((0, 2, 2))
+        self.lows = np.zeros((0, 2), dtype=int)
+        self.highs = np.zeros((0, 2), dtype=int)
+        self.arcs = np.zeros((0, 3, 2 * ellipsoids.RING_SEGMENTS + 2),
+                             dtype=int)
+        self.arc_counts = []
+        self.built_count = 0
+
+    def set_figures(self, figures, positions):
+        """Новый список эллипсов: positions - их номера среди фигур."""
+        self.positions = positions
+        self.rows = {id(figures[i]): row
+                     for row, i in enumerate(positions.tolist())}
+        self.corners = np.array([figures[i].indices
+                                 for i in positions.tolist()],
+                                dtype=np.intp).reshape(-1, 2)
+        self.versions = None
+
+    def update(self, model, view):
+        store = model.vertices
+        versions = store.versions[self.corners]
+        if self.versions is None or len(self.versions) != len(versions):
+            stale = np.arange(len(versions))
+            size = len(self.template)
+            self.centers = np.zeros((len(versions), 3))
+            self.axes = np.zeros((len(versions), 3))
+            self.mesh = np.zeros((len(versions), size, 3))
+            self.display = np.zeros((len(versions), size, 3))
+            self.front = np.zeros((len(versions), size), dtype=bool)
+        else:
+            stale = np.flatnonzero(np.any(versions != self.versions,
+                                          axis=1))
+        self.versions = versions
+        self.built_count = len(stale)
+        if len(stale):
+            self.centers[stale], self.axes[stale] = ellipsoids.semi_axes(
+                store.coords[self.corners[stale]])
+            self.mesh[stale] = ellipsoids.meshes(
+                self.centers[stale], self.axes[stale], self.template)
+
+        matrix = model.display_matrix_array
+        if self.display_version != model.display_version:
+            stale = np.arange(len(versions))
+            self.display_version = model.display_version
+        elif not len(stale) and view == self.view:
+            return
+        if len(stale):
+            self.display[stale] = self.mesh[stale] @ matrix.T
+            self.front[stale] = ellipsoids.front_facing(
+                self.template, self.axes[stale], matrix)
+        self.view = view
+        depths = self.display[:, :, 2]
+        self.depths = ((depths * model.perspective_scales(depths)).max(axis=1)
+                       if len(self.display) else np.zeros(0))
+        self.hidden = ~model.in_front(depths).all(axis=1)
+
+        centers = self.centers @ matrix.T
+        scales = model.perspective_scales(centers[:, 2])
+        zoom = view[2] * scales
+        self.surfaces = ellipsoids.front_surfaces(self.axes, matrix,
+                                                  centers[:, 2], scales, zoom)
+        shift = np.asarray(view[:2], dtype=float)
+        self.screen = (self.display[:, :, :2] * zoom[:, None, None] +
+                       shift).astype(int)
+        centers = centers[:, :2] * zoom[:, None] + shift
+        forms = ellipsoids.outline_forms(self.axes, matrix,
+                                         zoom[:, None, None])
+        self.outline = ellipsoids.outlines(centers, forms).astype(int)
+        extents = ellipsoids.outline_extents(forms)
+        self.lows = np.floor(centers - extents).astype(int)
+        self.highs = np.ceil(centers + extents).astype(int)
+        self.screen_centers = centers
+        self.forms = forms
+        self.inverse = ellipsoids.inverse_forms(forms)
+        self.update_arcs()
+
+    def update_arcs(self):
+        """Видимые дуги колец. Видимая часть кольца на выпуклой
+        поверхности - одна непрерывная дуга; она начинается с видимой
+        вершины после невидимой, а целое кольцо замыкается."""
+        segments = ellipsoids.RING_SEGMENTS
+        front = self.front.reshape(len(self.front), 3, segments)
+        counts = front.sum(axis=2)
+        starts = np.argmax(front & ~np.roll(front, 1, axis=2), axis=2)
+        starts[counts == segments] = 0
+        counts[counts == segments] += 1
+        ring = (starts[:, :, None] + np.arange(segments + 1)) % segments
+        ring += np.arange(0, 3 * segments, segments)[:, None]
+        self.arc_counts = counts.tolist()
+        self.arcs = np.take_along_axis(
+            self.screen, ring.reshape(len(ring), 3 * (segments + 1), 1),
+            axis=1).reshape(len(ring), 3, 2 * (segments + 1))
+
+    def front_arcs(self, row):
+        """Видимые дуги колец эллипса: для каждой дуги плоский список
+        x0, y0, x1, y1, ..."""
+        return [self.arcs[row, ring, :2 * count].tolist()
+                for ring, count in enumerate(self.arc_counts[row])
+                if count > 1]
+
+
+class FragmentProjection:
+    """Проекции фрагментов BSP-дерева: все вершины фрагментов
+    проецируются одним пакетом, пока не изменится дерево или вид.
+
+    В перспективе фрагменты за ближней плоскостью скрываются (hidden),
+    а пересекающие ее обрезаются (clipped: id фрагмента -> экранные
+    вершины и признаки обводимых ребер)."""
+
+    def __init__(self, model, tree):
+        self.model = model
+        self.tree = tree
+        self.key = None
+        self.slots = {}
+        self.screen = np.zeros((0, 2), dtype=int)
+        self.depths = {}
+        self.hidden = set()
+        self.clipped = {}
+
+    def update(self, view):
+        key = (self.tree.version, self.model.display_version, view)
+        if key == self.key:
+            return
+        fragments = [fragment for located in self.tree.locations.values()
+                     for _, fragment in located]
+        self.slots = {}
+        self.depths = {}
+        self.hidden = set()
+        self.clipped = {}
+        if fragments:
+            coords = np.concatenate([f.coords for f in fragments])
+            display, front = self.model.project(coords)
+            self.screen = ProjectionCache.to_screen(display, view)
+            start = 0
+            for fragment in fragments:
+                end = start + len(fragment.coords)
+                self.slots[id(fragment)] = (start, end)
+                self.depths[id(fragment)] = display[start:end, 2].max()
+                if not front[start:end].all():
+                    self.clip(fragment, view)
+                start = end
+        self.key = key
+
+    def clip(self, fragment, view):
+        clipped = clipping.clip_polygon(
+            self.model.homogeneous_vectors(fragment.coords), NEAR_PLANE,
+            fragment.edges)
+        if clipped is None:
+            self.hidden.add(id(fragment))
+            return
+        points, edges = clipped
+        self.clipped[id(fragment)] = (
+            ProjectionCache.to_screen(clipping.to_display(points), view),
+            edges)
+
+    def polygon(self, fragment):
+        """Экранные координаты вершин фрагмента одним плоским списком
+        x0, y0, x1, y1, ..."""
+        clipped = self.clipped.get(id(fragment))
+        if clipped is not None:
+            return clipped[0].ravel().tolist()
+        start, end = self.slots[id(fragment)]
+        return self.screen[start:end].ravel().tolist()
+
+    def edges(self, fragment):
+        """Признаки обводимых ребер фрагмента на экране."""
+        clipped = self.clipped.get(id(fragment))
+        return fragment.edges if clipped is None else clipped[1]
@@ -0,0 +1,271 @@
+"""Программная растеризация в буфер глубины (z-буфер).
+
+Художник рисует фигуры от дальних к ближним целиком и поэтому не может
+правильно показать пересекающиеся плоскости. Здесь фигуры раскладываются
+на пиксели с глубиной, и в каждом пикселе остается ближайший, как в
+z-буфере видеокарты. Пиксели всех треугольников (отрезков, точек)
+считаются сразу массивами numpy.
+
+Глубина - координата z вида: чем меньше, тем ближе. В перспективе она
+линейна по экрану, поэтому интерполяция глубины по треугольнику точна и
+там.
+"""
+from functools import partial
+
+from PyQt5 import QtGui
+import numpy as np
+
+# Пиксели считаются пачками примерно по столько штук
+FRAGMENT_CHUNK = 2 ** 21
+
+
+def argb(color):
+    """Цвет Qt -> число 0xAARRGGBB, как в буфере цвета."""
+    return QtGui.QColor(color).rgba()
+
+
+def disc(width):
+    """Смещения пикселей круга диаметра width: массив (K, 2)."""
+    radius = width / 2
+    reach = int(np.ceil(radius))
+    dx, dy = np.meshgrid(np.arange(-reach, reach + 1),
+                         np.arange(-reach, reach + 1))
+    inside = dx ** 2 + dy ** 2 <= radius ** 2
+    return np.stack((dx[inside], dy[inside]), axis=1)
+
+
+def chunks(counts, limit=FRAGMENT_CHUNK):
+    """Делит элементы с числами пикселей counts на пачки подряд идущих
+    элементов, в каждой из которых не больше limit пикселей (кроме
+    пачек из одного элемента); выдает срезы."""
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        done = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, done + limit, 'right')),
+                   start + 1)
+        yield slice(start, stop)
+        start = stop
+
+
+def expand(counts):
+    """Для элементов с counts пикселями: номер элемента и номер пикселя
+    внутри элемента для каждого пикселя."""
+    owners = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    return owners, np.arange(len(owners)) - starts[owners]
+
+
+def fit_planes(x, y, values):
+    """Коэффициенты a, b, c линейных функций a x + b y + c, принимающих
+    в вершинах треугольников (x, y: (T, 3)) значения values (T, 3)."""
+    dx1, dx2 = x[:, 1] - x[:, 0], x[:, 2] - x[:, 0]
+    dy1, dy2 = y[:, 1] - y[:, 0], y[:, 2] - y[:, 0]
+    dv1, dv2 = values[:, 1] - values[:, 0], values[:, 2] - values[:, 0]
+    area = dx1 * dy2 - dx2 * dy1
+    a = (dv1 * dy2 - dv2 * dy1) / area
+    b = (dv2 * dx1 - dv1 * dx2) / area
+    return a, b, values[:, 0] - a * x[:, 0] - b * y[:, 0]
+
+
+def plane_rows(planes, owners, rows):
+    """Глубина пикселей строк rows фигур owners по плоскостям фигур
+    planes = (a, b, c), z = a x + b y + c: функция для ZBuffer.fill_rows.
+    С первым аргументом, заданным через functools.partial, - глубина для
+    ZBuffer.fill_convex.
+    """
+    a, b, c = planes
+    a, base = a[owners], b[owners] * (rows + 0.5) + c[owners]
+    return lambda row_of, x: a[row_of] * x + base[row_of]
+
+
+def surface_rows(centers, surfaces, owners, rows):
+    """Глубина пикселей строк rows на передних поверхностях эллипсоидов
+    owners (см. ellipsoids.front_surfaces): функция для
+    ZBuffer.fill_rows. Коэффициенты, зависящие только от строки,
+    считаются один раз на строку."""
+    uy = rows + 0.5 - centers[owners, 1]
+    c = surfaces[owners].T
+    cx = centers[owners, 0]
+    base, slope = c[0] + c[2] * uy, c[1]
+    square, linear, free = c[3], c[4] * uy, c[5] * uy * uy + c[6]
+
+    def depths(row_of, x):
+        ux = x - cx[row_of]
+        inner = (square[row_of] * ux + linear[row_of]) * ux + free[row_of]
+        return base[row_of] + slope[row_of] * ux - \
+            np.sqrt(np.maximum(inner, 0))
+    return depths
+
+
+def segment_corners(starts, ends, width):
+    """Углы прямоугольников отрезков толщины width (S, 4, 2): отрезок
+    продолжен на width / 2 за концы, как у пера Qt с квадратными
+    концами."""
+    delta = ends - starts
+    length = np.hypot(delta[:, 0], delta[:, 1])[:, None]
+    along = np.where(length > 0, delta / np.where(length > 0, length, 1),
+                     (1.0, 0.0)) * (width / 2)
+    across = np.stack((-along[:, 1], along[:, 0]), axis=1)
+    return np.stack((starts - along - across, starts - along + across,
+                     ends + along + across, ends + along - across), axis=1)
+
+
+class ZBuffer:
+    """Буфер цвета (uint32 0xAARRGGBB, прозрачный фон) и буфер глубины
+    размера экрана.
+
+    image() оборачивает буфер цвета в QImage без копирования, поэтому
+    изображение годно, пока буфер не очищен заново.
+    """
+
+    def __init__(self):
+        self.color = np.zeros((0, 0), dtype=np.uint32)
+        self.depth = np.zeros((0, 0))
+        self.fragments = 0
+
+    def clear(self, resolution):
+        width, height = resolution
+        if self.color.shape != (height, width):
+            self.color = np.zeros((height, width), dtype=np.uint32)
+            self.depth = np.empty((height, width))
+        else:
+            self.color.fill(0)
+        self.depth.fill(np.inf)
+        self.fragments = 0
+
+    def image(self):
+        height, width = self.color.shape
+        return QtGui.QImage(self.color.data, width, height, 4 * width,
+                            QtGui.QImage.Format_ARGB32_Premultiplied)
+
+    def write(self, index, depth, color):
+        """Пиксели с номерами index в буфере (строка * ширина + столбец),
+        глубиной depth и цветом color: в буфере остается ближайший. Из
+        равных по глубине побеждает последний."""
+        depths = self.depth.reshape(-1)
+        np.minimum.at(depths, index, depth)
+        nearest = depth <= depths[index]
+        self.color.reshape(-1)[index[nearest]] = color[nearest]
+        self.fragments += len(index)
+
+    def fill_rows(self, rows, left, right, depths, colors):
+        """Закрашивает строки пикселей rows цветами colors: в строке -
+        пиксели с центрами от left до right. depths(row_of, x) - глубина
+        пикселей с центрами x в строках row_of (см. plane_rows)."""
+        width = self.color.shape[1]
+        left = np.clip(np.ceil(left - 0.5), 0, width).astype(np.intp)
+        right = np.clip(np.floor(right - 0.5) + 1, 0, width).astype(np.intp)
+        lengths = np.maximum(right - left, 0)
+        row_of = np.repeat(np.arange(len(lengths)), lengths)
+        # Пиксель k пачки лежит в строке row_of[k] на месте k - starts
+        starts = np.cumsum(lengths) - lengths
+        columns = (left - starts)[row_of] + np.arange(len(row_of))
+        self.write((rows * width)[row_of] + columns,
+                   depths(row_of, columns + 0.5), colors[row_of])
+
+    def row_ranges(self, low, high):
+        """Строки экрана, центры которых лежат между low и high: первая
+        строка и число строк."""
+        height = self.color.shape[0]
+        first = np.clip(np.ceil(low - 0.5), 0, height)
+        last = np.clip(np.floor(high - 0.5) + 1, 0, height)
+        return first.astype(np.intp), np.maximum(last - first, 0).astype(
+            np.intp)
+
+    def fill_convex(self, corners, depths, colors):
+        """Закрашивает выпуклые многоугольники corners (P, K, 2):
+        пиксели строки лежат между точками пересечения ее центра с
+        ребрами. depths(owners, rows) - функция глубины для fill_rows в
+        строках rows многоугольников owners (см. plane_rows)."""
+        width = self.color.shape[1]
+        x, y = corners[:, :, 0], corners[:, :, 1]
+        first, rows = self.row_ranges(y.min(axis=1), y.max(axis=1))
+        dx, dy = np.roll(x, -1, axis=1) - x, np.roll(y, -1, axis=1) - y
+        # Оценка сверху числа пикселей: по прямоугольнику и по площади с
+        # периметром (для узких наклонных многоугольников)
+        spans = np.clip(np.ceil(x.max(axis=1) - x.min(axis=1)) + 1, 1, width)
+        area = np.abs((x * np.roll(y, -1, axis=1) -
+                       np.roll(x, -1, axis=1) * y).sum(axis=1)) / 2
+        perimeter = np.hypot(dx, dy).sum(axis=1)
+        counts = np.minimum(rows * spans, rows + area + perimeter)
+        for part in chunks(counts):
+            owners, local = expand(rows[part])
+            owners += part.start
+            py = first[owners] + local
+            cy = (py + 0.5)[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = (cy - y[owners]) / dy[owners]
+            crossed = (t >= 0) & (t <= 1)
+            edge_x = x[owners] + t * dx[owners]
+            self.fill_rows(py, np.where(crossed, edge_x, np.inf).min(axis=1),
+                           np.where(crossed, edge_x, -np.inf).max(axis=1),
+                           depths(owners, py), colors[owners])
+
+    def fill_triangles(self, corners, depths, colors):
+        """Закрашивает треугольники: corners (T, 3, 2) - вершины на
+        экране, depths (T, 3) - их глубины, colors (T,) - цвета."""
+        x, y = corners[:, :, 0], corners[:, :, 1]
+        area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - \
+            (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+        keep = np.abs(area) > 1e-12
+        if not keep.all():
+            corners, depths, colors = corners[keep], depths[keep], \
+                colors[keep]
+        self.fill_convex(corners, partial(plane_rows, fit_planes(
+            corners[:, :, 0], corners[:, :, 1], depths)), colors)
+
+    def fill_ellipsoids(self, centers, forms, surfaces, colors):
+        """Закрашивает эллипсоиды: контур - эллипс y^T S^-1 y <= 1 с
+        центром centers (E, 2) и матрицей S = forms (E, 2, 2), глубина -
+        по передней поверхности surfaces (см. surface_rows)."""
+        p, q, r = forms[:, 0, 0], forms[:, 0, 1], forms[:, 1, 1]
+        keep = r > 1e-12
+        centers, surfaces, colors = centers[keep], surfaces[keep], \
+            colors[keep]
+        p, q, r = p[keep], q[keep], r[keep]
+        reach = np.sqrt(r)
+        first, rows = self.row_ranges(centers[:, 1] - reach,
+                                      centers[:, 1] + reach)
+        # В строке dy: x = q / r dy +- sqrt((p r - q^2) / r (1 - dy^2 / r))
+        spread = np.sqrt(np.maximum(p * r - q * q, 0) / r)
+        for part in chunks(rows * (2 * np.sqrt(p) + 2)):
+            owners, local = expand(rows[part])
+            owners += part.start
+            py = first[owners] + local
+            dy = py + 0.5 - centers[owners, 1]
+            middle = centers[owners, 0] + q[owners] / r[owners] * dy
+            half = spread[owners] * np.sqrt(
+                np.maximum(1 - dy * dy / r[owners], 0))
+            self.fill_rows(py, middle - half, middle + half,
+                           surface_rows(centers, surfaces, owners, py),
+                           colors[owners])
+
+    def stamp(self, x, y, depths, colors, kernel):
+        """Ставит в точках (x, y) круги kernel (см. disc) с глубиной и
+        цветом точки."""
+        height, width = self.color.shape
+        px = (np.floor(x).astype(np.intp)[:, None] + kernel[:, 0]).ravel()
+        py = (np.floor(y).astype(np.intp)[:, None] + kernel[:, 1]).ravel()
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        self.write((py * width + px)[inside],
+                   np.repeat(depths, len(kernel))[inside],
+                   np.repeat(colors, len(kernel))[inside])
+
+    def draw_segments(self, starts, ends, depths, colors, width):
+        """Рисует отрезки толщины width (см. segment_corners): starts,
+        ends (S, 2) - концы на экране, depths (S, 2) - их глубины,
+        colors (S,) - цвета."""
+        corners = segment_corners(starts, ends, width)
+        # Глубина постоянна поперек отрезка и линейна вдоль него
+        near, far = depths[:, :1], depths[:, 1:]
+        self.fill_convex(corners, partial(plane_rows, fit_planes(
+            corners[:, :3, 0], corners[:, :3, 1],
+            np.concatenate((near, near, far), axis=1))), colors)
+
+    def draw_discs(self, centers, depths, colors, width):
+        """Рисует круги диаметра width с центрами centers (P, 2)."""
+        kernel = disc(width)
+        for part in chunks(np.full(len(centers), len(kernel))):
+            self.stamp(centers[part, 0], centers[part, 1], depths[part],
+                       colors[part], kernel)
@@ -0,0 +1,162 @@
+from PyQt5 import QtGui, QtCore
+import logging
+
+import numpy as np
+
+from editor.profiling import FrameProfiler, FrameStats
+from editor.spatial_index import query_grids
+
+LOGGER_NAME = '3d-editor.render'
+LOGGER = logging.getLogger(LOGGER_NAME)
+
+
+class Frame:
+    """Готовый кадр и соответствующее ему состояние для выбора объектов."""
+
+    def __init__(self, frame_id, drawer):
+        self.frame_id = frame_id
+        self.grids = drawer.grids
+        self.screen = drawer.projection.publish()
+        # Обрезанные ближней плоскостью фигуры выбираются по видимой части
+        figures = drawer.model.figures
+        self.clipped = {id(figures[position]): screen
+                        for position, screen
+                        in drawer.projection.clipped.items()}
+        self.stats = drawer.stats
+        ellipses = drawer.projection.ellipses
+        self.ellipse_rows = ellipses.rows
+        self.ellipse_centers = ellipses.screen_centers.copy()
+        self.ellipse_inverse = ellipses.inverse.copy()
+
+    def screen_position(self, index):
+        x, y = self.screen[index]
+        return int(x), int(y)
+
+    def figure_screen(self, obj):
+        """Экранные координаты вершин фигуры: (K, 2)."""
+        screen = self.clipped.get(id(obj))
+        return self.screen[obj.indices] if screen is None else screen
+
+    def query(self, x, y):
+        return query_grids(self.grids, x, y)
+
+    def inside_ellipse(self, ellipse, x, y):
+        """Попадает ли точка экрана в контур эллипсоида."""
+        row = self.ellipse_rows.get(id(ellipse))
+        if row is None:
+            return False
+        offset = np.array((x, y)) - self.ellipse_centers[row]
+        return offset @ self.ellipse_inverse[row] @ offset <= 1
+
+
+class RenderTask(QtCore.QRunnable):
+    def __init__(self, renderer, frame_id, image, drawer, snapshot,
+                 origin_coordinates, zoom, active=None, stats=None):
+        super().__init__()
+        self.renderer = renderer
+        self.frame_id = frame_id
+        self.image = image
+        self.drawer = drawer
+        self.snapshot = snapshot
+        self.origin_coordinates = origin_coordinates
+        self.zoom = zoom
+        self.active = active
+        self.stats = stats or FrameStats()
+
+    def run(self):
+        frame = None
+        try:
+            with self.renderer.profiler.frame():
+                self.drawer.set_model(self.snapshot)
+                self.drawer.set_active(self.active)
+                painter = QtGui.QPainter(self.image)
+                try:
+                    self.drawer.update_scene(
+                        painter, (self.image.width(), self.image.height()),
+                        self.origin_coordinates, self.zoom, self.stats)
+                finally:
+                    painter.end()
+            frame = Frame(self.frame_id, self.drawer)
+        except Exception as e:
+            import traceback
+            LOGGER.error('Error: %s\n%s', e, traceback.format_exc())
+        self.renderer.task_done.emit(frame, self.image)
+
+
+class Renderer(QtCore.QObject):
+    """Отрисовка сцены в фоновом потоке с двойной буферизацией.
+
+    Кадр рисуется по снимку модели во внутренний QImage (задний буфер),
+    после чего буферы меняются местами. Пока кадр рисуется, из новых
+    запросов хранится только последний: устаревшие виды отбрасываются.
+    Снимок нарисованного или отброшенного кадра больше не читается и
+    отдается следующему снимку (spare_snapshot), чтобы не копировать
+    модель целиком.
+    """
+    frame_ready = QtCore.pyqtSignal(object)
+    task_done = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, resolution, parent=None):
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.back_buffer = self.new_buffer(resolution)
+        self.front_buffer = self.new_buffer(resolution)
+        self.front_buffer.fill(QtGui.QColor('grey'))
+        self.pending = None
+        self.busy = False
+        self.running = None
+        self.spare = None
+        self.requested_id = 0
+        self.shown_id = 0
+        self.dropped = 0
+        self.profiler = FrameProfiler(self)
+        self.task_done.connect(self.on_task_done)
+
+    @staticmethod
+    def new_buffer(resolution):
+        return QtGui.QImage(resolution[0], resolution[1],
+                            QtGui.QImage.Format_ARGB32_Premultiplied)
+
+    def request(self, drawer, snapshot, origin_coordinates, zoom,
+                active=None, stats=None):
+        self.requested_id += 1
+        request = (self.requested_id, drawer, snapshot,
+                   tuple(origin_coordinates), zoom, active, stats)
+        if self.busy:
+            if self.pending is not None:
+                self.dropped += 1
+                self.spare = self.pending[2]
+            self.pending = request
+        else:
+            self.start(request)
+
+    def spare_snapshot(self):
+        """Снимок, который больше не читается, или None."""
+        spare, self.spare = self.spare, None
+        return spare
+
+    def start(self, request):
+        self.busy = True
+        self.running = request
+        self.pool.start(RenderTask(self, request[0], self.back_buffer,
+                                   *request[1:]))
+
+    @QtCore.pyqtSlot(object, object)
+    def on_task_done(self, frame, image):
+        self.busy = False
+        self.spare = self.running[2]
+        if frame is not None and frame.frame_id > self.shown_id:
+            self.back_buffer, self.front_buffer = self.front_buffer, image
+            self.shown_id = frame.frame_id
+            self.frame_ready.emit(frame)
+        if self.pending is not None:
+            request, self.pending = self.pending, None
+            self.start(request)
+
+    def wait(self):
+        """Дожидается отрисовки последнего запрошенного кадра."""
+        while self.busy or self.pending is not None:
+            self.pool.waitForDone()
+            QtCore.QCoreApplication.sendPostedEvents(
+                self, QtCore.QEvent.MetaCall)
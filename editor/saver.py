@@ -0,0 +1,205 @@
+from PyQt5 import QtCore
+import functools
+import logging
+import os
+import tempfile
+
+from source import binary_format
+
+LOGGER_NAME = '3d-editor.saver'
+LOGGER = logging.getLogger(LOGGER_NAME)
+
+AUTOSAVE_INTERVAL = 60
+AUTOSAVE_FILE = 'autosave' + binary_format.EXTENSION
+
+
+def autosave_path(filename=AUTOSAVE_FILE):
+    """Путь файла автосохранения. Имя без каталога кладется в каталог
+    данных пользователя, а не в текущий каталог, откуда бы ни был
+    запущен редактор."""
+    if os.path.dirname(filename):
+        return os.path.abspath(filename)
+    directory = QtCore.QStandardPaths.writableLocation(
+        QtCore.QStandardPaths.AppDataLocation)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except (OSError, ValueError):
+        return os.path.abspath(filename)
+    return os.path.join(directory, filename)
+
+
+@functools.lru_cache(maxsize=None)
+def process_umask():
+    """Маска прав процесса. В Linux она читается из /proc; иначе ее
+    можно узнать, только на миг заменив, поэтому маска запоминается при
+    создании ModelSaver, до запуска фоновых потоков."""
+    try:
+        with open('/proc/self/status', encoding='ascii') as file:
+            for line in file:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    # На это время файлы создаются закрытыми, а не общедоступными
+    umask = os.umask(0o077)
+    os.umask(umask)
+    return umask
+
+
+def write_atomic(snapshot, filename, generation=None):
+    """Записывает модель во временный файл рядом с filename и заменяет
+    им filename одним переименованием: при сбое посреди записи прежний
+    файл остается целым.
+
+    Если задано поколение, файл пишется основой журнала изменений:
+    двоичным, со всеми вершинами под прежними номерами.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    descriptor, temporary = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(filename) + '.',
+        suffix='.tmp')
+    try:
+        # Расширение .3db - двоичный формат, иначе текстовый
+        if generation is not None:
+            with open(descriptor, 'wb') as file:
+                snapshot.save_binary(file, generation, compact=False)
+                file.flush()
+                os.fsync(file.fileno())
+        elif filename.endswith(binary_format.EXTENSION):
+            with open(descriptor, 'wb') as file:
+                snapshot.save_binary(file)
+                file.flush()
+                os.fsync(file.fileno())
+        else:
+            with open(descriptor, 'w', encoding='utf8') as file:
+                snapshot.save(file)
+                file.flush()
+                os.fsync(file.fileno())
+        # Временный файл создается с правами 0600; готовому файлу даются
+        # права прежнего файла или обычные
+        try:
+            mode = os.stat(filename).st_mode & 0o777
+        except OSError:
+            mode = 0o666 & ~process_umask()
+        os.chmod(temporary, mode)
+        os.replace(temporary, filename)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def model_state(model):
+    """Признак изменения модели: меняется при добавлении, удалении,
+    перекраске и сдвиге фигур."""
+    size = model.vertices.size
+    return (id(model), model.figures_version, size,
+            int(model.vertices.versions[:size].sum()))
+
+
+class SaveTask(QtCore.QRunnable):
+    """Запись снимка модели в фоновом потоке."""
+
+    def __init__(self, saver, snapshot, filename, auto, generation):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.saver = saver
+        self.snapshot = snapshot
+        self.filename = filename
+        self.auto = auto
+        self.generation = generation
+
+    def run(self):
+        try:
+            write_atomic(self.snapshot, self.filename, self.generation)
+        except Exception as e:
+            import traceback
+            LOGGER.error('Error: %s\n%s', e, traceback.format_exc())
+            self.saver.task_failed.emit(self, str(e))
+            return
+        self.saver.task_done.emit(self)
+
+
+class ModelSaver(QtCore.QObject):
+    """Сохранение модели без блокировки интерфейса.
+
+    В GUI-потоке снимаются только массивы: вершины и таблица фигур
+    (Model.save_snapshot); объекты фигур, сериализация и запись идут в
+    фоне. Записи выполняются по очереди; автосохранение пропускается,
+    если модель не менялась или предыдущая запись еще не закончилась.
+    """
+    task_done = QtCore.pyqtSignal(object)
+    task_failed = QtCore.pyqtSignal(object, str)
+
+    # Сигналы передают SaveTask: filename, auto, generation
+    saved = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        process_umask()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.tasks = []
+        self.model = None
+        self.autosave_file = AUTOSAVE_FILE
+        self.autosaved = None
+        self.task_done.connect(self.on_task_done)
+        self.task_failed.connect(self.on_task_failed)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.autosave)
+
+    def save(self, model, filename, auto=False, generation=None):
+        task = SaveTask(self, model.save_snapshot(), filename, auto,
+                        generation)
+        self.tasks.append(task)
+        self.pool.start(task)
+        return task
+
+    def start_autosave(self, model_source, filename=AUTOSAVE_FILE,
+                       interval=AUTOSAVE_INTERVAL):
+        """Каждые interval секунд сохраняет model_source() в filename,
+        если модель изменилась. model_source возвращает None, когда
+        сохранять нечего."""
+        self.model = model_source
+        self.autosave_file = autosave_path(filename)
+        if interval > 0:
+            self.timer.start(int(interval * 1000))
+        else:
+            self.timer.stop()
+
+    def autosave(self):
+        model = self.model() if self.model is not None else None
+        if model is None or self.tasks:
+            return
+        state = model_state(model)
+        if self.autosaved is None or self.autosaved[0] != state[0]:
+            # Новая или только что открытая модель еще не изменена
+            self.autosaved = state
+        elif state != self.autosaved:
+            self.autosaved = state
+            self.save(model, self.autosave_file, auto=True)
+
+    @QtCore.pyqtSlot(object)
+    def on_task_done(self, task):
+        self.tasks.remove(task)
+        LOGGER.info('model has been saved to %s', task.filename)
+        self.saved.emit(task)
+
+    @QtCore.pyqtSlot(object, str)
+    def on_task_failed(self, task, message):
+        self.tasks.remove(task)
+        if task.auto and task.generation is None:
+            # Следующее автосохранение попробует еще раз
+            self.autosaved = (self.autosaved[0], None)
+        self.failed.emit(task, message)
+
+    def wait(self):
+        """Дожидается окончания всех записей."""
+        while self.tasks:
+            self.pool.waitForDone()
+            QtCore.QCoreApplication.sendPostedEvents(
+                self, QtCore.QEvent.MetaCall)
@@ -0,0 +1,83 @@
+from PyQt5 import QtCore
+
+DEFAULT_FPS = 60
+
+
+class FrameScheduler(QtCore.QObject):
+    """Планировщик кадров: сцена помечается устаревшей, а перерисовка
+    происходит не чаще одного раза за тик.
+
+    Сдвиги поля, перетаскивание объекта и повороты, пришедшие между
+    тиками, накапливаются и применяются одним шагом перед кадром.
+    """
+
+    def __init__(self, render, fps=DEFAULT_FPS, parent=None):
+        super().__init__(parent)
+        self.render = render
+        self.dirty = False
+        self.pan = [0, 0]
+        self.drag_target = None
+        self.drag = [0, 0]
+        self.rotation = None
+        self.apply_drag = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.fps = fps
+        self.set_fps(fps)
+
+    def set_fps(self, fps):
+        self.fps = max(1, fps)
+        self.timer.setInterval(max(1, round(1000 / self.fps)))
+
+    def request(self):
+        self.dirty = True
+        if not self.timer.isActive():
+            # После простоя первый кадр рисуется сразу, следующие - по тикам
+            self.timer.start()
+            QtCore.QTimer.singleShot(0, self.tick)
+
+    def add_pan(self, dx, dy):
+        self.pan[0] += dx
+        self.pan[1] += dy
+        self.request()
+
+    def add_drag(self, target, dx, dy, apply_drag):
+        if target is not self.drag_target:
+            self.flush_drag()
+            self.drag_target = target
+            self.apply_drag = apply_drag
+        self.drag[0] += dx
+        self.drag[1] += dy
+        self.request()
+
+    def add_rotation(self, matrix):
+        self.rotation = (matrix if self.rotation is None else
+                         matrix * self.rotation)
+        self.request()
+
+    def flush_drag(self):
+        if self.drag_target is not None and any(self.drag):
+            self.apply_drag(self.drag_target, *self.drag)
+        self.drag_target = None
+        self.drag = [0, 0]
+
+    def take(self):
+        pan, rotation = self.pan, self.rotation
+        self.pan = [0, 0]
+        self.rotation = None
+        self.flush_drag()
+        return pan, rotation
+
+    def tick(self):
+        if not self.dirty:
+            self.timer.stop()
+            return
+        self.dirty = False
+        self.render(*self.take())
+
+    def flush(self):
+        """Немедленно рисует кадр, если сцена помечена устаревшей."""
+        if self.dirty:
+            self.tick()
@@ -0,0 +1,123 @@
+"""Выделение нескольких фигур рамкой или лассо.
+
+Фигура выделяется, если все ее вершины попали в рамку (в контур лассо)
+на экране и лежат перед наблюдателем. Проверяются сразу все вершины
+модели массивами numpy.
+"""
+import numpy as np
+
+from source.figures import Ellipse
+
+# Лассо проверяется кусками по столько вершин, чтобы не держать в
+# памяти таблицу вершины x ребра целиком
+LASSO_CHUNK = 4096
+
+
+class Selection:
+    """Выделенные фигуры и номера их вершин без повторов.
+
+    Выделение не меняется: при любом изменении создается новое, поэтому
+    отрисовка по id узнает, что активные фигуры сменились.
+    """
+
+    def __init__(self, figures=(), indices=None):
+        self.figures = list(figures)
+        self.ids = {id(obj) for obj in self.figures}
+        self.indices = (np.zeros(0, dtype=np.intp)
+                        if indices is None else indices)
+        self.ellipses = [obj for obj in self.figures
+                         if isinstance(obj, Ellipse)]
+
+    @classmethod
+    def of(cls, model, figures):
+        return cls(figures, model.figure_vertices(figures))
+
+    def __len__(self):
+        return len(self.figures)
+
+    def __contains__(self, figure):
+        return id(figure) in self.ids
+
+    def union(self, model, figures):
+        return Selection.of(model, self.figures +
+                            [obj for obj in figures if obj not in self])
+
+    def toggle(self, model, figure):
+        if figure in self:
+            return Selection.of(model, [obj for obj in self.figures
+                                        if obj is not figure])
+        return Selection.of(model, self.figures + [figure])
+
+    def center(self, model):
+        return model.vertices.coords[self.indices].mean(axis=0)
+
+    def forget_move_info(self):
+        # Как и Ellipse.__add__: после правки вершин размеры устарели
+        for ellipse in self.ellipses:
+            ellipse.set_move_info(None, None)
+
+
+def screen_coords(model, origin, zoom, indices=None):
+    """Экранные координаты вершин (всех или indices): (N, 2) и маска
+    вершин перед ближней плоскостью (N,)."""
+    store = model.vertices
+    coords = store.coords[:store.size] if indices is None else \
+        store.coords[indices]
+    display, front = model.project(coords)
+    return display[:, :2] * zoom + np.asarray(origin, dtype=float), front
+
+
+def figures_inside(model, inside):
+    """Фигуры, все вершины которых отмечены в массиве inside."""
+    figures = model.figures
+    if not figures:
+        return []
+    lengths = np.fromiter((len(obj.indices) for obj in figures),
+                          dtype=np.intp, count=len(figures))
+    offsets = np.zeros(len(figures), dtype=np.intp)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    indices = np.fromiter(
+        (index for obj in figures for index in obj.indices),
+        dtype=np.intp, count=int(lengths.sum()))
+    mask = np.logical_and.reduceat(inside[indices], offsets)
+    return [figures[i] for i in np.flatnonzero(mask).tolist()]
+
+
+def select_rect(model, origin, zoom, corner1, corner2):
+    """Фигуры внутри прямоугольника экрана с углами corner1, corner2."""
+    screen, front = screen_coords(model, origin, zoom)
+    low = np.minimum(corner1, corner2)
+    high = np.maximum(corner1, corner2)
+    inside = ((screen >= low) & (screen <= high)).all(axis=1) & front
+    return figures_inside(model, inside)
+
+
+def inside_polygon(points, polygon):
+    """Лежат ли точки (N, 2) внутри многоугольника (M, 2): правило
+    четного числа пересечений луча вправо от точки."""
+    x = points[:, :1]
+    y = points[:, 1:]
+    x0, y0 = polygon[:, 0], polygon[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    # Горизонтальные ребра отсекаются первым условием
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crosses = ((y0 > y) != (y1 > y)) & \
+            (x < (x1 - x0) * (y - y0) / (y1 - y0) + x0)
+    return np.count_nonzero(crosses, axis=1) % 2 == 1
+
+
+def select_lasso(model, origin, zoom, polygon):
+    """Фигуры внутри замкнутого контура лассо (список точек экрана)."""
+    polygon = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    if len(polygon) < 3:
+        return []
+    screen, front = screen_coords(model, origin, zoom)
+    # Сначала отсекаются вершины вне описанного прямоугольника и за
+    # ближней плоскостью
+    inside = ((screen >= polygon.min(axis=0)) &
+              (screen <= polygon.max(axis=0))).all(axis=1) & front
+    candidates = np.flatnonzero(inside)
+    for start in range(0, len(candidates), LASSO_CHUNK):
+        chunk = candidates[start:start + LASSO_CHUNK]
+        inside[chunk] = inside_polygon(screen[chunk], polygon)
+    return figures_inside(model, inside)
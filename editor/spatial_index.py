@@ -0,0 +1,63 @@
+import heapq
+
+
+class ScreenGrid:
+    """Равномерная сетка по экранным ограничивающим прямоугольникам.
+
+    Каждый объект вставляется с приоритетом (по умолчанию - номер вставки,
+    приоритеты должны возрастать); запрос возвращает кандидатов под
+    курсором по возрастанию приоритета (первый - приоритетнее).
+    """
+
+    def __init__(self, cell_size=32, max_cells=256):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self.cells = {}
+        self.large = []
+        self.entries = {}
+
+    def clear(self):
+        self.cells = {}
+        self.large = []
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def insert(self, obj, left, top, right, bottom, priority=None):
+        if priority is None:
+            priority = len(self.entries)
+        self.entries[priority] = (obj, (left, top, right, bottom))
+
+        size = self.cell_size
+        x0, x1 = int(left // size), int(right // size)
+        y0, y1 = int(top // size), int(bottom // size)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            self.large.append(priority)
+            return
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                cell = self.cells.get((cx, cy))
+                if cell is None:
+                    self.cells[(cx, cy)] = [priority]
+                else:
+                    cell.append(priority)
+
+    def hits(self, x, y):
+        size = self.cell_size
+        cell = self.cells.get((int(x // size), int(y // size)), ())
+        for priority in heapq.merge(cell, self.large):
+            obj, (left, top, right, bottom) = self.entries[priority]
+            if left <= x <= right and top <= y <= bottom:
+                yield priority, obj
+
+    def query(self, x, y):
+        for _, obj in self.hits(x, y):
+            yield obj
+
+
+def query_grids(grids, x, y):
+    """Кандидаты из нескольких сеток с общей нумерацией приоритетов."""
+    for _, obj in heapq.merge(*(grid.hits(x, y) for grid in grids),
+                              key=lambda hit: hit[0]):
+        yield obj
@@ -5,10 +5,14 @@ ERROR_PYTHON_VERSION = 2
 ERROR_MODULES_MISSING = 3
 ERROR_QT_VERSION = 4
 ERROR_OPEN_WINDOW = 5
+ERROR_RENDER = 10
 
 try:
+    from editor import batch
     from editor import editor
     from editor import drawer
+    from editor import saver
+    from source import history
 except Exception as e:
     print('Game modules not found: "{}"'.format(e), file=sys.stderr)
     sys.exit(ERROR_MODULES_MISSING)
@@ -35,6 +39,26 @@ LOGGER_NAME = '3d-editor'
 LOGGER = logging.getLogger(LOGGER_NAME)
 
 
+def positive_int(text):
+    """Целое число больше нуля (тип аргумента argparse)"""
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f'must be positive: {text}')
+    return value
+
+
+def converted(function):
+    """Тип аргумента argparse из функции разбора batch: ее ValueError
+    становится сообщением об ошибке в аргументах"""
+    def convert(text):
+        try:
+            return function(text)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    convert.__name__ = function.__name__
+    return convert
+
+
 def parse_args():
     """Разбор аргуметов запуска"""
     parser = argparse.ArgumentParser(
@@ -45,6 +69,30 @@ def parse_args():
     parser.add_argument(
         '-c', '--config', type=str,
         metavar='FILENAME', default='settings.ini', help='configuration file')
+    parser.add_argument(
+        '--fps', type=positive_int,
+        metavar='N', default=60, help='frame rate cap of the scene')
+    parser.add_argument(
+        '--profile-frames', type=positive_int,
+        metavar='N', default=100,
+        help='frames captured by Tools > Profile frames')
+    parser.add_argument(
+        '--profile-file', type=str,
+        metavar='FILENAME', default='frames.prof',
+        help='cProfile dump of the captured frames')
+    parser.add_argument(
+        '--undo-memory', type=float,
+        metavar='MB', default=history.DEFAULT_MEMORY / 2 ** 20,
+        help='memory cap of the undo history')
+    parser.add_argument(
+        '--autosave', type=float,
+        metavar='SECONDS', default=saver.AUTOSAVE_INTERVAL,
+        help='autosave interval, 0 disables autosave')
+    parser.add_argument(
+        '--autosave-file', type=str,
+        metavar='FILENAME', default=saver.AUTOSAVE_FILE,
+        help='autosave file (.3db - binary format); a bare name is '
+             'placed in the user data directory')
     arg_group = parser.add_mutually_exclusive_group()
     arg_group.add_argument(
         '-l', '--log', type=str,
@@ -53,6 +101,38 @@ def parse_args():
         '--no-log',
         action='store_true', help='no log')
 
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    render = commands.add_parser(
+        'render', help='render saved models to png without a window')
+    render.add_argument(
+        'files', nargs='+', metavar='FILE', help='saved model')
+    render.add_argument(
+        '-o', '--output', type=str,
+        metavar='DIR', default='.', help='output directory')
+    views = render.add_mutually_exclusive_group()
+    views.add_argument(
+        '--turntable', type=positive_int,
+        metavar='N', default=1, help='N views evenly spaced around the axis')
+    views.add_argument(
+        '--angles', type=converted(batch.parse_angles),
+        metavar='A[,A...]', help='view angles in degrees')
+    render.add_argument(
+        '--axis', choices=('x', 'y', 'z'), default='y',
+        help='rotation axis, as in the Rotates menu')
+    render.add_argument(
+        '--size', type=converted(batch.parse_size),
+        metavar='WxH', default='{}x{}'.format(*batch.DEFAULT_SIZE),
+        help='image size')
+    render.add_argument(
+        '--zoom', type=float,
+        metavar='K', default=1, help='scene zoom')
+    render.add_argument(
+        '--backend', choices=drawer.BACKENDS, default=drawer.PAINTER,
+        help='figure rendering: painter or software z-buffer')
+    render.add_argument(
+        '-j', '--jobs', type=positive_int,
+        metavar='N', default=None, help='worker processes (default: cpus)')
+
     return parser.parse_args()
 
 
@@ -87,16 +167,26 @@ def main():
         log.setFormatter(logging.Formatter(
             '%(asctime)s [%(levelname)s <%(name)s>] %(message)s'))
 
-        for module in (sys.modules[__name__], editor, drawer):
-            logger = logging.getLogger(module.LOGGER_NAME)
-            logger.setLevel(logging.DEBUG if args.log else logging.ERROR)
-            logger.addHandler(log)
+        # Логгеры модулей (3d-editor.editor и т.д.) передают записи сюда
+        LOGGER.setLevel(logging.DEBUG if args.log else logging.ERROR)
+        LOGGER.addHandler(log)
+
+        if args.command == 'render':
+            LOGGER.info('Batch rendering started')
+            if batch.main(args):
+                sys.exit(ERROR_RENDER)
+            return
 
         LOGGER.info('GUI Application started')
 
         try:
             application = QtWidgets.QApplication(sys.argv)
-            redactor_window = editor.RedactorWindow()
+            # Имя приложения задает каталог данных (автосохранение)
+            application.setApplicationName('3d-editor')
+            redactor_window = editor.RedactorWindow(
+                args.fps, args.profile_frames, args.profile_file,
+                int(args.undo_memory * 2 ** 20), args.autosave,
+                args.autosave_file)
             redactor_window.setMaximumSize(editor.RESOLUTION[0],
                                            editor.RESOLUTION[1])
             redactor_window.show()
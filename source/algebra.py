@@ -1,4 +1,9 @@
+import math
+
+
 class Vector3:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, x: float, y: float, z: float):
         self.x = x
         self.y = y
@@ -31,9 +36,7 @@ class Vector3:
 
     @staticmethod
     def dot_product(v1, v2):
-        t1 = v1.to_tuple()
-        t2 = v2.to_tuple()
-        return sum(i * j for i, j in zip(t1, t2))
+        return v1.x * v2.x + v1.y * v2.y + v1.z * v2.z
 
     def __eq__(self, other):
         return (isinstance(other, Vector3) and self.x == other.x and
@@ -54,13 +57,9 @@ class Vector3:
 
 class Matrix:
     def __init__(self, string: int, column: int, *args: float):
-        self.table = []
-        self.zero_string = [0 for _ in range(column)]
         self.column = column
-        for _ in range(string):
-            self.table.append([])
-        for i in range(column * string):
-            self.table[i // column].append(args[i])
+        self.table = [list(args[i * column:(i + 1) * column])
+                      for i in range(string)]
 
     def __getitem__(self, key):
         return self.table[key]
@@ -95,3 +94,107 @@ class Matrix:
             for element in string:
                 line.append(element)
         return tuple(line)
+
+
+class Matrix3:
+    """Матрица 3x3 с явными формулами умножения и транспонирования."""
+    __slots__ = ('m00', 'm01', 'm02',
+                 'm10', 'm11', 'm12',
+                 'm20', 'm21', 'm22')
+    column = 3
+
+    def __init__(self, m00: float, m01: float, m02: float,
+                 m10: float, m11: float, m12: float,
+                 m20: float, m21: float, m22: float):
+        self.m00, self.m01, self.m02 = m00, m01, m02
+        self.m10, self.m11, self.m12 = m10, m11, m12
+        self.m20, self.m21, self.m22 = m20, m21, m22
+
+    @staticmethod
+    def identity():
+        return Matrix3(1, 0, 0, 0, 1, 0, 0, 0, 1)
+
+    @staticmethod
+    def from_rows(a, b, c):
+        return Matrix3(a.x, a.y, a.z, b.x, b.y, b.z, c.x, c.y, c.z)
+
+    @staticmethod
+    def rotation(axis, angle):
+        """Поворот вида на angle радиан, оси названы как в меню Rotates."""
+        cos, sin = math.cos(angle), math.sin(angle)
+        if axis == 'x':
+            return Matrix3(cos, -sin, 0, sin, cos, 0, 0, 0, 1)
+        if axis == 'y':
+            return Matrix3(cos, 0, sin, 0, 1, 0, -sin, 0, cos)
+        if axis == 'z':
+            return Matrix3(1, 0, 0, 0, cos, -sin, 0, sin, cos)
+        raise ValueError(f'Unknown axis: {axis}')
+
+    @staticmethod
+    def axis_rotation(axis, angle):
+        """Поворот на angle радиан вокруг произвольной оси axis (Vector3)
+        по формуле Родрига."""
+        length = Vector3.distance(axis, Vector3(0, 0, 0))
+        if not length:
+            return Matrix3.identity()
+        x, y, z = axis.x / length, axis.y / length, axis.z / length
+        cos, sin = math.cos(angle), math.sin(angle)
+        t = 1 - cos
+        return Matrix3(t * x * x + cos, t * x * y - sin * z,
+                       t * x * z + sin * y,
+                       t * x * y + sin * z, t * y * y + cos,
+                       t * y * z - sin * x,
+                       t * x * z - sin * y, t * y * z + sin * x,
+                       t * z * z + cos)
+
+    @staticmethod
+    def from_matrix(matrix):
+        return Matrix3(*matrix.to_tuple())
+
+    @property
+    def table(self):
+        return [[self.m00, self.m01, self.m02],
+                [self.m10, self.m11, self.m12],
+                [self.m20, self.m21, self.m22]]
+
+    def __getitem__(self, key):
+        return self.table[key]
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix3):
+            return Matrix3(
+                self.m00 * other.m00 + self.m01 * other.m10 +
+                self.m02 * other.m20,
+                self.m00 * other.m01 + self.m01 * other.m11 +
+                self.m02 * other.m21,
+                self.m00 * other.m02 + self.m01 * other.m12 +
+                self.m02 * other.m22,
+                self.m10 * other.m00 + self.m11 * other.m10 +
+                self.m12 * other.m20,
+                self.m10 * other.m01 + self.m11 * other.m11 +
+                self.m12 * other.m21,
+                self.m10 * other.m02 + self.m11 * other.m12 +
+                self.m12 * other.m22,
+                self.m20 * other.m00 + self.m21 * other.m10 +
+                self.m22 * other.m20,
+                self.m20 * other.m01 + self.m21 * other.m11 +
+                self.m22 * other.m21,
+                self.m20 * other.m02 + self.m21 * other.m12 +
+                self.m22 * other.m22)
+        if isinstance(other, Vector3):
+            x, y, z = other.x, other.y, other.z
+            return Vector3(self.m00 * x + self.m01 * y + self.m02 * z,
+                           self.m10 * x + self.m11 * y + self.m12 * z,
+                           self.m20 * x + self.m21 * y + self.m22 * z)
+        if isinstance(other, Matrix):
+            return Matrix(3, 3, *self.to_tuple()) * other
+
+    def transpose(self):
+        return Matrix3(self.m00, self.m10, self.m20,
+                       self.m01, self.m11, self.m21,
+                       self.m02, self.m12, self.m22)
+
+    def to_tuple(self):
+        return (self.m00, self.m01, self.m02,
+                self.m10, self.m11, self.m12,
+                self.m20, self.m21, self.m22)
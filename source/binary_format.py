@@ -0,0 +1,208 @@
+"""Двоичный колоночный формат модели.
+
+Файл состоит из заголовка и секций-массивов, выровненных на 8 байт,
+поэтому каждую секцию можно прочитать numpy.frombuffer без копирования
+(в том числе из mmap):
+
+    заголовок   magic, версия, поколение, число вершин, фигур и индексов
+    базисы      basis (3x3), display_plate_basis (3x3) - float64
+    начало      origin: x, y, z (float64), цвет (uint8), толщина (uint16)
+    вершины     coords (N, 3) float64, colors uint8, widths uint16
+    фигуры      kinds uint8, colors uint8, widths uint16,
+                offsets uint32 (F + 1) - границы в таблице индексов,
+                radii (F, 2) float64 - rx, ry эллипсов (NaN - не заданы)
+    индексы     uint32 - номера вершин фигур
+
+Общие вершины фигур записываются один раз, фигуры ссылаются на них
+по номеру.
+
+Поколение (uint16) связывает файл с журналом изменений (source/journal.py):
+журнал применяется только к файлу своего поколения.
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b'3DEB'
+VERSION = 1
+EXTENSION = '.3db'
+
+HEADER = struct.Struct('<4sHHIII')
+ORIGIN = struct.Struct('<dddBxHxxxx')
+ALIGNMENT = 8
+
+KINDS = ('Point', 'Line', 'Place', 'Ellipse')
+
+# Массивы записываются кусками по столько строк: преобразованная в
+# нужный тип копия не создается целиком
+WRITE_CHUNK = 2 ** 16
+
+
+def is_binary(prefix):
+    return prefix[:len(MAGIC)] == MAGIC
+
+
+def padding(size):
+    return -size % ALIGNMENT
+
+
+def read_generation(filename):
+    """Поколение двоичного файла; None, если файла нет или он не
+    двоичный."""
+    try:
+        with open(filename, 'rb') as file:
+            prefix = file.read(HEADER.size)
+    except OSError:
+        return None
+    if len(prefix) < HEADER.size or not is_binary(prefix):
+        return None
+    return HEADER.unpack(prefix)[2]
+
+
+def write_array(file, array, dtype, rows=None):
+    """Записывает array (или его строки rows) кусками с выравниванием."""
+    count = len(array) if rows is None else len(rows)
+    size = 0
+    for start in range(0, count, WRITE_CHUNK):
+        end = min(start + WRITE_CHUNK, count)
+        chunk = array[start:end] if rows is None else array[rows[start:end]]
+        data = np.ascontiguousarray(chunk, dtype=dtype).tobytes()
+        file.write(data)
+        size += len(data)
+    file.write(bytes(padding(size)))
+
+
+def figure_table(figures):
+    """Колонки фигур в виде массивов: kinds, colors, widths, offsets
+    (F + 1, границы в indices), indices (номера вершин) и radii (rx, ry
+    эллипсов, NaN - не заданы). Цвет точки здесь 0: он хранится в ее
+    вершине."""
+    count = len(figures)
+    codes = {name: code for code, name in enumerate(KINDS)}
+    kinds = np.fromiter((codes[obj.NAME] for obj in figures),
+                        dtype=np.uint8, count=count)
+    widths = np.fromiter((obj.WIDTH for obj in figures), dtype=np.uint16,
+                         count=count)
+    colors = np.fromiter(
+        (0 if obj.NAME == 'Point' else obj.color.value for obj in figures),
+        dtype=np.uint8, count=count)
+    offsets = np.zeros(count + 1, dtype=np.uint32)
+    np.cumsum(np.fromiter((len(obj.indices) for obj in figures),
+                          dtype=np.intp, count=count), out=offsets[1:])
+    indices = np.fromiter(
+        (index for obj in figures for index in obj.indices),
+        dtype=np.intp, count=int(offsets[-1]))
+    radii = np.full((count, 2), np.nan)
+    for i in np.flatnonzero(kinds == codes['Ellipse']).tolist():
+        obj = figures[i]
+        radii[i] = [np.nan if r is None else r for r in (obj.rx, obj.ry)]
+    return {'kinds': kinds, 'colors': colors, 'widths': widths,
+            'offsets': offsets, 'indices': indices, 'radii': radii}
+
+
+
+def join_tables(tables):
+    """Одна таблица фигур из нескольких (figure_table), идущих подряд."""
+    if not tables:
+        return figure_table([])
+    joined = {name: np.concatenate([table[name] for table in tables])
+              for name in ('kinds', 'colors', 'widths', 'indices', 'radii')}
+    starts = np.cumsum([0] + [int(table['offsets'][-1])
+                              for table in tables[:-1]])
+    joined['offsets'] = np.concatenate(
+        [tables[0]['offsets'][:1]] +
+        [table['offsets'][1:] + start
+         for table, start in zip(tables, starts.tolist())]).astype(np.uint32)
+    return joined
+
+def write(model, file, generation=0, compact=True):
+    """Записывает модель. При compact=False записываются все вершины
+    хранилища с прежними номерами, чтобы к прочитанной модели можно
+    было применить журнал, ссылающийся на вершины по номеру.
+
+    Снимок для записи (Model.save_snapshot) приносит таблицу фигур
+    готовой, иначе она собирается из model.figures."""
+    store = model.vertices
+    table = model.table
+    if table is None:
+        table = figure_table(model.figures)
+    kinds, widths, offsets, radii = (
+        table['kinds'], table['widths'], table['offsets'], table['radii'])
+    colors = table['colors'].copy()
+    indices = table['indices']
+    count = len(kinds)
+    if compact:
+        # В файл попадают только используемые вершины, номера сжимаются
+        used, indices = np.unique(indices, return_inverse=True)
+    else:
+        used = np.arange(store.size)
+    points = kinds == KINDS.index('Point')
+    colors[points] = store.colors[used[indices[offsets[:-1][points]]]]
+
+    origin = model.origin
+    header = [
+        HEADER.pack(MAGIC, VERSION, generation, len(used), count,
+                    len(indices)),
+        np.array([v.to_tuple() for v in model.basis], dtype='<f8'),
+        np.array([v.to_tuple() for v in model.display_plate_basis],
+                 dtype='<f8'),
+        ORIGIN.pack(origin.x, origin.y, origin.z, origin.color.value,
+                    origin.WIDTH)]
+    for section in header:
+        data = section if isinstance(section, bytes) else section.tobytes()
+        file.write(data)
+        file.write(bytes(padding(len(data))))
+    # Вершины выбираются из хранилища по кускам
+    write_array(file, store.coords, '<f8', used)
+    write_array(file, store.colors, 'u1', used)
+    write_array(file, store.widths, '<u2', used)
+    for array, dtype in ((kinds, 'u1'), (colors, 'u1'), (widths, '<u2'),
+                         (offsets, '<u4'), (radii, '<f8'),
+                         (indices, '<u4')):
+        write_array(file, array, dtype)
+
+
+class Reader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = 0
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.buffer, self.position)
+        self.skip(layout.size)
+        return values
+
+    def array(self, dtype, count, shape=None):
+        dtype = np.dtype(dtype)
+        array = np.frombuffer(self.buffer, dtype=dtype, count=count,
+                              offset=self.position)
+        self.skip(dtype.itemsize * count)
+        return array if shape is None else array.reshape(shape)
+
+    def skip(self, size):
+        self.position += size + padding(size)
+
+
+def read(buffer):
+    """Разбирает файл в словарь массивов (без копирования данных)."""
+    reader = Reader(buffer)
+    magic, version, generation, vertex_count, figure_count, index_count = \
+        reader.unpack(HEADER)
+    if magic != MAGIC:
+        raise ValueError('Not a binary model file')
+    if version != VERSION:
+        raise ValueError(f'Unsupported binary model version: {version}')
+    return {
+        'generation': generation,
+        'basis': reader.array('<f8', 9, (3, 3)),
+        'display_plate_basis': reader.array('<f8', 9, (3, 3)),
+        'origin': reader.unpack(ORIGIN),
+        'coords': reader.array('<f8', 3 * vertex_count, (vertex_count, 3)),
+        'vertex_colors': reader.array('u1', vertex_count),
+        'vertex_widths': reader.array('<u2', vertex_count),
+        'kinds': reader.array('u1', figure_count),
+        'colors': reader.array('u1', figure_count),
+        'widths': reader.array('<u2', figure_count),
+        'offsets': reader.array('<u4', figure_count + 1),
+        'radii': reader.array('<f8', 2 * figure_count, (figure_count, 2)),
+        'indices': reader.array('<u4', index_count)}
@@ -0,0 +1,266 @@
+import random
+
+import numpy as np
+
+from .figures import Place
+
+EPSILON = 1e-6
+
+
+def polygon_plane(coords):
+    """Нормаль (по Ньюэллу) и смещение плоскости многоугольника."""
+    following = np.roll(coords, -1, axis=0)
+    normal = np.array([
+        np.sum((coords[:, 1] - following[:, 1]) *
+               (coords[:, 2] + following[:, 2])),
+        np.sum((coords[:, 2] - following[:, 2]) *
+               (coords[:, 0] + following[:, 0])),
+        np.sum((coords[:, 0] - following[:, 0]) *
+               (coords[:, 1] + following[:, 1]))])
+    magnitude = np.linalg.norm(normal)
+    if magnitude < EPSILON:
+        # Вырожденный многоугольник: любая плоскость через его вершины
+        direction = coords[np.argmax(np.linalg.norm(
+            coords - coords[0], axis=1))] - coords[0]
+        axis = np.zeros(3)
+        axis[np.argmin(np.abs(direction))] = 1
+        normal = np.cross(direction, axis)
+        magnitude = np.linalg.norm(normal)
+        if magnitude < EPSILON:
+            normal, magnitude = np.array([0.0, 0.0, 1.0]), 1.0
+    normal = normal / magnitude
+    return normal, float(normal @ coords.mean(axis=0))
+
+
+class Fragment:
+    """Часть плоскости Place после разрезаний.
+
+    edges[i] - лежит ли ребро i -> i + 1 на границе исходной плоскости
+    (ребра разреза не обводятся при отрисовке).
+    """
+    __slots__ = ('place', 'coords', 'edges')
+
+    def __init__(self, place, coords, edges):
+        self.place = place
+        self.coords = coords
+        self.edges = edges
+
+
+class BSPNode:
+    __slots__ = ('normal', 'offset', 'fragments', 'front', 'back')
+
+    def __init__(self, fragment):
+        self.normal, self.offset = polygon_plane(fragment.coords)
+        self.fragments = [fragment]
+        self.front = None
+        self.back = None
+
+
+def split_fragment(fragment, distances):
+    front, back = [], []
+    front_edges, back_edges = [], []
+    count = len(fragment.coords)
+    for i in range(count):
+        j = (i + 1) % count
+        a, b = fragment.coords[i], fragment.coords[j]
+        da, db = distances[i], distances[j]
+        edge = fragment.edges[i]
+        if da >= -EPSILON:
+            front.append(a)
+            front_edges.append(edge and (db >= -EPSILON or da > EPSILON))
+        if da <= EPSILON:
+            back.append(a)
+            back_edges.append(edge and (db <= EPSILON or da < -EPSILON))
+        if (da > EPSILON and db < -EPSILON) or \
+                (da < -EPSILON and db > EPSILON):
+            point = a + (b - a) * (da / (da - db))
+            # Ребро до точки разреза сохраняет свой признак, а ребро
+            # от нее вдоль плоскости разреза - новое
+            if da > 0:
+                front.append(point)
+                front_edges.append(False)
+                back.append(point)
+                back_edges.append(edge)
+            else:
+                back.append(point)
+                back_edges.append(False)
+                front.append(point)
+                front_edges.append(edge)
+    pieces = []
+    for coords, edges in ((front, front_edges), (back, back_edges)):
+        pieces.append(Fragment(fragment.place, np.array(coords),
+                               np.array(edges, dtype=bool))
+                      if len(coords) >= 3 else None)
+    return pieces
+
+
+class BSPTree:
+    """Не зависящее от вида BSP-дерево над плоскостями (Place) модели.
+
+    Дерево строится один раз; при изменении Place удаляются только ее
+    фрагменты и она вставляется заново. Порядок отрисовки от дальних к
+    ближним получается обходом дерева за O(n) для текущего направления
+    взгляда.
+    """
+
+    def __init__(self, seed=0):
+        self.root = None
+        self.random = random.Random(seed)
+        self.places = []
+        self.locations = {}
+        self.node_count = 0
+        self.empty_nodes = 0
+        self.version = 0
+
+        self.figures_version = None
+        self.positions = {}
+        self.indices = np.zeros(0, dtype=np.intp)
+        self.offsets = np.zeros(0, dtype=np.intp)
+        self.versions = np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.places)
+
+    def sync(self, model):
+        """Приводит дерево в соответствие с плоскостями модели."""
+        store = model.vertices
+        changed = []
+        if len(self.places) and self.indices.max(initial=-1) >= store.size:
+            # Вершины перенумерованы: все плоскости вставляются заново
+            for place in self.places:
+                self.remove(place)
+            changed = self.places
+        elif len(self.places):
+            stale = store.versions[self.indices] != self.versions
+            moved = np.flatnonzero(
+                np.logical_or.reduceat(stale, self.offsets))
+            changed = [self.places[i] for i in moved]
+            for place in changed:
+                self.remove(place)
+
+        if self.figures_version != model.figures_version:
+            self.positions = {id(obj): i for i, obj in
+                              enumerate(model.figures)
+                              if isinstance(obj, Place)}
+            places = [obj for obj in model.figures
+                      if isinstance(obj, Place)]
+            current = {id(place) for place in places}
+            for place in self.places:
+                if id(place) not in current and \
+                        id(place) in self.locations:
+                    self.remove(place)
+            changed = [place for place in places
+                       if id(place) not in self.locations]
+            self.track(places, store)
+            self.figures_version = model.figures_version
+        elif changed:
+            self.versions = store.versions[self.indices]
+
+        if not changed:
+            return
+        if self.root is None or 2 * len(changed) > len(self.places):
+            self.build(self.places, store)
+        else:
+            for place in changed:
+                self.insert(place, store)
+            if 2 * self.empty_nodes > self.node_count:
+                self.build(self.places, store)
+
+    def track(self, places, store):
+        self.places = places
+        lengths = np.fromiter((len(place.indices) for place in places),
+                              dtype=np.intp, count=len(places))
+        self.offsets = np.zeros(len(places), dtype=np.intp)
+        np.cumsum(lengths[:-1], out=self.offsets[1:])
+        self.indices = np.fromiter(
+            (index for place in places for index in place.indices),
+            dtype=np.intp, count=int(lengths.sum()))
+        self.versions = store.versions[self.indices]
+
+    def build(self, places, store):
+        self.root = None
+        self.locations = {}
+        self.node_count = 0
+        self.empty_nodes = 0
+        shuffled = list(places)
+        # Случайный порядок вставки дает в среднем сбалансированное дерево
+        self.random.shuffle(shuffled)
+        for place in shuffled:
+            self.insert(place, store)
+
+    def insert(self, place, store):
+        coords = store.coords[place.indices]
+        fragment = Fragment(place, coords,
+                            np.ones(len(coords), dtype=bool))
+        self.locations[id(place)] = []
+        self.version += 1
+        if self.root is None:
+            self.root = self.new_node(fragment)
+            return
+
+        stack = [(self.root, fragment)]
+        while stack:
+            node, fragment = stack.pop()
+            distances = fragment.coords @ node.normal - node.offset
+            if np.all(np.abs(distances) <= EPSILON):
+                if not node.fragments:
+                    self.empty_nodes -= 1
+                node.fragments.append(fragment)
+                self.locations[id(place)].append((node, fragment))
+                continue
+            if np.all(distances >= -EPSILON):
+                pieces = (fragment, None)
+            elif np.all(distances <= EPSILON):
+                pieces = (None, fragment)
+            else:
+                pieces = split_fragment(fragment, distances)
+            for piece, side in zip(pieces, ('front', 'back')):
+                if piece is None:
+                    continue
+                child = getattr(node, side)
+                if child is None:
+                    setattr(node, side, self.new_node(piece))
+                else:
+                    stack.append((child, piece))
+
+    def new_node(self, fragment):
+        node = BSPNode(fragment)
+        self.node_count += 1
+        self.locations[id(fragment.place)].append((node, fragment))
+        return node
+
+    def remove(self, place):
+        for node, fragment in self.locations.pop(id(place), ()):
+            node.fragments.remove(fragment)
+            if not node.fragments:
+                # Пустой узел остается разделителем, пока их не наберется
+                # слишком много для перестроения
+                self.empty_nodes += 1
+        self.version += 1
+
+    def back_to_front(self, direction=None, eye=None):
+        """Фрагменты от дальних к ближним.
+
+        direction - направление взгляда (ортогональная проекция),
+        eye - положение наблюдателя (перспектива).
+        """
+        order = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                order.extend(node)
+                continue
+            if eye is not None:
+                side = node.normal @ eye - node.offset
+            else:
+                side = -(node.normal @ direction)
+            near, far = ((node.front, node.back) if side > 0 else
+                         (node.back, node.front))
+            # Стек: сначала дальнее поддерево, затем узел, затем ближнее
+            if near is not None:
+                stack.append(near)
+            stack.append(node.fragments)
+            if far is not None:
+                stack.append(far)
+        return order
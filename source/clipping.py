@@ -0,0 +1,65 @@
+"""Отсечение фигур ближней плоскостью перспективной проекции.
+
+Вершины задаются однородными координатами вида (x, y, z, w); видимая
+часть - там, где w >= near. В однородных координатах отсечение линейно,
+поэтому точка пересечения ребра с плоскостью - обычная интерполяция.
+"""
+import numpy as np
+
+
+def intersection(a, b, near):
+    """Точка ребра a -> b, в которой w = near."""
+    t = (near - a[3]) / (b[3] - a[3])
+    return a + t * (b - a)
+
+
+def clip_segment(points, near):
+    """Отрезок (2, 4), обрезанный ближней плоскостью; None, если он
+    целиком за ней."""
+    a, b = points
+    if a[3] < near and b[3] < near:
+        return None
+    if a[3] < near:
+        a = intersection(a, b, near)
+    elif b[3] < near:
+        b = intersection(a, b, near)
+    return np.stack((a, b))
+
+
+def clip_polygon(points, near, edges=None):
+    """Многоугольник (K, 4), обрезанный ближней плоскостью (алгоритм
+    Сазерленда - Ходжмена для одной плоскости).
+
+    edges[i] - признак ребра i -> i + 1 (например, обводится ли оно);
+    ребра, лежащие на ближней плоскости, получают False. Возвращает
+    вершины и признаки ребер или None, если многоугольник целиком за
+    плоскостью.
+    """
+    count = len(points)
+    if edges is None:
+        edges = np.ones(count, dtype=bool)
+    inside = points[:, 3] >= near
+    if not inside.any():
+        return None
+    if inside.all():
+        return points, edges
+    result = []
+    flags = []
+    for i in range(count):
+        j = (i + 1) % count
+        if inside[i]:
+            result.append(points[i])
+            flags.append(edges[i])
+            if not inside[j]:
+                # Ребро уходит за плоскость, дальше идет разрез
+                result.append(intersection(points[i], points[j], near))
+                flags.append(False)
+        elif inside[j]:
+            result.append(intersection(points[i], points[j], near))
+            flags.append(edges[i])
+    return np.array(result), np.array(flags, dtype=bool)
+
+
+def to_display(points):
+    """Однородные координаты (K, 4) -> координаты вида (K, 3)."""
+    return points[:, :3] / points[:, 3:]
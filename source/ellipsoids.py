@@ -0,0 +1,106 @@
+"""Параметрическая сетка эллипсоидов.
+
+Эллипс задается двумя противоположными углами коробки; в нее вписан
+эллипсоид с осями вдоль осей мира. Сетка - три главных кольца, контур
+на экране зависит от вида и строится отдельно по квадратичной форме
+проекции.
+"""
+import numpy as np
+
+RING_SEGMENTS = 24
+OUTLINE_SEGMENTS = 32
+
+
+def ring_template(segments=RING_SEGMENTS):
+    """Вершины трех единичных колец в плоскостях yz, xz и xy: массив
+    (3 * segments, 3)."""
+    angles = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    cos, sin = np.cos(angles), np.sin(angles)
+    zero = np.zeros(segments)
+    return np.concatenate((np.stack((zero, cos, sin), axis=1),
+                           np.stack((cos, zero, sin), axis=1),
+                           np.stack((cos, sin, zero), axis=1)))
+
+
+def semi_axes(corners):
+    """Центры и полуоси эллипсоидов по углам коробок (E, 2, 3).
+
+    Плоская коробка (эллипс, нарисованный в плоскости экрана) получает
+    толщину по меньшей из остальных полуосей, чтобы эллипсоид оставался
+    объемным при повороте.
+    """
+    corners = np.asarray(corners, dtype=float).reshape(-1, 2, 3)
+    centers = corners.mean(axis=1)
+    axes = np.abs(corners[:, 1] - corners[:, 0]) / 2
+    flat = axes <= 1e-9
+    thickness = np.where(flat, np.inf, axes).min(axis=1, keepdims=True)
+    thickness[~np.isfinite(thickness)] = 0
+    return centers, np.where(flat, thickness, axes)
+
+
+def meshes(centers, axes, template=None):
+    """Вершины колец эллипсоидов: (E, K, 3)."""
+    if template is None:
+        template = ring_template()
+    return centers[:, None, :] + axes[:, None, :] * template[None]
+
+
+def front_facing(template, axes, display_matrix):
+    """Маска вершин колец, обращенных к зрителю: (E, K).
+
+    Нормаль эллипсоида в точке center + axes * u направлена по u / axes;
+    к зрителю обращены вершины, у которых нормаль в координатах экрана
+    смотрит в сторону уменьшения глубины.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normals = np.nan_to_num(template[None] / axes[:, None, :])
+    return normals @ display_matrix[2] <= 0
+
+
+def outline_forms(axes, display_matrix, zoom):
+    """Матрицы S (E, 2, 2) контуров на экране: контур - это точки
+    center + y, для которых y^T S^-1 y = 1."""
+    projection = zoom * display_matrix[None, :2, :] * axes[:, None, :]
+    return projection @ projection.transpose(0, 2, 1)
+
+
+def outlines(centers, forms, segments=OUTLINE_SEGMENTS):
+    """Контуры эллипсоидов на экране: (E, segments, 2)."""
+    values, vectors = np.linalg.eigh(forms)
+    scale = vectors * np.sqrt(np.maximum(values, 0))[:, None, :]
+    angles = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    circle = np.stack((np.cos(angles), np.sin(angles)))
+    return centers[:, None, :] + (scale @ circle).transpose(0, 2, 1)
+
+
+def front_surfaces(axes, display_matrix, depths, scales, zoom):
+    """Передние поверхности эллипсоидов для буфера глубины: (E, 7).
+
+    Глубина поверхности в точке экрана center + u равна
+    L(u) - sqrt(P(u)), где L(u) = c0 + c1 ux + c2 uy, а
+    P(u) = c3 ux^2 + c4 ux uy + c5 uy^2 + c6; на контуре P = 0. depths -
+    глубины центров, scales - множители перспективы (глубина умножается
+    на них, как у всего эллипсоида), zoom - масштаб экрана (E,).
+    """
+    inverse = 1 / np.maximum(axes, 1e-9) ** 2
+    quadrics = (display_matrix[None] * inverse[:, None, :]) @ \
+        display_matrix.T
+    q1, q2, qz = quadrics[:, 2, 0], quadrics[:, 2, 1], quadrics[:, 2, 2]
+    g = scales / (qz * zoom)
+    return np.stack((
+        scales * depths, -g * q1, -g * q2,
+        g * g * (q1 * q1 - qz * quadrics[:, 0, 0]),
+        2 * g * g * (q1 * q2 - qz * quadrics[:, 0, 1]),
+        g * g * (q2 * q2 - qz * quadrics[:, 1, 1]),
+        scales * scales / qz), axis=1)
+
+
+def outline_extents(forms):
+    """Полуширина и полувысота контуров: (E, 2)."""
+    return np.sqrt(np.maximum(np.diagonal(forms, axis1=1, axis2=2), 0))
+
+
+def inverse_forms(forms):
+    """S^-1 для проверки попадания; вырожденный контур считается
+    эллипсом толщиной в пиксель."""
+    return np.linalg.inv(forms + np.eye(2)[None])
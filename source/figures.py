@@ -1,8 +1,20 @@
 import math
+import threading
 
 from .algebra import Vector3
+from .vertices import VertexStore
+from . import ellipsoids
 from enum import Enum
 
+# Точки ближе этого по каждой координате считаются совпадающими
+CLOSE_TOLERANCE = 1e-5
+
+# Точки вне модели (начало координат из заголовка файла и т.п.) берут
+# вершину из общего хранилища, а не заводят каждая свое. Такие точки
+# создаются и в потоке чтения, поэтому добавление идет под замком
+LOOSE_STORE = VertexStore()
+LOOSE_LOCK = threading.Lock()
+
 
 class Color(Enum):
     BLACK = 0
@@ -13,23 +25,83 @@ class Color(Enum):
 
 
 class Point:
-    WIDTH = 10
     NAME = 'Point'
+    __slots__ = ('store', 'index', 'figure_id')
 
     def __init__(self, x: int, y: int, z: int,
                  color=Color.BLACK,
-                 width=WIDTH):
-        self.x = x
-        self.y = y
-        self.z = z
-        self.color = color
-        self.WIDTH = width
+                 width=10, store=None):
+        if store is None:
+            with LOOSE_LOCK:
+                self.index = LOOSE_STORE.add(x, y, z, color.value, width)
+            self.store = LOOSE_STORE
+        else:
+            self.index = store.add(x, y, z, color.value, width)
+            self.store = store
+        self.figure_id = None
+
+    @classmethod
+    def from_index(cls, store, index):
+        point = cls.__new__(cls)
+        point.store = store
+        point.index = index
+        point.figure_id = None
+        return point
+
+    @property
+    def x(self):
+        return float(self.store.coords[self.index, 0])
+
+    @x.setter
+    def x(self, value):
+        self.store.coords[self.index, 0] = value
+        self.store.touch(self.index)
+
+    @property
+    def y(self):
+        return float(self.store.coords[self.index, 1])
+
+    @y.setter
+    def y(self, value):
+        self.store.coords[self.index, 1] = value
+        self.store.touch(self.index)
+
+    @property
+    def z(self):
+        return float(self.store.coords[self.index, 2])
+
+    @z.setter
+    def z(self, value):
+        self.store.coords[self.index, 2] = value
+        self.store.touch(self.index)
+
+    @property
+    def color(self):
+        return Color(int(self.store.colors[self.index]))
+
+    @color.setter
+    def color(self, value):
+        self.store.colors[self.index] = value.value
+
+    @property
+    def WIDTH(self):
+        return int(self.store.widths[self.index])
+
+    @WIDTH.setter
+    def WIDTH(self, value):
+        self.store.widths[self.index] = value
 
     def __add__(self, other):
         if isinstance(other, Vector3):
-            self.x += other.x
-            self.y += other.y
-            self.z += other.z
+            self.store.move(self.index, (other.x, other.y, other.z))
+
+    @property
+    def indices(self):
+        return [self.index]
+
+    @property
+    def points(self):
+        return [self]
 
     def distance_to_viewer(self, model):
         display_p = model.display_vector(self.to_vector3())
@@ -50,19 +122,20 @@ class Point:
     def __str__(self):
         return f'pt,{int(self.x)},{int(self.y)},{int(self.z)}'
 
+    # Точки сравниваются как ссылки на одну вершину хранилища
     def __hash__(self):
-        return hash((self.x, self.y, self.x))
+        return hash((id(self.store), self.index))
 
     def __eq__(self, other):
         if not isinstance(other, Point):
             return NotImplemented
-        return self.x == other.x and self.y == other.y and self.z == other.z
+        return self.store is other.store and self.index == other.index
 
     # Пока не актуально
     def close_equal(self, point):
-        return abs(self.x - point.x) < 1e-5 and \
-               abs(self.y - point.y) < 1e-5 and \
-               abs(self.z - point.z) < 1e-5
+        return abs(self.x - point.x) < CLOSE_TOLERANCE and \
+               abs(self.y - point.y) < CLOSE_TOLERANCE and \
+               abs(self.z - point.z) < CLOSE_TOLERANCE
 
 
 class Line:
@@ -72,15 +145,37 @@ class Line:
     def __init__(self, start: Point, end: Point,
                  color=Color.BLACK,
                  width=WIDTH):
-        self.start = start
-        self.end = end
+        self.store = start.store
+        self.indices = [start.index, self.store.adopt(end)]
         self.color = color
         self.WIDTH = width
+        self.figure_id = None
+
+    @classmethod
+    def from_indices(cls, store, indices, color=Color.BLACK, width=WIDTH):
+        line = cls.__new__(cls)
+        line.store = store
+        line.indices = indices
+        line.color = color
+        line.WIDTH = width
+        line.figure_id = None
+        return line
+
+    @property
+    def start(self):
+        return Point.from_index(self.store, self.indices[0])
+
+    @property
+    def end(self):
+        return Point.from_index(self.store, self.indices[1])
 
     def __add__(self, other):
         if isinstance(other, Vector3):
-            self.start + other
-            self.end + other
+            self.store.move(self.indices, (other.x, other.y, other.z))
+
+    @property
+    def points(self):
+        return [self.start, self.end]
 
     # Нужно во время отладки
     def __str__(self):
@@ -114,14 +209,30 @@ class Place:
                  color=Color.BLACK,
                  width=WIDTH):
         if points:
-            self.points = [point for point in points]
+            self.store = points[0].store
+            self.indices = [self.store.adopt(point) for point in points]
         self.color = color
         self.WIDTH = width
+        self.figure_id = None
+
+    @classmethod
+    def from_indices(cls, store, indices, color=Color.BLACK, width=WIDTH):
+        place = cls.__new__(cls)
+        place.store = store
+        place.indices = indices
+        place.color = color
+        place.WIDTH = width
+        place.figure_id = None
+        return place
+
+    @property
+    def points(self):
+        return [Point.from_index(self.store, index)
+                for index in self.indices]
 
     def __add__(self, other):
         if isinstance(other, Vector3):
-            for point in self.points:
-                point + other
+            self.store.move(self.indices, (other.x, other.y, other.z))
 
     def __str__(self):
         str_place = 'pl!'
@@ -152,34 +263,50 @@ class Ellipse:
 
     def __init__(self, topLeft: Point, bottomRight: Point,
                  color=Color.BLACK, width=WIDTH):
+        # Размеры из старых версий; хранятся только ради формата файлов
         self.rx = None
         self.ry = None
         self.WIDTH = width
-        self.extra_el = []
 
         if topLeft and bottomRight:
-            self.topLeft = topLeft
-            self.bottomRight = bottomRight
+            self.store = topLeft.store
+            self.indices = [topLeft.index, self.store.adopt(bottomRight)]
         self.color = color
+        self.figure_id = None
+
+    @classmethod
+    def from_indices(cls, store, indices, color=Color.BLACK, width=WIDTH):
+        ellipse = cls(None, None, color, width)
+        ellipse.store = store
+        ellipse.indices = indices
+        return ellipse
+
+    @property
+    def topLeft(self):
+        return Point.from_index(self.store, self.indices[0])
+
+    @property
+    def bottomRight(self):
+        return Point.from_index(self.store, self.indices[1])
 
     def set_move_info(self, rx: int, ry: int):
         self.rx = rx
         self.ry = ry
 
-    def add_extra_el(self, el):
-        self.extra_el.append(el)
-
     def __add__(self, other):
         if isinstance(other, Vector3):
-            self.topLeft + other
-            self.bottomRight + other
+            self.store.move(self.indices, (other.x, other.y, other.z))
             self.rx = None
             self.ry = None
 
+    @property
+    def points(self):
+        return [self.topLeft, self.bottomRight]
+
     def __str__(self):
         str_el = 'el!'
-        str_el += f'|{str(self.pt_topLeft)}|'
-        str_el += f'|{str(self.pt_bottomRight)}|'
+        str_el += f'|{str(self.topLeft)}|'
+        str_el += f'|{str(self.bottomRight)}|'
         return str_el
 
     def to_dict(self):
@@ -191,17 +318,10 @@ class Ellipse:
                 "color": self.color.value,
                 "width": self.WIDTH}
 
-    def distance_to_viewer(self, model):
-        points = [self.topLeft, self.bottomRight]
-        for el in self.extra_el:
-            points.append(el.topLeft)
-            points.append(el.bottomRight)
-        z_min = None
-        for point in self.points:
-            display_p = model.display_vector(point.to_vector3())
-            if z_min is None:
-                z_min = display_p[2]
-            if z_min < display_p[2]:
-                z_min = display_p[2]
+    def mesh(self):
+        """Вершины колец вписанного эллипсоида: (K, 3)."""
+        centers, axes = ellipsoids.semi_axes(self.store.coords[self.indices])
+        return ellipsoids.meshes(centers, axes)[0]
 
-        return z_min
+    def distance_to_viewer(self, model):
+        return float(model.display_vectors(self.mesh())[:, 2].max())
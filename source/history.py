@@ -0,0 +1,275 @@
+"""История изменений модели для отмены и повтора.
+
+Каждая запись хранит только само изменение (фигуры, сдвиг, координаты
+затронутых вершин или старый и новый цвет), поэтому отмена стоит
+O(изменения), а не O(сцены). Записи лежат в кольцевом буфере: при
+превышении лимита памяти отбрасываются самые старые.
+"""
+from collections import deque
+import sys
+
+# Лимит памяти истории по умолчанию, байт
+DEFAULT_MEMORY = 8 * 2 ** 20
+
+
+class AddFigure:
+    __slots__ = ('figure',)
+
+    def __init__(self, figure):
+        self.figure = figure
+
+    def undo(self, model):
+        model.detach_figure(self.figure)
+
+    def redo(self, model):
+        model.attach_figure(self.figure)
+
+    def merge(self, other):
+        return False
+
+    def size(self):
+        return record_size(self) + figure_size(self.figure)
+
+
+class RemoveFigure:
+    __slots__ = ('figure', 'position')
+
+    def __init__(self, figure, position):
+        self.figure = figure
+        self.position = position
+
+    def undo(self, model):
+        model.attach_figure(self.figure, self.position)
+
+    def redo(self, model):
+        model.detach_figure(self.figure)
+
+    def merge(self, other):
+        return False
+
+    def size(self):
+        return record_size(self) + figure_size(self.figure)
+
+
+class MoveFigure:
+    """Сдвиг фигуры на вектор через ее __add__. Сдвиги одной фигуры
+    подряд (кадры одного перетаскивания) сливаются в один."""
+    __slots__ = ('figure', 'delta')
+
+    def __init__(self, figure, delta):
+        self.figure = figure
+        self.delta = delta
+
+    def undo(self, model):
+        model.shift_figure(self.figure, self.delta * -1)
+
+    def redo(self, model):
+        model.shift_figure(self.figure, self.delta)
+
+    def merge(self, other):
+        if not isinstance(other, MoveFigure) or \
+                other.figure is not self.figure:
+            return False
+        self.delta = self.delta + other.delta
+        return True
+
+    def size(self):
+        return record_size(self) + sys.getsizeof(self.delta)
+
+
+class RecolorFigure:
+    __slots__ = ('figure', 'old', 'new')
+
+    def __init__(self, figure, old, new):
+        self.figure = figure
+        self.old = old
+        self.new = new
+
+    def undo(self, model):
+        model.set_figure_color(self.figure, self.old)
+
+    def redo(self, model):
+        model.set_figure_color(self.figure, self.new)
+
+    def merge(self, other):
+        return False
+
+    def size(self):
+        return record_size(self)
+
+
+class RemoveFigures:
+    """Удаление нескольких фигур; positions - их места в списке модели
+    по возрастанию."""
+    __slots__ = ('figures', 'positions')
+
+    def __init__(self, figures, positions):
+        self.figures = figures
+        self.positions = positions
+
+    def undo(self, model):
+        model.attach_figures(self.figures, self.positions)
+
+    def redo(self, model):
+        model.detach_figures(self.figures)
+
+    def merge(self, other):
+        return False
+
+    def size(self):
+        return (record_size(self) + sys.getsizeof(self.positions) +
+                sum(figure_size(figure) for figure in self.figures))
+
+
+class MoveVertices:
+    """Сдвиг набора вершин на вектор. Сдвиги того же набора подряд
+    (кадры одного перетаскивания) сливаются в один."""
+    __slots__ = ('indices', 'delta')
+
+    def __init__(self, indices, delta):
+        self.indices = indices
+        self.delta = delta
+
+    def undo(self, model):
+        model.shift_vertices(self.indices, -self.delta)
+
+    def redo(self, model):
+        model.shift_vertices(self.indices, self.delta)
+
+    def merge(self, other):
+        if not isinstance(other, MoveVertices) or \
+                other.indices is not self.indices:
+            return False
+        self.delta = self.delta + other.delta
+        return True
+
+    def size(self):
+        return record_size(self) + self.indices.nbytes + self.delta.nbytes
+
+
+class SetVertices:
+    """Поворот или масштаб набора вершин: хранятся их старые и новые
+    координаты, так что отмена точна."""
+    __slots__ = ('indices', 'old', 'new')
+
+    def __init__(self, indices, old, new):
+        self.indices = indices
+        self.old = old
+        self.new = new
+
+    def undo(self, model):
+        model.set_vertices(self.indices, self.old)
+
+    def redo(self, model):
+        model.set_vertices(self.indices, self.new)
+
+    def merge(self, other):
+        if not isinstance(other, SetVertices) or \
+                other.indices is not self.indices:
+            return False
+        self.new = other.new
+        return True
+
+    def size(self):
+        return (record_size(self) + self.indices.nbytes +
+                self.old.nbytes + self.new.nbytes)
+
+
+class RecolorFigures:
+    __slots__ = ('figures', 'old', 'new')
+
+    def __init__(self, figures, old, new):
+        self.figures = figures
+        self.old = old
+        self.new = new
+
+    def undo(self, model):
+        model.set_figure_colors(self.figures, self.old)
+
+    def redo(self, model):
+        model.set_figure_colors(self.figures, [self.new] * len(self.figures))
+
+    def merge(self, other):
+        return False
+
+    def size(self):
+        return (record_size(self) + sys.getsizeof(self.figures) +
+                sys.getsizeof(self.old))
+
+
+def record_size(record):
+    return sys.getsizeof(record)
+
+
+def figure_size(figure):
+    """Примерная память фигуры, которую держит запись: после удаления
+    из модели она живет только в истории."""
+    indices = getattr(figure, 'indices', ())
+    return sys.getsizeof(figure) + 8 * len(indices)
+
+
+class History:
+    """Стек отмены в кольцевом буфере с лимитом памяти и стек повтора.
+
+    Новая запись сливается с предыдущей, если та это допускает и с
+    момента seal() не было новых действий пользователя.
+    """
+
+    def __init__(self, memory=DEFAULT_MEMORY):
+        self.memory = memory
+        self.done = deque()
+        self.undone = []
+        self.used = 0
+        self.sealed = True
+
+    def __len__(self):
+        return len(self.done)
+
+    def push(self, record):
+        self.undone.clear()
+        if not self.sealed and self.done:
+            top = self.done[-1]
+            size = top.size()
+            if top.merge(record):
+                self.used += top.size() - size
+                return
+        self.done.append(record)
+        self.used += record.size()
+        self.sealed = False
+        self.trim()
+
+    def trim(self):
+        while self.used > self.memory and self.done:
+            self.used -= self.done.popleft().size()
+
+    def seal(self):
+        """Завершает текущее действие: следующая запись не сольется
+        с предыдущей."""
+        self.sealed = True
+
+    def undo(self, model):
+        if not self.done:
+            return False
+        record = self.done.pop()
+        self.used -= record.size()
+        record.undo(model)
+        self.undone.append(record)
+        self.sealed = True
+        return True
+
+    def redo(self, model):
+        if not self.undone:
+            return False
+        record = self.undone.pop()
+        record.redo(model)
+        self.done.append(record)
+        self.used += record.size()
+        self.sealed = True
+        self.trim()
+        return True
+
+    def clear(self):
+        self.done.clear()
+        self.undone.clear()
+        self.used = 0
+        self.sealed = True
@@ -0,0 +1,332 @@
+"""Журнал изменений модели.
+
+Журнал лежит рядом с двоичным файлом модели (основой) и дописывается
+короткими JSON-записями о каждом изменении: новые вершины, добавление и
+удаление фигур, сдвиги и новые координаты вершин, перекраска, поворот
+вида, склейка точек. Так сохранение одной правки стоит O(правки), а не
+O(сцены).
+
+Первая запись журнала - поколение основы (см. binary_format); журнал
+применяется только к основе своего поколения. Записи сбрасываются на
+диск (fsync) пачками, поэтому при сбое теряется не больше одной пачки;
+оборванная последняя строка при чтении отбрасывается.
+
+Когда журнал разрастается, модель целиком записывается в новую основу
+следующего поколения (сжатие). Пока основа пишется, записи идут и в
+старый журнал, и в новый (файл .next); новый журнал заменяет старый
+только после того, как основа записана. При сбое в любой момент на диске
+остается основа и журнал одного поколения.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from .algebra import Vector3
+from .figures import Color, Ellipse, Line, Place, Point
+from . import binary_format
+
+SUFFIX = '.journal'
+NEXT_SUFFIX = '.next'
+
+# Записи сбрасываются на диск каждые SYNC_RECORDS записей или
+# SYNC_INTERVAL секунд
+SYNC_RECORDS = 64
+SYNC_INTERVAL = 1.0
+# Размер журнала, после которого основа переписывается, байт
+COMPACT_SIZE = 8 * 2 ** 20
+
+GENERATIONS = 2 ** 16
+
+CLASSES = {'Line': Line, 'Place': Place, 'Ellipse': Ellipse}
+
+
+def journal_path(base):
+    return base + SUFFIX
+
+
+def next_generation(base):
+    generation = binary_format.read_generation(base)
+    return 0 if generation is None else (generation + 1) % GENERATIONS
+
+
+def encode(entry):
+    return json.dumps(entry, separators=(',', ':')) + '\n'
+
+
+def read_entries(path, generation):
+    """Записи журнала path поколения generation и длина его целой части
+    в байтах; None, если журнала нет или он от другой основы."""
+    try:
+        file = open(path, 'rb')
+    except OSError:
+        return None
+    entries = []
+    end = 0
+    with file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if not end and entry != ['base', generation]:
+                return None
+            entries.append(entry)
+            end += len(line)
+    if not end:
+        return None
+    return entries[1:], end
+
+
+def apply(model, entry):
+    """Повторяет одну запись журнала на модели."""
+    operation = entry[0]
+    store = model.vertices
+    if operation == 'vertices':
+        start, rows = entry[1], entry[2]
+        if start != store.size:
+            raise ValueError(f'Journal vertices start at {start}, '
+                             f'model has {store.size}')
+        for x, y, z, color, width in rows:
+            store.add(x, y, z, color, width)
+    elif operation == 'attach':
+        position, name, indices, color, width = entry[1:]
+        if name == 'Point':
+            figure = Point.from_index(store, indices[0])
+        else:
+            figure = CLASSES[name].from_indices(store, indices,
+                                                Color(color), width)
+        figure.figure_id = model.next_figure_id
+        model.next_figure_id += 1
+        model.attach_figure(figure, position)
+    elif operation == 'detach':
+        model.detach_figure(model.figures[entry[1]])
+    elif operation == 'detach_many':
+        figures = model.figures
+        model.detach_figures([figures[i] for i in entry[1]])
+    elif operation == 'move':
+        indices, x, y, z = entry[1:]
+        store.move(indices, (x, y, z))
+    elif operation == 'coords':
+        indices = np.asarray(entry[1], dtype=np.intp)
+        store.coords[indices] = entry[2]
+        store.touch(indices)
+    elif operation == 'color':
+        model.set_figure_color(model.figures[entry[1]], Color(entry[2]))
+    elif operation == 'colors':
+        figures = model.figures
+        model.set_figure_colors([figures[i] for i in entry[1]],
+                                [Color(value) for value in entry[2]])
+    elif operation == 'view':
+        model.display_plate_basis = [Vector3(*row) for row in entry[1]]
+        model.update_display_matrix(None)
+    elif operation == 'weld':
+        model.weld(entry[1])
+    else:
+        raise ValueError(f'Unknown journal record: {operation}')
+
+
+def find(base):
+    """Журнал, подходящий к основе base: (путь, записи, длина целой
+    части) или None.
+
+    Журнал .next подходит, если сбой случился после записи новой основы,
+    но до замены им старого журнала.
+    """
+    generation = binary_format.read_generation(base)
+    if generation is None:
+        return None
+    for path in (journal_path(base), journal_path(base) + NEXT_SUFFIX):
+        found = read_entries(path, generation)
+        if found is not None:
+            return (path,) + found
+    return None
+
+
+def apply_all(model, entries):
+    journal, model.journal = model.journal, None
+    try:
+        for entry in entries:
+            apply(model, entry)
+    finally:
+        model.journal = journal
+    return len(entries)
+
+
+def replay(model, base):
+    """Применяет к только что открытой из base модели ее журнал, ничего
+    не меняя на диске. Возвращает число примененных записей."""
+    found = find(base)
+    return 0 if found is None else apply_all(model, found[1])
+
+
+def restore(model, base):
+    """Применяет журнал к открытой из base модели и готовит его к
+    продолжению: файл .next заменяет журнал, оборванный хвост
+    отрезается. Модель может быть еще не видна пользователю (чтение в
+    фоне); вести журнал начинает attach. Возвращает поколение основы и
+    число примененных записей."""
+    generation = binary_format.read_generation(base)
+    path = journal_path(base)
+    found = find(base)
+    if found is None:
+        Journal.create(path, generation).close()
+        return generation, 0
+    count = apply_all(model, found[1])
+    if found[0] != path:
+        os.replace(found[0], path)
+    # Оборванный хвост отрезается, чтобы дописывать с целой строки
+    with open(path, 'r+b') as file:
+        file.truncate(found[2])
+    return generation, count
+
+
+def attach(model, base, generation):
+    """Продолжает журнал основы base, подготовленный restore."""
+    model.journal = Journal(model, base, generation,
+                            open(journal_path(base), 'a', encoding='utf8'))
+
+
+def resume(model, base):
+    """Применяет журнал к открытой из base модели и продолжает вести его.
+    Возвращает число примененных записей."""
+    generation, count = restore(model, base)
+    attach(model, base, generation)
+    return count
+
+
+class Journal:
+    """Открытый журнал модели с основой base поколения generation.
+
+    file - журнал текущей основы (None, пока первая основа еще пишется),
+    next - журнал основы, которая пишется сейчас. После ошибки записи
+    журнал перестает писать, а ошибка остается в error.
+    """
+
+    def __init__(self, model, base, generation, file=None):
+        self.base = base
+        self.generation = generation
+        self.file = file
+        self.next = None
+        self.next_generation = None
+        self.store = model.vertices
+        self.known = self.store.size
+        self.unsynced = 0
+        self.synced = time.monotonic()
+        self.error = None
+
+    @staticmethod
+    def create(path, generation):
+        file = open(path, 'w', encoding='utf8')
+        file.write(encode(['base', generation]))
+        return file
+
+    @classmethod
+    def start(cls, model, base):
+        """Новый журнал для модели, которая сейчас будет записана в base
+        (следующего поколения): до конца записи он остается файлом .next.
+        """
+        journal = cls(model, base, None)
+        journal.begin_compaction(next_generation(base))
+        return journal
+
+    @property
+    def size(self):
+        file = self.file or self.next
+        return file.tell()
+
+    @property
+    def compacting(self):
+        return self.next is not None
+
+    def record(self, model, entry):
+        if self.error is not None:
+            return
+        store = model.vertices
+        if store is not self.store:
+            # Склейка точек заменила хранилище; она повторяется при
+            # чтении журнала, и ее вершины записывать не нужно
+            self.store = store
+            self.known = store.size
+        lines = []
+        if store.size > self.known:
+            size = store.size
+            rows = [[x, y, z, color, width] for (x, y, z), color, width
+                    in zip(store.coords[self.known:size].tolist(),
+                           store.colors[self.known:size].tolist(),
+                           store.widths[self.known:size].tolist())]
+            lines.append(encode(['vertices', self.known, rows]))
+            self.known = size
+        lines.append(encode(list(entry)))
+        try:
+            for file in (self.file, self.next):
+                if file is not None:
+                    file.writelines(lines)
+        except OSError as e:
+            self.error = e
+            return
+        self.unsynced += 1
+        if self.unsynced >= SYNC_RECORDS or \
+                time.monotonic() - self.synced >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        """Сбрасывает накопленные записи на диск."""
+        if self.error is not None:
+            return
+        try:
+            for file in (self.file, self.next):
+                if file is not None:
+                    file.flush()
+                    os.fsync(file.fileno())
+        except OSError as e:
+            self.error = e
+            return
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+    def needs_compaction(self):
+        return not self.compacting and self.size > COMPACT_SIZE
+
+    def begin_compaction(self, generation=None):
+        """Начинает новый журнал для основы следующего поколения;
+        возвращает это поколение. Основу записывает вызывающий (снимок
+        модели, снятый сейчас, с compact=False)."""
+        if generation is None:
+            generation = (self.generation + 1) % GENERATIONS
+        self.next_generation = generation
+        self.next = self.create(journal_path(self.base) + NEXT_SUFFIX,
+                                generation)
+        return generation
+
+    def finish_compaction(self):
+        """Новая основа записана: новый журнал заменяет старый."""
+        self.next.flush()
+        os.fsync(self.next.fileno())
+        os.replace(self.next.name, journal_path(self.base))
+        if self.file is not None:
+            self.file.close()
+        self.file, self.next = self.next, None
+        self.generation = self.next_generation
+        self.next_generation = None
+
+    def abort_compaction(self):
+        """Основа не записана: новый журнал выбрасывается."""
+        self.next.close()
+        try:
+            os.remove(self.next.name)
+        except OSError:
+            pass
+        self.next = None
+        self.next_generation = None
+
+    def close(self):
+        if self.compacting:
+            self.abort_compaction()
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
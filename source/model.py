@@ -1,7 +1,33 @@
 from .algebra import *
 from .figures import *
+from .vertices import VertexStore
+from . import binary_format
+from .welding import weld_store
+from .history import (AddFigure, History, MoveFigure, MoveVertices,
+                      RecolorFigure, RecolorFigures, RemoveFigure,
+                      RemoveFigures, SetVertices)
+from .journal import replay as replay_journal
 from enum import Enum
+import copy
+import gc
+import io
+import itertools
 import json
+import mmap
+
+import numpy as np
+
+
+HEADER_LINES = 3
+# В перспективе видны точки не ближе стольких единиц к наблюдателю
+NEAR_PLANE = 1.0
+
+
+def orthonormalize(matrix):
+    """Ближайшая к matrix ортогональная матрица (U V^T из SVD); знак
+    определителя, то есть ориентация базиса, сохраняется."""
+    u, _, vt = np.linalg.svd(matrix)
+    return u @ vt
 
 
 class Color(Enum):
@@ -13,14 +39,31 @@ class Color(Enum):
 
 
 class Model:
-    def __init__(self):
+    def __init__(self, history=None):
         self.matrix_of_display = None
+        self.display_matrix_array = None
+        self.display_version = 0
         self.display_plate_basis = None
         self.basis = (Vector3(1, 0, 0), Vector3(0, 1, 0), Vector3(0, 0, 1))
         self.origin = Point(0, 0, 0)
         self.init_display_settings()
+        self.vertices = VertexStore()
         self.figures = []
+        self.figures_version = 0
+        self.next_figure_id = 0
+        # Наблюдатель перспективной проекции стоит перед плоскостью экрана
+        # на расстоянии |viewer_position|
         self.viewer_position = Vector3(0, 0, 2000)
+        self.perspective = False
+        self.view_transform = None
+        self.history = History() if history is None else history
+        # Журнал изменений (source/journal.py), если модель его ведет
+        self.journal = None
+        # Таблица фигур снимка для записи (save_snapshot); пока она
+        # задана, фигуры снимка еще не построены
+        self.table = None
+        # Хранилище модели, с которой снят снимок
+        self.source = None
 
     def init_display_settings(self):
         self.display_plate_basis = [Vector3(0, 0, 1),
@@ -29,122 +72,556 @@ class Model:
         self.matrix_of_display = None
         self.update_display_matrix(None)
 
+    def add_figure(self, figure):
+        figure.figure_id = self.next_figure_id
+        self.next_figure_id += 1
+        self.attach_figure(figure)
+        self.history.push(AddFigure(figure))
+        return figure
+
+    def attach_figure(self, figure, position=None):
+        """Вставляет фигуру в список без записи в историю."""
+        if position is None:
+            self.figures.append(figure)
+        else:
+            self.figures.insert(position, figure)
+        self.figures_version += 1
+        self.log('attach', position, figure.NAME, list(figure.indices),
+                 figure.color.value, figure.WIDTH)
+
+    def detach_figure(self, figure):
+        """Убирает фигуру из списка без записи в историю, возвращает
+        ее место в списке."""
+        # Точки сравниваются по вершине, а нужна именно эта фигура
+        position = next(i for i, obj in enumerate(self.figures)
+                        if obj is figure)
+        del self.figures[position]
+        self.figures_version += 1
+        self.log('detach', position)
+        return position
+
+    def remove_figure(self, figure):
+        self.history.push(RemoveFigure(figure, self.detach_figure(figure)))
+
+    def move_figure(self, figure, delta: Vector3):
+        self.shift_figure(figure, delta)
+        self.history.push(MoveFigure(figure, delta))
+
+    def shift_figure(self, figure, delta: Vector3):
+        """Сдвигает фигуру без записи в историю."""
+        figure + delta
+        self.log('move', list(figure.indices), delta.x, delta.y, delta.z)
+
+    def recolor_figure(self, figure, color):
+        old = figure.color
+        if old != color:
+            self.set_figure_color(figure, color)
+            self.history.push(RecolorFigure(figure, old, color))
+
+    def set_figure_color(self, figure, color):
+        figure.color = color
+        self.figures_version += 1
+        if self.journal is not None:
+            position = next(i for i, obj in enumerate(self.figures)
+                            if obj is figure)
+            self.log('color', position, color.value)
+
+    def figure_vertices(self, figures):
+        """Номера вершин фигур без повторов: общая вершина нескольких
+        фигур входит один раз."""
+        return np.unique(np.fromiter(
+            (index for obj in figures for index in obj.indices),
+            dtype=np.intp))
+
+    def figure_positions(self, figures):
+        """Места фигур в списке модели за один проход по нему."""
+        positions = {id(obj): i for i, obj in enumerate(self.figures)}
+        return [positions[id(obj)] for obj in figures]
+
+    def remove_figures(self, figures):
+        figures, positions = self.detach_figures(figures)
+        self.history.push(RemoveFigures(figures, positions))
+
+    def detach_figures(self, figures):
+        """Убирает фигуры из списка одним проходом без записи в историю.
+        Возвращает их в порядке списка и их места в нем."""
+        ids = {id(obj) for obj in figures}
+        positions = [i for i, obj in enumerate(self.figures)
+                     if id(obj) in ids]
+        removed = [self.figures[i] for i in positions]
+        self.figures = [obj for obj in self.figures if id(obj) not in ids]
+        self.figures_version += 1
+        self.log('detach_many', positions)
+        return removed, positions
+
+    def attach_figures(self, figures, positions):
+        """Возвращает фигуры на места positions (по возрастанию) одним
+        проходом без записи в историю."""
+        merged = []
+        rest = iter(self.figures)
+        for figure, position in zip(figures, positions):
+            merged.extend(itertools.islice(rest, position - len(merged)))
+            merged.append(figure)
+        merged.extend(rest)
+        self.figures = merged
+        self.figures_version += 1
+        for figure, position in zip(figures, positions):
+            self.log('attach', position, figure.NAME, list(figure.indices),
+                     figure.color.value, figure.WIDTH)
+
+    def move_vertices(self, indices, delta):
+        """Сдвигает вершины indices (без повторов) на вектор delta."""
+        delta = np.asarray(delta, dtype=float)
+        self.shift_vertices(indices, delta)
+        self.history.push(MoveVertices(indices, delta))
+
+    def shift_vertices(self, indices, delta):
+        """Сдвигает вершины без записи в историю."""
+        self.vertices.coords[indices] += delta
+        self.vertices.touch(indices)
+        if self.journal is not None:
+            self.log('move', indices.tolist(), *delta.tolist())
+
+    def transform_vertices(self, indices, matrix, center):
+        """Применяет к вершинам indices (без повторов) матрицу 3x3
+        относительно точки center: все вершины одним умножением."""
+        old = self.vertices.coords[indices]
+        new = (old - center) @ np.asarray(matrix, dtype=float).T + center
+        self.set_vertices(indices, new)
+        self.history.push(SetVertices(indices, old, new))
+
+    def set_vertices(self, indices, coords):
+        """Задает координаты вершин без записи в историю."""
+        self.vertices.coords[indices] = coords
+        self.vertices.touch(indices)
+        if self.journal is not None:
+            self.log('coords', indices.tolist(), coords.tolist())
+
+    def recolor_figures(self, figures, color):
+        figures = [obj for obj in figures if obj.color != color]
+        if figures:
+            old = [obj.color for obj in figures]
+            self.set_figure_colors(figures, [color] * len(figures))
+            self.history.push(RecolorFigures(figures, old, color))
+
+    def set_figure_colors(self, figures, colors):
+        for figure, color in zip(figures, colors):
+            figure.color = color
+        self.figures_version += 1
+        if self.journal is not None:
+            self.log('colors', self.figure_positions(figures),
+                     [color.value for color in colors])
+
+    def log(self, *entry):
+        if self.journal is not None:
+            self.journal.record(self, entry)
+
+    def undo(self):
+        return self.history.undo(self)
+
+    def redo(self):
+        return self.history.redo(self)
+
+    def add_figures(self, figures):
+        for figure_id, figure in enumerate(figures, self.next_figure_id):
+            figure.figure_id = figure_id
+        self.next_figure_id += len(figures)
+        self.figures.extend(figures)
+        self.figures_version += 1
+
     def add_point(self, vector, color=Color.GREEN):
         if isinstance(vector, Vector3):
-            self.figures.append(Point(vector.x, vector.y, vector.z, color))
+            self.add_figure(Point(vector.x, vector.y, vector.z, color,
+                                  store=self.vertices))
         elif isinstance(vector, Point):
-            self.figures.append(vector)
+            self.vertices.adopt(vector)
+            self.add_figure(vector)
 
     def add_line(self, point1, point2, color):
-        self.figures.append(Line(point1, point2, color))
+        self.vertices.adopt(point1)
+        self.add_figure(Line(point1, point2, color))
 
     def add_place(self, points, color):
-        self.figures.append(Place(points, color))
+        self.vertices.adopt(points[0])
+        self.add_figure(Place(points, color))
 
     def add_ellipse(self, point1, point2, color):
-        self.figures.append(Ellipse(point1, point2, color))
+        self.vertices.adopt(point1)
+        self.add_figure(Ellipse(point1, point2, color))
+
+    def weld(self, tolerance=CLOSE_TOLERANCE):
+        """Склеивает совпадающие вершины фигур в общие и выбрасывает
+        из хранилища неиспользуемые. Возвращает число склеенных вершин.
+
+        Номера вершин меняются, поэтому история отмены очищается."""
+        figures = self.figures
+        indices = np.fromiter(
+            (index for obj in figures for index in obj.indices),
+            dtype=np.intp)
+        store, renumber, merged = weld_store(self.vertices, indices,
+                                             tolerance)
+        for obj in figures:
+            obj.store = store
+            if isinstance(obj, Point):
+                obj.index = int(renumber[obj.index])
+            else:
+                obj.indices = renumber[obj.indices].tolist()
+        self.vertices = store
+        self.figures_version += 1
+        # Удаленные фигуры в истории ссылаются на старое хранилище
+        self.history.clear()
+        self.log('weld', tolerance)
+        return merged
+
+    def snapshot(self, previous=None):
+        """Согласованная копия состояния для отрисовки в другом потоке:
+        вершины копируются, фигуры разделяются с моделью.
+
+        previous - прошлый снимок, который больше никто не читает. Если
+        с тех пор фигуры не менялись, а вершины только сдвигались, его
+        хранилище и список фигур используются снова: копируются лишь
+        вершины с новыми счетчиками изменений."""
+        snapshot = copy.copy(self)
+        store = self.vertices
+        if previous is not None and previous.source is store and \
+                previous.figures_version == self.figures_version and \
+                previous.vertices.size == store.size:
+            snapshot.vertices = previous.vertices
+            snapshot.vertices.sync(store)
+            snapshot.figures = previous.figures
+        else:
+            snapshot.vertices = store.copy()
+            snapshot.figures = list(self.figures)
+        snapshot.source = store
+        snapshot.display_plate_basis = list(self.display_plate_basis)
+        return snapshot
+
+    def save_snapshot(self):
+        """Снимок для записи в другом потоке. Цвет, толщина и размеры
+        эллипсов меняются в GUI-потоке, поэтому фигуры тоже копируются,
+        но только массивами (binary_format.figure_table): объекты фигур
+        строит поток записи, если они нужны для текстового файла."""
+        snapshot = self.snapshot()
+        snapshot.table = binary_format.figure_table(self.figures)
+        snapshot.figures = None
+        return snapshot
+
+    def build_figures(self):
+        """Строит фигуры снимка save_snapshot по его таблице."""
+        if self.table is not None:
+            self.figures = self.figures_from_table(self.vertices,
+                                                   self.table)
+            self.table = None
 
     def display_vector(self, vector: Vector3) -> tuple:
         return (self.matrix_of_display * vector).to_tuple()
 
-    def update_display_matrix(self, ort_matrix: Matrix):
+    def display_vectors(self, coordinates) -> np.ndarray:
+        return self.project(coordinates)[0]
+
+    def project(self, coordinates):
+        """Проекция всех вершин сразу: (N, 3) -> координаты вида (N, 3)
+        и маска вершин перед ближней плоскостью (N,).
+
+        В перспективе x и y после деления на w уменьшаются с удалением,
+        z остается монотонной глубиной; точки плоскости экрана z = 0
+        проецируются так же, как в ортогональной проекции. Координаты
+        вершин за ближней плоскостью не имеют смысла.
+        """
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 3)
+        if not self.perspective:
+            return (coordinates @ self.display_matrix_array.T,
+                    np.ones(len(coordinates), dtype=bool))
+        homogeneous = self.homogeneous_vectors(coordinates)
+        w = homogeneous[:, 3]
+        front = w >= NEAR_PLANE
+        return homogeneous[:, :3] / np.maximum(w, NEAR_PLANE)[:, None], front
+
+    def homogeneous_vectors(self, coordinates) -> np.ndarray:
+        """Однородные координаты вида (N, 4) одним умножением на
+        матрицу 4x4."""
+        matrix = self.view_matrix()
+        return coordinates @ matrix[:, :3].T + matrix[:, 3]
+
+    def view_matrix(self) -> np.ndarray:
+        """Матрица 4x4 из мира в однородные координаты вида: поворот
+        вида, а в перспективе еще и проекция из точки наблюдателя,
+        стоящего на расстоянии d перед экраном (z = -d в координатах
+        вида): (x, y, z) -> (d x, d y, d z, z + d)."""
+        key = (self.display_version, self.perspective)
+        if self.view_transform is None or self.view_transform[0] != key:
+            matrix = np.eye(4)
+            matrix[:3, :3] = self.display_matrix_array
+            if self.perspective:
+                d = self.viewer_distance()
+                matrix = np.array(((d, 0, 0, 0), (0, d, 0, 0),
+                                   (0, 0, d, 0), (0, 0, 1, d))) @ matrix
+            self.view_transform = (key, matrix)
+        return self.view_transform[1]
+
+    def viewer_distance(self):
+        return Vector3.distance(self.viewer_position, Vector3(0, 0, 0))
+
+    def viewer_eye(self) -> np.ndarray:
+        """Положение наблюдателя в координатах мира."""
+        return -self.viewer_distance() * self.display_matrix_array[2]
+
+    def perspective_scales(self, depths) -> np.ndarray:
+        """Множители перспективы d / w для точек на глубине depths
+        (координата z вида до проекции); в ортогональной проекции - 1."""
+        depths = np.asarray(depths, dtype=float)
+        if not self.perspective:
+            return np.ones_like(depths)
+        d = self.viewer_distance()
+        return d / np.maximum(depths + d, NEAR_PLANE)
+
+    def in_front(self, depths) -> np.ndarray:
+        """Лежат ли точки на глубине depths перед ближней плоскостью."""
+        depths = np.asarray(depths, dtype=float)
+        if not self.perspective:
+            return np.ones(depths.shape, dtype=bool)
+        return depths + self.viewer_distance() >= NEAR_PLANE
+
+    def set_perspective(self, enabled):
+        self.perspective = enabled
+        # Все проекции считаются заново
+        self.display_version += 1
+
+    def update_display_matrix(self, ort_matrix: Matrix3):
         if not ort_matrix:
             a, b, c = self.display_plate_basis
-            self.matrix_of_display = Matrix(
-                3, 3, a.x, a.y, a.z, b.x, b.y, b.z, c.x, c.y, c.z)
+            self.matrix_of_display = Matrix3.from_rows(a, b, c)
+            self.display_matrix_array = np.array(
+                self.matrix_of_display.to_tuple(), dtype=float).reshape(3, 3)
+            self.display_version += 1
         else:
-            self.display_plate_basis[0] = Vector3(
-                *((ort_matrix * self.display_plate_basis[0]).to_tuple()))
-            self.display_plate_basis[1] = Vector3(
-                *((ort_matrix * self.display_plate_basis[1]).to_tuple()))
-            self.display_plate_basis[2] = Vector3(
-                *((ort_matrix * self.display_plate_basis[2]).to_tuple()))
+            # Базис поворачивается одним умножением и приводится обратно
+            # к ортонормированному, чтобы ошибки округления не копились
+            # от поворота к повороту
+            rotation = np.array(ort_matrix.to_tuple(),
+                                dtype=float).reshape(3, 3)
+            rows = orthonormalize(self.display_matrix_array @ rotation.T)
+            self.display_plate_basis = [Vector3(*row)
+                                        for row in rows.tolist()]
             self.update_display_matrix(None)
+            self.log('view', rows.tolist())
+
+    def rotate_view(self, angle, axis):
+        """Поворачивает вид на angle радиан вокруг оси axis: имени оси
+        из меню Rotates ('x', 'y', 'z') или вектора Vector3 в координатах
+        мира."""
+        if isinstance(axis, str):
+            self.update_display_matrix(Matrix3.rotation(axis, angle))
+        else:
+            self.update_display_matrix(Matrix3.axis_rotation(axis, angle))
 
     def save(self, file):
-        file.write(str(self))
+        file.writelines(self.text_lines())
+
+    def save_binary(self, file, generation=0, compact=True):
+        binary_format.write(self, file, generation, compact)
 
     def __str__(self):
-        info = f'''{json.dumps([vector.to_dict() for vector in self.basis])}
+        return ''.join(self.text_lines())
+
+    def text_lines(self):
+        """Текстовый файл по частям: заголовок, затем по строке на фигуру.
+
+        Вершины читаются из self.vertices, поэтому так же записывается
+        и снимок модели (Model.save_snapshot) в другом потоке.
+        """
+        yield f'''{json.dumps([vector.to_dict() for vector in self.basis])}
         {json.dumps(self.origin.to_dict())}
         {json.dumps([vector.to_dict() for vector in self.display_plate_basis])}
         '''
+        self.build_figures()
+        store = self.vertices
         for obj in self.figures:
-            info += f'{json.dumps(obj.to_dict())}\n'
-        return info
+            if obj.store is not store:
+                # Фигура снимка ссылается на хранилище модели
+                obj = copy.copy(obj)
+                obj.store = store
+            yield f'{json.dumps(obj.to_dict())}\n'
+
+    def open_binary(self, file):
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            buffer = file.read()
+        data = binary_format.read(buffer)
+
+        self.basis = [Vector3(*row) for row in data['basis'].tolist()]
+        self.display_plate_basis = [
+            Vector3(*row) for row in data['display_plate_basis'].tolist()]
+        x, y, z, color, width = data['origin']
+        self.origin = Point(x, y, z, Color(color), width)
+
+        # Массивы копируются в хранилище, после чего mmap можно закрыть
+        store = self.vertices
+        indices = data['indices'].astype(np.intp) + store.size
+        store.extend(data['coords'], data['vertex_colors'],
+                     data['vertex_widths'])
+        table = {name: data[name].copy()
+                 for name in ('kinds', 'colors', 'widths', 'offsets',
+                              'radii')}
+        table['indices'] = indices
+        del data
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+        figures = self.figures_from_table(store, table)
+        self.add_figures(figures)
+
+        self.update_display_matrix(None)
+
+    @staticmethod
+    def figures_from_table(store, table, start=0, stop=None):
+        """Фигуры start..stop таблицы binary_format.figure_table, вершины
+        которых лежат в store."""
+        offsets = table['offsets'][start:(stop if stop is None
+                                           else stop + 1)].tolist()
+        indices = table['indices'][offsets[0]:offsets[-1]].tolist()
+        base = offsets[0]
+        kinds = [binary_format.KINDS[kind]
+                 for kind in table['kinds'][start:stop].tolist()]
+        colors = table['colors'][start:stop].tolist()
+        widths = table['widths'][start:stop].tolist()
+        radii = table['radii'][start:stop].tolist()
+
+        # Создается много мелких объектов, и все они останутся жить:
+        # сборщик мусора на это время только мешает
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            figures = []
+            color_table = {color.value: color for color in Color}
+            classes = {'Line': Line, 'Place': Place, 'Ellipse': Ellipse}
+            for kind, begin, end, color, width, (rx, ry) in zip(
+                    kinds, offsets, offsets[1:], colors, widths, radii):
+                if kind == 'Point':
+                    figures.append(
+                        Point.from_index(store, indices[begin - base]))
+                    continue
+                figure = classes[kind].from_indices(
+                    store, indices[begin - base:end - base],
+                    color_table[color], width)
+                if kind == 'Ellipse':
+                    figure.set_move_info(None if rx != rx else int(rx),
+                                         None if ry != ry else int(ry))
+                figures.append(figure)
+        finally:
+            if collecting:
+                gc.enable()
+        return figures
 
     def open(self, file):
-        data = file.read()
-        lines = data.strip().split('\n')
+        # Журнал изменений (source/journal.py) ведется только для
+        # двоичных файлов: у текстового нет поколения основы
+        lines = iter(file)
+        self.set_header(self.parse_header(
+            [next(lines) for _ in range(HEADER_LINES)]))
+        # Открытие файла не попадает в историю
+        self.add_figures([self.parse_figure(line, self.vertices)
+                          for line in lines if line.strip()])
+        # В текстовом файле у каждой фигуры свои копии точек
+        self.weld()
+        self.update_display_matrix(None)
 
+    @staticmethod
+    def parse_header(lines):
+        """Базис, начало координат и базис экрана из первых строк файла."""
         basis_data = json.loads(lines[0])
-        self.basis = [Vector3(**v_dict) for v_dict in basis_data]
+        basis = [Vector3(**v_dict) for v_dict in basis_data]
 
         origin_data = json.loads(lines[1])
         del origin_data['name']
         origin_data['color'] = Color(origin_data['color'])
-        self.origin = Point(**origin_data)
+        origin = Point(**origin_data)
 
         display_plate_basis_data = json.loads(lines[2])
-        self.display_plate_basis = [Vector3(**v_dict) for
-                                    v_dict in display_plate_basis_data]
-
-        for line in lines[3:]:
-            figure_dict = json.loads(line)
-            figure_name = figure_dict.pop('name')
-            if figure_name == 'Point':
-                figure_dict['color'] = Color(figure_dict['color'])
-                figure = Point(**figure_dict)
-            elif figure_name == 'Line':
-                del figure_dict['start']['name']
-                color = Color(figure_dict['start']['color'])
-                figure_dict['start']['color'] = color
-                del figure_dict['end']['name']
-                color = Color(figure_dict['end']['color'])
-                figure_dict['end']['color'] = color
-
-                figure_dict['start'] = Point(**figure_dict['start'])
-                figure_dict['end'] = Point(**figure_dict['end'])
-
-                figure_dict['color'] = Color(figure_dict['color'])
-
-                figure = Line(**figure_dict)
-            elif figure_name == 'Place':
-                points = []
-                for point_data in figure_dict['points']:
-                    del point_data['name']
-                    point_data['color'] = Color(point_data['color'])
-                    point = Point(**point_data)
-                    points.append(point)
-
-                figure_dict['points'] = points
-                figure_dict['color'] = Color(figure_dict['color'])
-
-                figure = Place(**figure_dict)
-            elif figure_name == 'Ellipse':
-                del figure_dict['topLeft']['name']
-                color = Color(figure_dict['topLeft']['color'])
-                figure_dict['topLeft']['color'] = color
-                del figure_dict['bottomRight']['name']
-                color = Color(figure_dict['bottomRight']['color'])
-                figure_dict['bottomRight']['color'] = color
-
-                figure_dict['topLeft'] = Point(**figure_dict['topLeft'])
-                p = Point(**figure_dict['bottomRight'])
-                figure_dict['bottomRight'] = p
-
-                figure_dict['color'] = Color(figure_dict['color'])
-                rx = figure_dict.pop('rx')
-                ry = figure_dict.pop('ry')
-
-                figure = Ellipse(**figure_dict)
-                figure.set_move_info(rx, ry)
-            else:
-                raise ValueError(f"Unknown figure name: {figure_name}")
-            self.figures.append(figure)
+        display_plate_basis = [Vector3(**v_dict) for
+                               v_dict in display_plate_basis_data]
+        return basis, origin, display_plate_basis
 
+    def set_header(self, header):
+        self.basis, self.origin, self.display_plate_basis = header
         self.update_display_matrix(None)
 
+    @staticmethod
+    def parse_figure(line, store):
+        figure_dict = json.loads(line)
+        figure_name = figure_dict.pop('name')
+        if figure_name == 'Point':
+            figure_dict['color'] = Color(figure_dict['color'])
+            figure = Point(**figure_dict, store=store)
+        elif figure_name == 'Line':
+            del figure_dict['start']['name']
+            color = Color(figure_dict['start']['color'])
+            figure_dict['start']['color'] = color
+            del figure_dict['end']['name']
+            color = Color(figure_dict['end']['color'])
+            figure_dict['end']['color'] = color
+
+            figure_dict['start'] = Point(**figure_dict['start'],
+                                         store=store)
+            figure_dict['end'] = Point(**figure_dict['end'], store=store)
+
+            figure_dict['color'] = Color(figure_dict['color'])
+
+            figure = Line(**figure_dict)
+        elif figure_name == 'Place':
+            points = []
+            for point_data in figure_dict['points']:
+                del point_data['name']
+                point_data['color'] = Color(point_data['color'])
+                point = Point(**point_data, store=store)
+                points.append(point)
+
+            figure_dict['points'] = points
+            figure_dict['color'] = Color(figure_dict['color'])
+
+            figure = Place(**figure_dict)
+        elif figure_name == 'Ellipse':
+            del figure_dict['topLeft']['name']
+            color = Color(figure_dict['topLeft']['color'])
+            figure_dict['topLeft']['color'] = color
+            del figure_dict['bottomRight']['name']
+            color = Color(figure_dict['bottomRight']['color'])
+            figure_dict['bottomRight']['color'] = color
+
+            figure_dict['topLeft'] = Point(**figure_dict['topLeft'],
+                                           store=store)
+            p = Point(**figure_dict['bottomRight'], store=store)
+            figure_dict['bottomRight'] = p
+
+            figure_dict['color'] = Color(figure_dict['color'])
+            rx = figure_dict.pop('rx')
+            ry = figure_dict.pop('ry')
+
+            figure = Ellipse(**figure_dict)
+            figure.set_move_info(rx, ry)
+        else:
+            raise ValueError(f"Unknown figure name: {figure_name}")
+        return figure
+
+    def merge(self, figures, store):
+        """Дописывает фигуры, подготовленные в другом потоке (ModelLoader):
+        вершины store добавляются в конец хранилища модели, а фигуры уже
+        ссылаются на него с итоговыми номерами вершин и фигур."""
+        size = store.size
+        self.vertices.extend(store.coords[:size], store.colors[:size],
+                             store.widths[:size])
+        self.figures.extend(figures)
+        self.figures_version += 1
+
+    def replace_figures(self, figures, store):
+        """Заменяет все фигуры и хранилище готовыми (например, склеенными
+        в другом потоке). Номера вершин меняются, поэтому история отмены
+        очищается."""
+        self.vertices = store
+        self.figures = figures
+        self.figures_version += 1
+        self.history.clear()
+
     @staticmethod
     def newell_algorithm(vertices):
         # Initialize normal vector
@@ -207,3 +684,18 @@ class Model:
         # тут должно быть разделение плоскостей и повторная проверка
 
         return True
+
+
+def load(filename):
+    """Открывает файл модели любого формата; к двоичному файлу
+    применяется его журнал изменений."""
+    model = Model()
+    with open(filename, 'rb') as file:
+        binary = binary_format.is_binary(file.read(len(binary_format.MAGIC)))
+        file.seek(0)
+        if binary:
+            model.open_binary(file)
+            replay_journal(model, filename)
+        else:
+            model.open(io.TextIOWrapper(file, encoding='utf8'))
+    return model
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+class VertexStore:
+    """Колоночное хранилище вершин: координаты, цвета и толщины
+    лежат в непрерывных массивах, вершина задается целым индексом."""
+
+    def __init__(self, capacity=16):
+        self.coords = np.zeros((capacity, 3))
+        self.colors = np.zeros(capacity, dtype=np.uint8)
+        self.widths = np.zeros(capacity, dtype=np.uint16)
+        # Счетчики изменений вершин: увеличиваются при каждом сдвиге
+        self.versions = np.zeros(capacity, dtype=np.uint32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def reserve(self, capacity):
+        if capacity <= len(self.coords):
+            return
+        coords = np.zeros((capacity, 3))
+        coords[:self.size] = self.coords[:self.size]
+        colors = np.zeros(capacity, dtype=np.uint8)
+        colors[:self.size] = self.colors[:self.size]
+        widths = np.zeros(capacity, dtype=np.uint16)
+        widths[:self.size] = self.widths[:self.size]
+        versions = np.zeros(capacity, dtype=np.uint32)
+        versions[:self.size] = self.versions[:self.size]
+        self.coords, self.colors, self.widths = coords, colors, widths
+        self.versions = versions
+
+    def add(self, x, y, z, color=0, width=0) -> int:
+        if self.size == len(self.coords):
+            self.reserve(max(2 * self.size, 16))
+        index = self.size
+        self.coords[index] = (x, y, z)
+        self.colors[index] = color
+        self.widths[index] = width
+        self.versions[index] = 0
+        self.size += 1
+        return index
+
+    def extend(self, coords, colors, widths) -> np.ndarray:
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        count = len(coords)
+        if self.size + count > len(self.coords):
+            self.reserve(max(2 * self.size, self.size + count, 16))
+        start = self.size
+        self.coords[start:start + count] = coords
+        self.colors[start:start + count] = colors
+        self.widths[start:start + count] = widths
+        self.versions[start:start + count] = 0
+        self.size += count
+        return np.arange(start, start + count)
+
+    def adopt(self, point) -> int:
+        """Переносит вершину точки в это хранилище и перепривязывает точку."""
+        if point.store is not self:
+            old_store, old_index = point.store, point.index
+            point.index = self.add(*old_store.coords[old_index],
+                                   old_store.colors[old_index],
+                                   old_store.widths[old_index])
+            point.store = self
+        return point.index
+
+    def move(self, indices, delta):
+        indices = np.unique(np.asarray(indices, dtype=np.intp))
+        self.coords[indices] += delta
+        self.versions[indices] += 1
+
+    def touch(self, indices):
+        self.versions[indices] += 1
+
+    def copy(self):
+        store = VertexStore(max(self.size, 1))
+        store.coords[:self.size] = self.coords[:self.size]
+        store.colors[:self.size] = self.colors[:self.size]
+        store.widths[:self.size] = self.widths[:self.size]
+        store.versions[:self.size] = self.versions[:self.size]
+        store.size = self.size
+        return store
+
+    def sync(self, source):
+        """Обновляет копию source того же размера: переносятся только
+        вершины, счетчики изменений которых отличаются."""
+        size = self.size
+        rows = np.flatnonzero(self.versions[:size] != source.versions[:size])
+        self.coords[rows] = source.coords[rows]
+        self.colors[rows] = source.colors[rows]
+        self.widths[rows] = source.widths[rows]
+        self.versions[rows] = source.versions[rows]
+
+    def subset(self, indices):
+        """Новое хранилище из выбранных вершин (в заданном порядке).
+
+        Номера вершин меняются, поэтому счетчики изменений всех вершин
+        делаются больше прежних: закэшированные по номерам данные
+        считаются устаревшими.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        store = VertexStore(max(len(indices), 1))
+        store.extend(self.coords[indices], self.colors[indices],
+                     self.widths[indices])
+        if self.size:
+            store.versions[:] = self.versions[:self.size].max() + 1
+        return store
+
+    def used_coords(self) -> np.ndarray:
+        return self.coords[:self.size]
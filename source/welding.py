@@ -0,0 +1,159 @@
+import numpy as np
+
+from .figures import CLOSE_TOLERANCE
+
+# Ячейка: три координаты и признак вершины (цвет и толщина)
+CELL = [('x', '<i8'), ('y', '<i8'), ('z', '<i8'), ('kind', '<i8')]
+
+# Множители хэша ячейки (большие нечетные числа)
+HASH = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F,
+                 0x165667B19E3779F9, 0x27D4EB2F165667C5], dtype=np.uint64)
+
+# Соседние ячейки в одну сторону: пара ячеек проверяется один раз.
+# Признак у соседей тот же
+NEIGHBOURS = np.array([(dx, dy, dz, 0)
+                       for dx in (-1, 0, 1)
+                       for dy in (-1, 0, 1)
+                       for dz in (-1, 0, 1)
+                       if (dx, dy, dz) > (0, 0, 0)], dtype=np.int64)
+
+
+def cell_hash(cells):
+    return (cells.astype(np.uint64) * HASH).sum(axis=1, dtype=np.uint64)
+
+
+class CellIndex:
+    """Поиск номера ячейки по ее координатам.
+
+    Ячейки ищутся по 64-битному хэшу; при совпадении хэшей разных ячеек
+    (почти невозможном) - сравнением самих координат.
+    """
+
+    def __init__(self, cells):
+        self.cells = cells
+        codes = cell_hash(cells)
+        self.order = np.argsort(codes)
+        self.codes = codes[self.order]
+        self.exact = not np.any(self.codes[1:] == self.codes[:-1])
+        if not self.exact:
+            self.records = np.ascontiguousarray(cells).view(CELL).reshape(-1)
+
+    def find(self, targets):
+        """Номера ячеек targets; -1 - такой ячейки нет."""
+        if self.exact:
+            position = np.minimum(np.searchsorted(self.codes,
+                                                  cell_hash(targets)),
+                                  len(self.codes) - 1)
+            found = self.order[position]
+        else:
+            records = np.ascontiguousarray(targets).view(CELL).reshape(-1)
+            found = np.minimum(np.searchsorted(self.records, records),
+                               len(self.cells) - 1)
+        return np.where(np.all(self.cells[found] == targets, axis=1),
+                        found, -1)
+
+
+def cell_pairs(starts, counts, cell, other):
+    """Все пары вершин (a, b), где a из ячейки cell, b из ячейки other
+    (номера в порядке сортировки по ячейкам), и номер пары ячеек."""
+    sizes = counts[cell] * counts[other]
+    owners = np.repeat(np.arange(len(cell)), sizes)
+    local = np.arange(len(owners)) - np.repeat(np.cumsum(sizes) - sizes,
+                                               sizes)
+    width = counts[other][owners]
+    return (starts[cell][owners] + local // width,
+            starts[other][owners] + local % width, owners)
+
+
+def weld_vertices(coords, tolerance=CLOSE_TOLERANCE, kinds=None):
+    """Склеивание совпадающих вершин через пространственный хэш.
+
+    Пространство делится на кубические ячейки со стороной tolerance:
+    вершины одной ячейки совпадают (как в Point.close_equal) сразу, а
+    каждая вершина сравнивается со всеми вершинами соседних ячеек.
+    Группы - связные компоненты отношения "близки", поэтому от порядка
+    вершин не зависят. Вершины с разными kinds (например, цвет и
+    толщина) не склеиваются. Возвращает для каждой вершины номер
+    вершины-представителя своей группы (наименьший номер в группе).
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+    count = len(coords)
+    if not count:
+        return np.zeros(0, dtype=np.intp)
+    if kinds is None:
+        kinds = np.zeros(count, dtype=np.int64)
+
+    # Одинаковые вершины сравниваются с соседями один раз
+    keys = np.concatenate(
+        (np.floor(coords / tolerance).astype(np.int64),
+         np.asarray(kinds, dtype=np.int64).reshape(-1, 1)), axis=1)
+    records = np.ascontiguousarray(
+        np.concatenate((np.ascontiguousarray(coords).view(np.int64), keys),
+                       axis=1))
+    _, distinct, inverse = np.unique(records, axis=0, return_index=True,
+                                     return_inverse=True)
+    inverse = inverse.reshape(-1)
+    points = coords[distinct]
+    keys = keys[distinct]
+
+    # Вершины по ячейкам
+    order = np.lexsort(keys.T[::-1])
+    keys = keys[order]
+    points = points[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(keys)))
+    cells = keys[starts]
+    cell_of = np.cumsum(first) - 1
+
+    # Пары ячеек, в которых нашлась пара близких вершин
+    index = CellIndex(cells)
+    pairs = []
+    for offset in NEIGHBOURS:
+        other = index.find(cells + offset)
+        cell = np.flatnonzero(other >= 0)
+        other = other[cell]
+        a, b, owners = cell_pairs(starts, counts, cell, other)
+        close = np.all(np.abs(points[a] - points[b]) < tolerance, axis=1)
+        close = np.unique(owners[close])
+        pairs.append((cell[close], other[close]))
+
+    # Объединение ячеек в группы; таких пар мало, поэтому обычный цикл
+    parent = np.arange(len(cells))
+    for cell, other in pairs:
+        for a, b in zip(cell.tolist(), other.tolist()):
+            while parent[a] != a:
+                a = parent[a]
+            while parent[b] != b:
+                b = parent[b]
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            break
+        parent = grandparent
+
+    # Группа каждой исходной вершины и наименьший номер в группе
+    position = np.empty(len(order), dtype=np.intp)
+    position[order] = np.arange(len(order))
+    groups = parent[cell_of[position[inverse]]]
+    representative = np.full(len(cells), count, dtype=np.intp)
+    np.minimum.at(representative, groups, np.arange(count))
+    return representative[groups]
+
+
+def weld_store(store, indices, tolerance=CLOSE_TOLERANCE):
+    """Склеивает вершины хранилища, на которые ссылаются фигуры
+    (indices - все их номера вершин). Вершины с разными цветом или
+    толщиной не склеиваются. Возвращает новое хранилище без
+    неиспользуемых вершин, новые номера по старым и число склеенных
+    вершин."""
+    used = np.unique(indices)
+    kinds = (store.colors[used].astype(np.int64) << 16) | store.widths[used]
+    representatives = weld_vertices(store.coords[used], tolerance, kinds)
+    kept = np.unique(representatives)
+    renumber = np.zeros(store.size, dtype=np.intp)
+    renumber[used] = np.searchsorted(kept, representatives)
+    return store.subset(used[kept]), renumber, len(used) - len(kept)